@@ -1,59 +1,194 @@
 # backend/drs-llm/clm_api/app.py
 
 from contextlib import asynccontextmanager
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, JSONResponse
 
-from core.settings import BaseAppSettings
+from core.settings import get_settings
 from core.logging_setup import setup_logging
 from core.github_client import fetch_commit_message_and_diff
-from core.diff_utils import diff_to_structured_xml
-from core.runtime import preload_singleton
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from core.runtime import (InferenceExecutor, startup_profile, start_model, run_warmup, estimate_tokens, token_budget,
+                          make_residency)
+from core.profiling import capture_profile, check_debug_token
+from core.timing import ServerTimingMiddleware, stage, count, stage_stats
+from core.streaming import stream_ndjson
+from core.jobs import make_job_runner, make_jobs_router
 
 from .schemas import PredictRequest, PredictBySHARequest
 from .prompts import SYSTEM_PROMPT, USER_TEMPLATE
 from .model_clm import make_singleton
 
-settings = BaseAppSettings()
+settings = get_settings()
 setup_logging()
 log = logging.getLogger(__name__)
 
 gen_singleton = make_singleton(settings)
+residency = make_residency(settings, gen_singleton, "clm")
+executor = InferenceExecutor(residency=residency)
+
+def warmup_input(n: int) -> str:
+    """Synthetic model input of roughly n tokens, built through the real preprocessing path."""
+    return build_prompt("Warm-up commit", synthetic_diff(n))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     log.info("Initializing CLM generator (raw text)...")
-    await preload_singleton(gen_singleton)
-    log.info("CLM generator ready.")
+    lengths = [min(n, settings.max_length) for n in settings.warmup_lengths]
+    startup = asyncio.create_task(start_model(
+        gen_singleton,
+        lambda gen: run_warmup(gen.infer_text, warmup_input, lengths),
+    ))
+    job_runner.start()
+    residency.start()
     yield
+    residency.stop()
+    job_runner.stop()
+    startup.cancel()
 
 app = FastAPI(title="DRS-LLM API (CLM Raw Text)", version="0.1.0", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(ServerTimingMiddleware)
+# Routes live on a router so the combined service (api_combined) can mount them under a prefix
+router = APIRouter()
 
-@app.get("/health")
+@router.get("/health")
 def health():
-    return {"status": "ok", "model_id": settings.model_id}
+    return {
+        "status": "ok",
+        "model_id": settings.model_id,
+        "startup": startup_profile.as_dict(),
+        "inference": executor.stats(),
+        "jobs": job_runner.stats(),
+        "residency": residency.stats(),
+        "decoding": _decoding_stats(),
+    }
+
+def _decoding_stats():
+    """Generated tokens/s and, with a draft model, its acceptance rate (HFGenerator only)."""
+    if not startup_profile.ready:
+        return None
+    gen = gen_singleton.get()
+    return gen.stats() if hasattr(gen, "stats") else None
+
+@router.get("/ready")
+def ready():
+    """Readiness probe: 503 until the model is loaded and warmed up."""
+    if not startup_profile.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    # Released models still serve; the gateway prefers replicas whose model is resident
+    return {"ready": True, "residency": residency.state}
+
+@router.get("/debug/timings")
+def debug_timings():
+    """Per-route percentiles of request stages (ms) and input sizes over the recent window."""
+    return stage_stats.summary()
+
+@router.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds),
+    format: str = Query("zip", description="zip | chrome | collapsed | summary"),
+):
+    """Profile inference for `seconds`: torch.profiler trace, Python stack samples, per-request peak memory."""
+    check_debug_token(request, settings.debug_token)
+    return await capture_profile(seconds, format, name="clm")
+
+
+def generation_cost(prompt: str, max_new_tokens: int) -> int:
+    """Token budget cost of generating for `prompt`: the prompt plus the tokens it may add."""
+    return estimate_tokens(prompt, settings.max_length) + max_new_tokens
+
+def generation_limits(req) -> Tuple[int, Optional[float]]:
+    """(max_new_tokens, max_time_s or None) for a request: what it asked for, capped by the server's limits."""
+    max_new_tokens = min(req.max_new_tokens or settings.clm_max_new_tokens, settings.clm_max_new_tokens)
+    times = [t for t in (req.max_time_s, settings.clm_max_time_s) if t]
+    return max_new_tokens, (min(times) if times else None)
 
+def _generation_headers(result) -> dict:
+    return {"X-DRS-New-Tokens": str(result.new_tokens), "X-DRS-Tokens-Saved": str(result.tokens_saved),
+            "X-DRS-Stop-Reason": result.stop_reason}
+
+async def _explain(request: Request, req, prompt: str) -> PlainTextResponse:
+    gen = gen_singleton.get()
+    max_new_tokens, max_time_s = generation_limits(req)
+    result = await executor.run(request, gen.infer, prompt, max_new_tokens, max_time_s,
+                                cost=generation_cost(prompt, max_new_tokens))
+    return PlainTextResponse(result.text, headers=_generation_headers(result))
 
 def build_prompt(commit_message: str, diff: str) -> str:
     structured = diff_to_structured_xml(diff, commit_message, strict=False)
     user = USER_TEMPLATE.format(structured_diff=structured)
     return SYSTEM_PROMPT + "\n\n" + user
 
-@app.post("/predict", response_class=PlainTextResponse)
-def predict(req: PredictRequest):
-    prompt = build_prompt(req.commit_message, req.code_diff)
-    text = gen_singleton.get().infer_text(prompt)
-    return text
+@router.post("/predict", response_class=PlainTextResponse)
+async def predict(req: PredictRequest, request: Request):
+    startup_profile.require_ready()
+    count("input_bytes", len(req.code_diff.encode()) + len(req.commit_message.encode()))
+    with stage("preprocess"):
+        prompt = await asyncio.to_thread(build_prompt, req.commit_message, req.code_diff)
+    return await _explain(request, req, prompt)
 
-@app.post("/predict_by_sha", response_class=PlainTextResponse)
-def predict_by_sha(req: PredictBySHARequest):
-    msg, diff = fetch_commit_message_and_diff(req.repo, req.sha)
+@router.post("/predict_by_sha", response_class=PlainTextResponse)
+async def predict_by_sha(req: PredictBySHARequest, request: Request):
+    startup_profile.require_ready()
+    with stage("github"):
+        msg, diff = await asyncio.to_thread(fetch_commit_message_and_diff, req.repo, req.sha)
+    count("input_bytes", len(diff.encode()) + len(msg.encode()))
     try:
-        prompt = build_prompt(msg, diff)
+        with stage("preprocess"):
+            prompt = await asyncio.to_thread(build_prompt, msg, diff)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e)) from e
-    text = gen_singleton.get().infer_text(prompt)
-    return text
\ No newline at end of file
+    return await _explain(request, req, prompt)
+
+
+async def _predict_many(client, reqs: List[PredictRequest]) -> list:
+    for r in reqs:
+        count("input_bytes", len(r.code_diff.encode()) + len(r.commit_message.encode()))
+    with stage("preprocess"):
+        prompts = await asyncio.to_thread(lambda: [build_prompt(r.commit_message, r.code_diff) for r in reqs])
+    gen = gen_singleton.get()
+    limits = [generation_limits(r) for r in reqs]
+    costs = [generation_cost(p, n) for p, (n, _) in zip(prompts, limits)]
+    if not hasattr(gen, "infer_many"):
+        return [(await executor.run(client, gen.infer, p, n, t, cost=c))._asdict()
+                for p, (n, t), c in zip(prompts, limits, costs)]
+    results: list = [None] * len(prompts)
+    for group in token_budget.batches(costs):
+        outs = await executor.run(client, gen.infer_many, [prompts[i] for i in group],
+                                  [limits[i][0] for i in group], [limits[i][1] for i in group],
+                                  cost=max(costs[i] for i in group) * len(group))
+        for i, out in zip(group, outs):
+            results[i] = out._asdict()
+    return results
+
+@router.post("/predict_stream")
+async def predict_stream(request: Request):
+    """
+    NDJSON in, NDJSON out: one PredictRequest per input line, one {"index": n, "text", "new_tokens",
+    "tokens_saved", "stop_reason"} (or {"index": n, "error", "status"}) per output line, written as
+    each batch finishes.
+    """
+    startup_profile.require_ready()
+    return stream_ndjson(
+        request, PredictRequest, _predict_many,
+        batch_size=settings.stream_batch_size,
+        batch_wait_s=settings.stream_batch_wait_ms / 1000.0,
+        max_pending=settings.stream_max_pending,
+        max_line_bytes=settings.stream_max_line_bytes,
+    )
+
+
+job_runner = make_job_runner(settings, "clm", executor, PredictRequest, _predict_many)
+router.include_router(make_jobs_router(
+    job_runner, max_items=settings.jobs_max_items, max_queued=settings.jobs_max_queued,
+    max_wait_s=settings.jobs_max_wait_s,
+))
+
+
+app.include_router(router)
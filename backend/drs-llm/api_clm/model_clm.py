@@ -1,30 +1,59 @@
 import logging
-from transformers import AutoTokenizer, pipeline
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList, pipeline
 from core.settings import BaseAppSettings
-from core.runtime import SingletonFactory, model_kwargs_from_settings, limited_infer
+from core.runtime import SingletonFactory, model_kwargs_from_settings, limited_infer, startup_profile, torch_dtype
+from core import timing
 
 log = logging.getLogger(__name__)
 
+class Generation(NamedTuple):
+    text: str
+    new_tokens: int
+    # Budget left unused because decoding ended at a stop string or EOS
+    tokens_saved: int
+    # "stop_string" | "eos" | "max_new_tokens" | "max_time"
+    stop_reason: str
+
+
 class HFGenerator:
     def __init__(self, settings: BaseAppSettings):
-        tok = AutoTokenizer.from_pretrained(
-            settings.model_id, use_fast=True, trust_remote_code=True
-        )
+        with startup_profile.phase("tokenizer"):
+            tok = AutoTokenizer.from_pretrained(
+                settings.model_id, use_fast=True, trust_remote_code=True
+            )
 
         tok.truncation_side = "right"
         tok.model_max_length = settings.max_length
+        # Batched generation (infer_batch) pads prompts on the left; single prompts are unpadded
+        tok.padding_side = "left"
+        if tok.pad_token is None:
+            tok.pad_token = tok.eos_token
 
         gen_kwargs = model_kwargs_from_settings(settings, for_4bit_quant=True)
         log.info("Setting up text-generation pipeline (raw text mode)")
-        self.pipe = pipeline(
-            task="text-generation",
-            model=settings.model_id,
-            tokenizer=tok,
-            model_kwargs=gen_kwargs,
-        )
+        # Includes the weight load: the pipeline is given a model path
+        with startup_profile.phase("pipeline"):
+            self.pipe = pipeline(
+                task="text-generation",
+                model=settings.model_id,
+                tokenizer=tok,
+                model_kwargs=gen_kwargs,
+            )
         self.tok = tok
+        self.draft = _load_draft(settings, self.pipe.model) if settings.draft_model_id else None
+        self.decode_stats = DecodeStats(assisted=self.draft is not None)
+        # Forward passes per generate() call, counted per thread (limited_infer may run several at once)
+        self._forwards = threading.local()
+        self.pipe.model.register_forward_hook(self._count_forward("target"))
+        if self.draft is not None:
+            self.draft.register_forward_hook(self._count_forward("draft"))
+        self.stop_strings = list(settings.clm_stop_strings)
         self.generate_params = dict(
-            max_new_tokens=100,
+            max_new_tokens=settings.clm_max_new_tokens,
             # temperature=0.3,
             # top_p=0.9,
             do_sample=False,
@@ -33,17 +62,255 @@ class HFGenerator:
             truncation=True,
             return_full_text=False
         )
+        if self.draft is not None:
+            self.generate_params["assistant_model"] = self.draft
+
+    def _count_forward(self, which: str):
+        def hook(_module, _args, _output):
+            setattr(self._forwards, which, getattr(self._forwards, which, 0) + 1)
+        return hook
+
+    def stats(self) -> dict:
+        return self.decode_stats.as_dict()
+
+    def residency_modules(self) -> dict:
+        modules = {"model": self.pipe.model}
+        if self.draft is not None:
+            modules["draft"] = self.draft
+        return modules
+
+    def _prompt_lengths(self, prompts: List[str]) -> List[int]:
+        # The pipeline tokenizes internally; this extra pass gives the prompt lengths for the token counts
+        with timing.stage("tokenize"):
+            lengths = [len(ids) for ids in self.tok(prompts, truncation=True, max_length=self.tok.model_max_length)["input_ids"]]
+        timing.count("input_tokens", sum(lengths))
+        return lengths
+
+    def _generate(self, prompt: str, max_new_tokens: Optional[int] = None,
+                  max_time_s: Optional[float] = None) -> Generation:
+        [n_tokens] = self._prompt_lengths([prompt])
+        limit = max_new_tokens or self.generate_params["max_new_tokens"]
+        control = _StopControl(self.tok, n_tokens, [limit], [max_time_s], self.stop_strings)
+        self._forwards.target = self._forwards.draft = 0
+        t0 = time.perf_counter()
+        with timing.stage("generate"):
+            out = self.pipe(prompt, stopping_criteria=StoppingCriteriaList([control]),
+                            **{**self.generate_params, "max_new_tokens": limit})
+        new_tokens = max(0, control.value - n_tokens)
+        self.decode_stats.record(new_tokens, time.perf_counter() - t0, self._forwards.target, self._forwards.draft)
+        if self.draft is not None:
+            timing.count("draft_accepted", max(0, new_tokens - self._forwards.target))
+        [result] = control.results([out[0].get("generated_text", "")], [prompt])
+        return self._finish(result)
+
+    def _generate_many(self, prompts: List[str], max_new_tokens: Optional[List[Optional[int]]] = None,
+                       max_time_s: Optional[List[Optional[float]]] = None) -> List[Generation]:
+        """One padded generate() over all prompts; each row still stops at its own limits.
+        Greedy results can differ from single-prompt generation in the last ulp."""
+        max_new_tokens = max_new_tokens or [None] * len(prompts)
+        max_time_s = max_time_s or [None] * len(prompts)
+        if self.draft is not None:
+            # Assisted generation only supports a batch of one
+            return [self._generate(p, n, t) for p, n, t in zip(prompts, max_new_tokens, max_time_s)]
+        lengths = self._prompt_lengths(prompts)
+        limits = [n or self.generate_params["max_new_tokens"] for n in max_new_tokens]
+        # Prompts are left-padded to the longest, so new tokens start after max(lengths)
+        control = _StopControl(self.tok, max(lengths), limits, max_time_s, self.stop_strings)
+        with timing.stage("generate"):
+            outs = self.pipe(prompts, batch_size=len(prompts), stopping_criteria=StoppingCriteriaList([control]),
+                             **{**self.generate_params, "max_new_tokens": max(limits)})
+        results = control.results([out[0].get("generated_text", "") for out in outs], prompts)
+        return [self._finish(r) for r in results]
+
+    def _finish(self, result: Generation) -> Generation:
+        self.decode_stats.record_stop(result)
+        timing.count("new_tokens", result.new_tokens)
+        timing.count("tokens_saved", result.tokens_saved)
+        return result
+
+    @limited_infer
+    def infer(self, prompt: str, max_new_tokens: Optional[int] = None, max_time_s: Optional[float] = None) -> Generation:
+        """Explanation for one prompt, ending at a stop string, EOS or the given limits (server defaults when None)."""
+        return self._generate(prompt, max_new_tokens, max_time_s)
+
+    @limited_infer
+    def infer_many(self, prompts: List[str], max_new_tokens: Optional[List[Optional[int]]] = None,
+                   max_time_s: Optional[List[Optional[float]]] = None) -> List[Generation]:
+        return self._generate_many(prompts, max_new_tokens, max_time_s)
 
     @limited_infer
     def infer_text(self, prompt: str) -> str:
-        out = self.pipe(prompt, **self.generate_params)
-        text = out[0].get("generated_text", "")
-        # Remove the prompt prefix if present
-        if text.startswith(prompt):
-            text = text[len(prompt):]
-        # Strip out <ANSWER> and </ANSWER> tags if they exist
-        text = text.replace("<ANSWER>", "").replace("</ANSWER>", "")
-        return text.strip()
+        return self._generate(prompt).text
+
+    @limited_infer
+    def infer_batch(self, prompts: List[str]) -> List[str]:
+        return [r.text for r in self._generate_many(prompts)]
+
+
+def _load_draft(settings: BaseAppSettings, target):
+    """
+    Small causal LM for assisted (speculative) decoding: it proposes up to draft_num_tokens
+    tokens per step and the main model checks them all in one forward pass, keeping the longest
+    prefix it agrees with plus its own next token. Under greedy decoding the output is the
+    main model's own; only the number of main-model forward passes changes.
+    """
+    kwargs = model_kwargs_from_settings(settings, for_4bit_quant=False)
+    if kwargs["device_map"] != "cpu":
+        # The draft is not quantized; without this the 4-bit settings would load it in float32
+        # rather than the target's compute dtype
+        kwargs["torch_dtype"] = torch_dtype(settings.dtype)
+    with startup_profile.phase("draft"):
+        draft = AutoModelForCausalLM.from_pretrained(settings.draft_model_id, **kwargs).eval()
+    if draft.config.vocab_size != target.config.vocab_size:
+        raise ValueError(
+            f"Draft model {settings.draft_model_id} has a vocabulary of {draft.config.vocab_size} tokens, "
+            f"the main model {target.config.vocab_size}; assisted decoding needs the same tokenizer"
+        )
+    draft.generation_config.num_assistant_tokens = settings.draft_num_tokens
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    draft.generation_config.assistant_confidence_threshold = settings.draft_confidence_threshold
+    log.info("Assisted decoding with draft model %s (%d tokens per step)", settings.draft_model_id, settings.draft_num_tokens)
+    return draft
+
+
+class _StopControl(StoppingCriteria):
+    """
+    Ends each row of a (possibly batched) generate() at the first stop string or EOS, at its own
+    token limit, or once its time limit has passed since generation started; records why and
+    after how many new tokens. Rows that finish early are padded by generate() until all are done.
+    Only the tokens added since the last step (plus enough earlier ones to hold a stop string)
+    are decoded, so the check costs little next to a forward pass. Also remembers the sequence
+    length after the last step (value), for the decode statistics.
+    """
+    def __init__(self, tok, prompt_len: int, limits: List[int], max_time_s: List[Optional[float]],
+                 stop_strings: Sequence[str]):
+        self._tok = tok
+        self._prompt_len = prompt_len
+        self._limits = limits
+        self._max_time_s = max_time_s
+        self._stop_strings = [s for s in stop_strings if s]
+        # A token decodes to at least one character, except byte pieces of one character
+        self._overlap = max((len(s) for s in self._stop_strings), default=0) + 4
+        eos = tok.eos_token_id
+        self._eos = set(eos if isinstance(eos, list) else [eos]) - {None}
+        self._t0 = time.perf_counter()
+        self._seen = 0
+        self.value = prompt_len
+        self.reasons: List[Optional[str]] = [None] * len(limits)
+        self.new_tokens = [0] * len(limits)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.value = input_ids.shape[-1]
+        new = self.value - self._prompt_len
+        added, self._seen = new - self._seen, new
+        elapsed = time.perf_counter() - self._t0
+        # One device->host copy per step
+        tails = input_ids[:, -min(new, added + self._overlap):].tolist()
+        for row, tail in enumerate(tails):
+            if self.reasons[row] is not None:
+                continue
+            reason = None
+            if self._stop_strings:
+                text = self._tok.decode(tail, skip_special_tokens=True)
+                if any(s in text for s in self._stop_strings):
+                    reason = "stop_string"
+            if reason is None and self._eos.intersection(tail[-added:]):
+                reason = "eos"
+            if reason is None and new >= self._limits[row]:
+                reason = "max_new_tokens"
+            if reason is None and self._max_time_s[row] and elapsed >= self._max_time_s[row]:
+                reason = "max_time"
+            if reason is not None:
+                self.reasons[row], self.new_tokens[row] = reason, new
+        done = [r is not None for r in self.reasons]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def results(self, texts: List[str], prompts: List[str]) -> List[Generation]:
+        out = []
+        for row, (text, prompt) in enumerate(zip(texts, prompts)):
+            reason = self.reasons[row]
+            new_tokens = self.new_tokens[row]
+            if reason is None:
+                # generate() ended on its own (an EOS id from the generation config, or its length limit)
+                new_tokens = max(0, self.value - self._prompt_len)
+                reason = "max_new_tokens" if new_tokens >= self._limits[row] else "eos"
+            saved = self._limits[row] - new_tokens if reason in ("stop_string", "eos") else 0
+            out.append(Generation(clean_generated_text(text, prompt, self._stop_strings), new_tokens, saved, reason))
+        return out
+
+
+class DecodeStats:
+    """
+    Cumulative decode counters for /health. With a draft model, every main-model forward
+    pass yields the accepted draft tokens plus one of its own, so accepted = new tokens -
+    main forwards, and each draft forward pass proposes one token.
+    """
+    def __init__(self, assisted: bool):
+        self.assisted = assisted
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.new_tokens = 0
+        self.seconds = 0.0
+        self.target_forwards = 0
+        self.draft_forwards = 0
+        self.accepted = 0
+        # Per explanation, batched or not
+        self.explanations = 0
+        self.explanation_tokens = 0
+        self.tokens_saved = 0
+        self.stop_reasons: dict = {}
+
+    def record_stop(self, result: Generation) -> None:
+        with self._lock:
+            self.explanations += 1
+            self.explanation_tokens += result.new_tokens
+            self.tokens_saved += result.tokens_saved
+            self.stop_reasons[result.stop_reason] = self.stop_reasons.get(result.stop_reason, 0) + 1
+
+    def record(self, new_tokens: int, seconds: float, target_forwards: int, draft_forwards: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += new_tokens
+            self.seconds += seconds
+            self.target_forwards += target_forwards
+            self.draft_forwards += draft_forwards
+            self.accepted += max(0, new_tokens - target_forwards)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            out = {
+                "assisted": self.assisted,
+                "calls": self.calls,
+                "new_tokens": self.new_tokens,
+                "tokens_per_s": round(self.new_tokens / self.seconds, 2) if self.seconds else None,
+                "tokens_per_target_forward": round(self.new_tokens / self.target_forwards, 3) if self.target_forwards else None,
+                "explanations": self.explanations,
+                "new_tokens_per_explanation": round(self.explanation_tokens / self.explanations, 2) if self.explanations else None,
+                "tokens_saved": self.tokens_saved,
+                "stop_reasons": dict(self.stop_reasons),
+            }
+            if self.assisted:
+                out["drafted"] = self.draft_forwards
+                out["accepted"] = self.accepted
+                out["acceptance_rate"] = round(self.accepted / self.draft_forwards, 3) if self.draft_forwards else None
+            return out
+
+
+def clean_generated_text(text: str, prompt: str, stop_strings: Sequence[str] = ()) -> str:
+    # Remove the prompt prefix if present
+    if text.startswith(prompt):
+        text = text[len(prompt):]
+    # Cut at the first stop string (generation may have run a few tokens past it)
+    cut = min((i for i in (text.find(s) for s in stop_strings if s) if i >= 0), default=-1)
+    if cut >= 0:
+        text = text[:cut]
+    # Strip out <ANSWER> and </ANSWER> tags if they exist
+    text = text.replace("<ANSWER>", "").replace("</ANSWER>", "")
+    return text.strip()
+
 
 def make_singleton(settings: BaseAppSettings):
-    return SingletonFactory(lambda: HFGenerator(settings))
\ No newline at end of file
+    if settings.combined_serving:
+        from api_combined.backbone import shared_backbone
+        return SingletonFactory(lambda: shared_backbone(settings).generator, name="clm")
+    return SingletonFactory(lambda: HFGenerator(settings), name="clm")
\ No newline at end of file
@@ -3,10 +3,15 @@
 from pydantic import BaseModel, Field
 from typing import List, Literal, Optional
 
-class PredictRequest(BaseModel):
+class GenerationBudget(BaseModel):
+    # Capped by the server's DRSLLM_CLM_MAX_NEW_TOKENS / DRSLLM_CLM_MAX_TIME_S
+    max_new_tokens: Optional[int] = Field(None, ge=1)
+    max_time_s: Optional[float] = Field(None, gt=0)
+
+class PredictRequest(GenerationBudget):
     commit_message: str = Field(...)
     code_diff: str = Field(...)
 
-class PredictBySHARequest(BaseModel):
+class PredictBySHARequest(GenerationBudget):
     repo: str = Field(..., example="octocat/Hello-World")
     sha: str = Field(..., example="f9c2a5d...")
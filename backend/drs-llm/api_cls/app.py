@@ -1,62 +1,384 @@
 from contextlib import asynccontextmanager
-import asyncio, logging
-from fastapi import FastAPI, HTTPException
+import asyncio, functools, logging, time
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse
+from typing import List, Optional
 
-from core.settings import BaseAppSettings
+from core.settings import get_settings
 from core.logging_setup import setup_logging
 from core.github_client import fetch_commit_message_and_diff
-from core.diff_utils import diff_to_structured_xml
-from core.runtime import preload_singleton
+from core.diff_utils import (INLINE, PREFIXED, commit_fingerprint, diff_to_structured_xml, model_input,
+                              synthetic_diff)
+from core.runtime import (InferenceExecutor, HTTP_CLIENT_CLOSED_REQUEST, startup_profile, start_model, run_warmup,
+                          estimate_tokens, token_budget, make_residency)
+from core.profiling import capture_profile, check_debug_token
+from core.timing import ServerTimingMiddleware, stage, count, current_timing, stage_stats
+from core.streaming import stream_ndjson
+from core.jobs import make_job_runner, make_jobs_router
 
-from .schemas import PredictRequest, PredictResponse, PredictBySHARequest
+from .schemas import (PredictRequest, PredictResponse, PredictBySHARequest, SimilarRequest, SimilarResponse,
+                      SimilarCommit, LabeledCommit)
 from .model_cls import get_classifier
+from .prediction_cache import PredictionCache
+from .similar_index import SimilarIndex
 
-settings = BaseAppSettings()
+settings = get_settings()
 setup_logging()
 log = logging.getLogger(__name__)
 
 clf_singleton = get_classifier(settings)
+residency = make_residency(settings, clf_singleton, "seq-cls")
+executor = InferenceExecutor(residency=residency)
+prediction_cache = PredictionCache(settings.prediction_cache_size)
+similar_index = SimilarIndex(
+    settings.similar_index_dir, settings.model_id, mode=settings.similar_index_mode,
+    approx_dim=settings.similar_approx_dim, candidates=settings.similar_approx_candidates,
+) if settings.similar_index_dir else None
+
+def warmup_input(n: int) -> str:
+    """Synthetic model input of roughly n tokens, built through the real preprocessing path."""
+    return diff_to_structured_xml(synthetic_diff(n), "Warm-up commit", strict=False)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    log.info("Initializing classifier (blocking startup)...")
-    await preload_singleton(clf_singleton)
-    log.info("Classifier ready.")
+    log.info("Initializing classifier (in background)...")
+    lengths = [min(n, settings.max_length) for n in settings.warmup_lengths]
+    startup = asyncio.create_task(start_model(
+        clf_singleton,
+        lambda clf: run_warmup(clf.predict, warmup_input, lengths),
+    ))
+    job_runner.start()
+    residency.start()
     yield
+    residency.stop()
+    job_runner.stop()
+    startup.cancel()
 
 app = FastAPI(title="DRS-LLM API (SeqCls)", version="0.1.0", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(ServerTimingMiddleware)
+# Routes live on a router so the combined service (api_combined) can mount them under a prefix
+router = APIRouter()
 
-@app.get("/health")
+@router.get("/health")
 def health():
-    return {"status": "ok", "model_id": settings.model_id}
-
-@app.post("/predict", response_model=PredictResponse)
-def predict(req: PredictRequest):
-    text = diff_to_structured_xml(req.code_diff, req.commit_message, strict=False)
-    label, conf = clf_singleton.get().predict(text)
-    log.info("label=%s conf=%.3f", label, conf)
-    return PredictResponse(label=label, confidence=conf)
-
-@app.post("/predict_by_sha", response_model=PredictResponse)
-def predict_by_sha(req: PredictBySHARequest):
-    msg, diff = fetch_commit_message_and_diff(req.repo, req.sha)
-    text = msg + "\n\n" + diff_to_structured_xml(diff, strict=False)
+    return {
+        "status": "ok",
+        "model_id": settings.model_id,
+        "startup": startup_profile.as_dict(),
+        "inference": executor.stats(),
+        "jobs": job_runner.stats(),
+        "residency": residency.stats(),
+        "adapters": clf_singleton.get().stats() if settings.adapters and startup_profile.ready else None,
+        "cascade": clf_singleton.get().stats() if settings.cascade_first_stage and startup_profile.ready else None,
+        "prediction_cache": prediction_cache.stats(),
+        "similar_index": similar_index.stats() if similar_index is not None else None,
+    }
+
+@router.get("/ready")
+def ready():
+    """Readiness probe: 503 until the model is loaded and warmed up."""
+    if not startup_profile.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    # Released models still serve; the gateway prefers replicas whose model is resident
+    return {"ready": True, "residency": residency.state}
+
+@router.get("/debug/timings")
+def debug_timings():
+    """Per-route percentiles of request stages (ms) and input sizes over the recent window."""
+    return stage_stats.summary()
+
+@router.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=settings.profile_max_seconds),
+    format: str = Query("zip", description="zip | chrome | collapsed | summary"),
+):
+    """Profile inference for `seconds`: torch.profiler trace, Python stack samples, per-request peak memory."""
+    check_debug_token(request, settings.debug_token)
+    return await capture_profile(seconds, format, name="seq-cls")
+
+def _unstaged(fn):
+    return lambda text: (*fn(text), None)
+
+def _subject(commit_message: str) -> str:
+    return commit_message.strip().split("\n", 1)[0][:200]
+
+def _embedder():
+    """The classifier's batched (label, conf, vector) call when the similar index is on and the
+    classifier exposes embeddings (direct engine, no adapters or cascade), else None."""
+    if similar_index is None or settings.adapters or settings.cascade_first_stage:
+        return None
+    clf = clf_singleton.get()
+    return clf.predict_embed_batch if getattr(clf, "supports_embeddings", False) else None
+
+def _score_and_index(embed, texts: List[str], metas: List[dict]) -> list:
+    """Score texts and add each to the similar index; runs in the inference worker thread."""
+    out = []
+    for (label, conf, vector), meta in zip(embed(texts), metas):
+        similar_index.add(vector, {**meta, "label": label, "confidence": round(conf, 4), "source": "scored"})
+        out.append((label, conf, None))
+    return out
+
+def _predictor(adapter: Optional[str], meta: Optional[dict] = None):
+    """Resolve the request's adapter to (callable returning (label, conf, stage), adapter name reported back).
+    With the similar index on, the callable also indexes the commit described by `meta`."""
+    clf = clf_singleton.get()
+    if not settings.adapters:
+        if adapter is not None:
+            raise HTTPException(status_code=422, detail="This server does not host multiple adapters")
+        if settings.cascade_first_stage:
+            return clf.predict_staged, None
+        embed = _embedder() if meta is not None else None
+        if embed is not None:
+            return lambda text: _score_and_index(embed, [text], [meta])[0], None
+        return _unstaged(clf.predict), None
+    name = adapter or clf.default_adapter
+    if not clf.has_adapter(name):
+        raise HTTPException(status_code=404, detail=f"Unknown adapter {name!r}")
+    return functools.partial(_adapter_predict, clf, name), name
+
+def _adapter_predict(registry, name: str, text: str):
+    from .registry import AdapterUnavailable
+
+    try:
+        return (*registry.predict(text, adapter=name), None)
+    except AdapterUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+
+async def _classify(request: Request, adapter_req: Optional[str], kind: str, diff: str, msg: str,
+                    meta: Optional[dict] = None):
+    """Cached prediction for this change if there is one, else preprocess + infer and cache it.
+    Returns ((label, conf, stage), adapter, fingerprint, patch_id_match)."""
+    fingerprint = commit_fingerprint(diff, msg)
+    predict_fn, adapter = _predictor(adapter_req, {"fingerprint": fingerprint, **(meta or {})})
+    hit = prediction_cache.get(fingerprint, adapter, kind)
+    if hit is not None:
+        return hit, adapter, fingerprint, True
+    with stage("preprocess"):
+        text = await asyncio.to_thread(model_input, kind, diff, msg)
+    result = await executor.run(request, predict_fn, text, cost=estimate_tokens(text, settings.max_length))
+    prediction_cache.put(fingerprint, adapter, kind, result)
+    return result, adapter, fingerprint, False
+
+@router.post("/predict", response_model=PredictResponse)
+async def predict(req: PredictRequest, request: Request, timing: bool = False):
+    startup_profile.require_ready()
+    count("input_bytes", len(req.code_diff.encode()) + len(req.commit_message.encode()))
+    (label, conf, cascade_stage), adapter, fp, matched = await _classify(
+        request, req.adapter, INLINE, req.code_diff, req.commit_message, {"subject": _subject(req.commit_message)},
+    )
+    log.info("label=%s conf=%.3f adapter=%s stage=%s patch_id_match=%s", label, conf, adapter, cascade_stage, matched)
+    return PredictResponse(label=label, confidence=conf, adapter=adapter, stage=cascade_stage,
+                           fingerprint=fp, patch_id_match=matched,
+                           timing=current_timing().as_dict() if timing else None)
+
+@router.post("/predict_by_sha", response_model=PredictResponse)
+async def predict_by_sha(req: PredictBySHARequest, request: Request, timing: bool = False):
+    startup_profile.require_ready()
+    with stage("github"):
+        msg, diff = await asyncio.to_thread(fetch_commit_message_and_diff, req.repo, req.sha)
+    count("input_bytes", len(diff.encode()) + len(msg.encode()))
     try:
-        label, conf = clf_singleton.get().predict(text)
+        (label, conf, cascade_stage), adapter, fp, matched = await _classify(
+            request, req.adapter, PREFIXED, diff, msg, {"subject": _subject(msg), "repo": req.repo, "sha": req.sha},
+        )
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e)) from e
-    log.info("label=%s conf=%.3f repo=%s sha=%s", label, conf, req.repo, req.sha)
-    return PredictResponse(label=label, confidence=conf)
+    log.info("label=%s conf=%.3f repo=%s sha=%s adapter=%s stage=%s patch_id_match=%s",
+             label, conf, req.repo, req.sha, adapter, cascade_stage, matched)
+    return PredictResponse(label=label, confidence=conf, adapter=adapter, stage=cascade_stage,
+                           fingerprint=fp, patch_id_match=matched,
+                           timing=current_timing().as_dict() if timing else None)
 
 
-@app.post("/predict_batch", response_model=List[PredictResponse])
-def predict_batch(reqs: List[PredictRequest]):
+@router.post("/predict_batch", response_model=List[PredictResponse])
+async def predict_batch(reqs: List[PredictRequest], request: Request):
+    startup_profile.require_ready()
     results: List[PredictResponse] = []
     for r in reqs:
-        text = r.commit_message + "\n\n" + diff_to_structured_xml(r.code_diff, strict=False)
-        label, conf = clf_singleton.get().predict(text)
-        results.append(PredictResponse(label=label, confidence=conf))
-    return results
\ No newline at end of file
+        # Each item is queued separately so a disconnect or expired deadline stops the rest
+        count("input_bytes", len(r.code_diff.encode()) + len(r.commit_message.encode()))
+        (label, conf, cascade_stage), adapter, fp, matched = await _classify(
+            request, r.adapter, PREFIXED, r.code_diff, r.commit_message, {"subject": _subject(r.commit_message)},
+        )
+        results.append(PredictResponse(label=label, confidence=conf, adapter=adapter, stage=cascade_stage,
+                                       fingerprint=fp, patch_id_match=matched))
+    return results
+
+
+def _batch_predictor():
+    """Callable scoring a list of texts (plus their similar-index metadata) in one worker call ->
+    [(label, conf, stage)], or None when the classifier has no batched path (adapters,
+    CLM-as-classifier, combined mode)."""
+    clf = clf_singleton.get()
+    if settings.adapters or not hasattr(clf, "predict_batch"):
+        return None
+    if settings.cascade_first_stage:
+        return lambda texts, metas: clf.predict_batch(texts)
+    embed = _embedder()
+    if embed is not None:
+        return functools.partial(_score_and_index, embed)
+    return lambda texts, metas: [(label, conf, None) for label, conf in clf.predict_batch(texts)]
+
+async def _run_grouped(client, batch_fn, texts: List[str], *per_item: list) -> list:
+    """batch_fn(texts, *per_item) in input order, split so that each call's padded size fits
+    the token budget (one call when it is off)."""
+    costs = [estimate_tokens(t, settings.max_length) for t in texts]
+    results: list = [None] * len(texts)
+    for group in token_budget.batches(costs):
+        outs = await executor.run(client, batch_fn, [texts[i] for i in group],
+                                  *([items[i] for i in group] for items in per_item),
+                                  cost=max(costs[i] for i in group) * len(group))
+        for i, out in zip(group, outs):
+            results[i] = out
+    return results
+
+async def _infer_predict_many(client, predict_fns, texts: List[str], metas: List[dict]) -> list:
+    batch_fn = _batch_predictor()
+    if batch_fn is not None:
+        return await _run_grouped(client, batch_fn, texts, metas)
+    costs = [estimate_tokens(t, settings.max_length) for t in texts]
+    # Queued individually; the adapter registry groups concurrent items per adapter itself
+    results = await asyncio.gather(*(executor.run(client, fn, t, cost=c) for fn, t, c in zip(predict_fns, texts, costs)),
+                                   return_exceptions=True)
+    for r in results:
+        if isinstance(r, HTTPException) and r.status_code == HTTP_CLIENT_CLOSED_REQUEST:
+            raise r
+        if isinstance(r, Exception) and not isinstance(r, HTTPException):
+            raise r
+    return results
+
+async def _predict_many(client, reqs: List[PredictRequest]) -> list:
+    out: list = [None] * len(reqs)
+    todo = []  # (index in batch, fingerprint, adapter, predict_fn, index metadata) for cache misses
+    for i, r in enumerate(reqs):
+        count("input_bytes", len(r.code_diff.encode()) + len(r.commit_message.encode()))
+        fp = commit_fingerprint(r.code_diff, r.commit_message)
+        meta = {"fingerprint": fp, "subject": _subject(r.commit_message)}
+        try:
+            predict_fn, adapter = _predictor(r.adapter, meta)
+        except HTTPException as e:
+            out[i] = e
+            continue
+        hit = prediction_cache.get(fp, adapter, PREFIXED)
+        if hit is not None:
+            label, conf, cascade_stage = hit
+            out[i] = PredictResponse(label=label, confidence=conf, adapter=adapter, stage=cascade_stage,
+                                     fingerprint=fp, patch_id_match=True).model_dump(exclude={"timing"})
+            continue
+        todo.append((i, fp, adapter, predict_fn, meta))
+    if not todo:
+        return out
+    with stage("preprocess"):
+        texts = await asyncio.to_thread(lambda: [
+            model_input(PREFIXED, reqs[i].code_diff, reqs[i].commit_message) for i, *_ in todo
+        ])
+    results = await _infer_predict_many(client, [t[3] for t in todo], texts, [t[4] for t in todo])
+    for (i, fp, adapter, _, _), res in zip(todo, results):
+        if isinstance(res, HTTPException):
+            out[i] = res
+            continue
+        prediction_cache.put(fp, adapter, PREFIXED, res)
+        label, conf, cascade_stage = res
+        out[i] = PredictResponse(label=label, confidence=conf, adapter=adapter, stage=cascade_stage,
+                                 fingerprint=fp, patch_id_match=False).model_dump(exclude={"timing"})
+    return out
+
+@router.post("/predict_stream")
+async def predict_stream(request: Request):
+    """
+    NDJSON in, NDJSON out: one PredictRequest per input line, one result per output line
+    ({"index": n, ...PredictResponse} or {"index": n, "error", "status"}), written as each batch finishes.
+    """
+    startup_profile.require_ready()
+    return stream_ndjson(
+        request, PredictRequest, _predict_many,
+        batch_size=settings.stream_batch_size,
+        batch_wait_s=settings.stream_batch_wait_ms / 1000.0,
+        max_pending=settings.stream_max_pending,
+        max_line_bytes=settings.stream_max_line_bytes,
+    )
+
+
+def _similar_embedder():
+    if similar_index is None:
+        raise HTTPException(status_code=404, detail="The similar-commit index is disabled (DRSLLM_SIMILAR_INDEX_DIR)")
+    embed = _embedder()
+    if embed is None:
+        raise HTTPException(status_code=501, detail="This classifier does not expose embeddings "
+                                                    "(needs the direct engine, no adapters or cascade)")
+    return embed
+
+@router.post("/similar", response_model=SimilarResponse)
+async def similar(req: SimilarRequest, request: Request):
+    """Past commits closest to this one in the classifier's representation space. An indexed commit
+    is answered from the index alone; otherwise it is scored (and indexed) first."""
+    startup_profile.require_ready()
+    embed = _similar_embedder()
+    meta = {"repo": req.repo, "sha": req.sha}
+    if req.commit_message is not None and req.code_diff is not None:
+        msg, diff = req.commit_message, req.code_diff
+    elif req.repo and req.sha:
+        with stage("github"):
+            msg, diff = await asyncio.to_thread(fetch_commit_message_and_diff, req.repo, req.sha)
+    else:
+        raise HTTPException(status_code=422, detail="Give commit_message and code_diff, or repo and sha")
+    count("input_bytes", len(diff.encode()) + len(msg.encode()))
+    fp = commit_fingerprint(diff, msg)
+    found = similar_index.lookup(fp)
+    if found is not None:
+        vector, entry = found
+    else:
+        with stage("preprocess"):
+            try:
+                text = await asyncio.to_thread(model_input, PREFIXED, diff, msg)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e)) from e
+        [(label, conf, vector)] = await executor.run(request, embed, [text],
+                                                     cost=estimate_tokens(text, settings.max_length))
+        entry = {**meta, "fingerprint": fp, "subject": _subject(msg), "label": label,
+                 "confidence": round(conf, 4), "source": "scored"}
+        similar_index.add(vector, entry)
+    k = min(req.k, settings.similar_max_k)
+    with stage("search"):
+        t0 = time.perf_counter()
+        hits = await asyncio.to_thread(similar_index.search, vector, k, fp)
+        search_ms = (time.perf_counter() - t0) * 1000.0
+    return SimilarResponse(fingerprint=fp, indexed=found is not None, label=entry.get("label"),
+                           confidence=entry.get("confidence"), results=[SimilarCommit(**h) for h in hits],
+                           search_ms=round(search_ms, 3))
+
+@router.post("/similar/add")
+async def similar_add(items: List[LabeledCommit], request: Request):
+    """Index commits with known labels (e.g. confirmed bug-inducing changes); a label given here
+    is kept over the model's prediction for the same change."""
+    startup_profile.require_ready()
+    embed = _similar_embedder()
+    if len(items) > settings.similar_add_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.similar_add_max_items} commits per call")
+    with stage("preprocess"):
+        try:
+            texts = await asyncio.to_thread(lambda: [
+                model_input(PREFIXED, it.code_diff, it.commit_message) for it in items
+            ])
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+    results = await _run_grouped(request, embed, texts)
+    for it, (predicted, _, vector) in zip(items, results):
+        similar_index.add(vector, {
+            "fingerprint": commit_fingerprint(it.code_diff, it.commit_message), "subject": _subject(it.commit_message),
+            "repo": it.repo, "sha": it.sha, "label": it.label, "predicted": predicted, "source": "labeled",
+        })
+    return {"added": len(items), "commits": len(similar_index)}
+
+
+job_runner = make_job_runner(settings, "seq-cls", executor, PredictRequest, _predict_many)
+router.include_router(make_jobs_router(
+    job_runner, max_items=settings.jobs_max_items, max_queued=settings.jobs_max_queued,
+    max_wait_s=settings.jobs_max_wait_s,
+))
+
+
+app.include_router(router)
@@ -0,0 +1,107 @@
+# /drs-llm/api_cls/cascade.py
+
+"""
+Confidence cascade for seq-cls.
+
+A small full seq-cls model (e.g. a distilled classifier, run on CPU by default) scores
+every request first. Only requests whose first-stage confidence falls inside
+`cascade_band` [low, high) are escalated to the main classifier (HFSeqClassifier or
+whichever backend is configured). Both stages must use the same label names.
+"""
+
+from __future__ import annotations
+import logging
+import threading
+from typing import List, Optional
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+from core.settings import BaseAppSettings
+from core.runtime import startup_profile
+from core import timing
+
+from .model_cls import DirectSeqClsEngine
+
+log = logging.getLogger(__name__)
+
+FIRST_STAGE = "first"
+SECOND_STAGE = "second"
+
+
+class CascadeClassifier:
+    def __init__(self, settings: BaseAppSettings, second_stage):
+        path = settings.cascade_first_stage
+        with startup_profile.phase("cascade_first_stage"):
+            tok = AutoTokenizer.from_pretrained(
+                path, use_fast=True, local_files_only=settings.local_files_only, trust_remote_code=settings.trust_remote_code
+            )
+            if tok.pad_token_id is None and tok.eos_token_id is not None:
+                tok.pad_token_id = tok.eos_token_id
+                tok.pad_token = tok.eos_token
+            model = AutoModelForSequenceClassification.from_pretrained(
+                path, torch_dtype=torch.float32, local_files_only=settings.local_files_only,
+                trust_remote_code=settings.trust_remote_code,
+            ).to(settings.cascade_device).eval()
+            if model.config.pad_token_id is None:
+                model.config.pad_token_id = tok.pad_token_id
+        self._first = DirectSeqClsEngine(model, tok, settings.max_length)
+        self._second = second_stage
+        self._low, self._high = settings.cascade_band
+        self._lock = threading.Lock()
+        self._counters = dict(first=0, escalated=0)
+        log.info("Cascade enabled: first stage %s on %s, escalating confidence in [%.2f, %.2f)",
+                 path, settings.cascade_device, self._low, self._high)
+
+    def _escalate(self, conf: float) -> bool:
+        return self._low <= conf < self._high
+
+    def _count(self, first: int, escalated: int) -> None:
+        with self._lock:
+            self._counters["first"] += first
+            self._counters["escalated"] += escalated
+
+    def predict_staged(self, text: str) -> tuple[str, float, str]:
+        """(label, confidence, stage that answered)."""
+        with timing.stage("cascade_first"):
+            label, conf = self._first([text])[0]
+        if not self._escalate(conf):
+            self._count(1, 0)
+            return label, conf, FIRST_STAGE
+        self._count(0, 1)
+        label, conf = self._second.predict(text)
+        return label, conf, SECOND_STAGE
+
+    def predict(self, text: str) -> tuple[str, float]:
+        label, conf, _ = self.predict_staged(text)
+        return label, conf
+
+    def predict_batch(self, texts: List[str]) -> List[tuple[str, float, str]]:
+        """First stage on the whole batch; one second-stage batch for the escalated subset."""
+        out: List[Optional[tuple]] = []
+        escalate: List[int] = []
+        for i, (label, conf) in enumerate(self._first(texts)):
+            if self._escalate(conf):
+                escalate.append(i)
+                out.append(None)
+            else:
+                out.append((label, conf, FIRST_STAGE))
+        if escalate:
+            batch = [texts[i] for i in escalate]
+            if hasattr(self._second, "predict_batch"):
+                results = self._second.predict_batch(batch)
+            else:
+                results = [self._second.predict(t) for t in batch]
+            for i, (label, conf) in zip(escalate, results):
+                out[i] = (label, conf, SECOND_STAGE)
+        self._count(len(texts) - len(escalate), len(escalate))
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._counters["first"] + self._counters["escalated"]
+            return {
+                "band": [self._low, self._high],
+                **self._counters,
+                "escalation_rate": round(self._counters["escalated"] / total, 4) if total else None,
+            }
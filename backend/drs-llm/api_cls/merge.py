@@ -0,0 +1,171 @@
+# /drs-llm/api_cls/merge.py
+
+"""
+Pre-merged adapter export.
+
+Folds a PEFT/LoRA adapter into its base weights (`merge_and_unload`) and saves the result
+as safetensors next to the resized tokenizer, so later starts load one plain model with no
+adapter overhead on the forward pass. Artifacts are keyed by adapter and base hashes.
+
+Build ahead of time with:
+    python -m api_cls.merge --task seq-cls
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Literal, Optional
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModelForCausalLM
+from peft import PeftModel
+
+from core.settings import get_settings
+from core.runtime import torch_dtype
+
+log = logging.getLogger(__name__)
+
+Task = Literal["seq-cls", "causal-lm"]
+
+_MODEL_CLASSES = {
+    "seq-cls": AutoModelForSequenceClassification,
+    "causal-lm": AutoModelForCausalLM,
+}
+_WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+_DONE_MARKER = ".merged-ok"
+
+
+def _sha256_file(path: str, h: "hashlib._Hash") -> None:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+
+def adapter_hash(adapter_path: str) -> str:
+    """Content hash of every file in the adapter dir (adapters are small enough to read fully)."""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(adapter_path)):
+        path = os.path.join(adapter_path, name)
+        if os.path.isfile(path):
+            h.update(name.encode())
+            _sha256_file(path, h)
+    return h.hexdigest()
+
+
+def base_hash(base_model_path: str) -> str:
+    """
+    Cheap fingerprint of the base model: full content of the JSON configs plus name, size
+    and mtime of each weight shard (hashing 16GB of weights on every start defeats the purpose).
+    """
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(base_model_path)):
+        path = os.path.join(base_model_path, name)
+        if not os.path.isfile(path):
+            continue
+        h.update(name.encode())
+        if name.endswith(".json"):
+            _sha256_file(path, h)
+        elif name.endswith(_WEIGHT_SUFFIXES):
+            st = os.stat(path)
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def merged_artifact_dir(cache_dir: str, adapter_path: str, base_model_path: str, *, task: Task, dtype: str) -> str:
+    key = f"{task}-{dtype}-{adapter_hash(adapter_path)[:16]}-{base_hash(base_model_path)[:16]}"
+    return os.path.join(cache_dir, key)
+
+
+def export_merged_model(
+    adapter_path: str,
+    base_model_path: str,
+    out_dir: str,
+    *,
+    task: Task,
+    dtype: str = "float16",
+    trust_remote_code: bool = True,
+) -> str:
+    """
+    Merge `adapter_path` into `base_model_path` and save the full model + tokenizer to `out_dir`.
+    The base is loaded unquantized on CPU: merging into 4-bit weights is lossy, and quantization
+    is applied again when the merged artifact is loaded for serving.
+    """
+    t0 = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(
+        adapter_path, use_fast=True, local_files_only=True, trust_remote_code=trust_remote_code
+    )
+    base_model = _MODEL_CLASSES[task].from_pretrained(
+        base_model_path,
+        torch_dtype=torch_dtype(dtype),
+        low_cpu_mem_usage=True,
+        local_files_only=True,
+        trust_remote_code=trust_remote_code,
+    )
+    new_vocab = len(tokenizer)
+    if getattr(base_model.config, "vocab_size", None) != new_vocab:
+        base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
+        base_model.config.vocab_size = new_vocab
+
+    peft_model = PeftModel.from_pretrained(base_model, model_id=adapter_path, is_trainable=False, local_files_only=True)
+    merged = peft_model.merge_and_unload()
+    merged.eval()
+    # resize_token_embeddings pads to a multiple of 8; the saved config must match the real shape
+    merged.config.vocab_size = merged.get_input_embeddings().weight.shape[0]
+    if tokenizer.pad_token_id is not None:
+        merged.config.pad_token_id = tokenizer.pad_token_id
+    elif tokenizer.eos_token_id is not None:
+        merged.config.pad_token_id = tokenizer.eos_token_id
+
+    # Write next to the target and rename so a crashed export never looks like a valid cache entry
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    merged.save_pretrained(tmp_dir, safe_serialization=True)
+    tokenizer.save_pretrained(tmp_dir)
+    open(os.path.join(tmp_dir, _DONE_MARKER), "w").close()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    log.info("Merged adapter %s into %s -> %s in %.1fs", adapter_path, base_model_path, out_dir, time.perf_counter() - t0)
+    return out_dir
+
+
+def ensure_merged_model(
+    adapter_path: str,
+    base_model_path: str,
+    cache_dir: str,
+    *,
+    task: Task,
+    dtype: str = "float16",
+    trust_remote_code: bool = True,
+) -> str:
+    """Return the cached merged artifact for this adapter/base pair, building it on a miss."""
+    out_dir = merged_artifact_dir(cache_dir, adapter_path, base_model_path, task=task, dtype=dtype)
+    if os.path.exists(os.path.join(out_dir, _DONE_MARKER)):
+        log.info("Using pre-merged model %s", out_dir)
+        return out_dir
+    log.info("No pre-merged model for %s; merging now (one-time)", adapter_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    return export_merged_model(
+        adapter_path, base_model_path, out_dir, task=task, dtype=dtype, trust_remote_code=trust_remote_code
+    )
+
+
+def main(argv: Optional[list] = None) -> None:
+    settings = get_settings()
+    ap = argparse.ArgumentParser(description="Merge a PEFT adapter into its base model and cache the result.")
+    ap.add_argument("--task", choices=sorted(_MODEL_CLASSES), default="causal-lm" if settings.clm_for_seq_cls else "seq-cls")
+    ap.add_argument("--adapter", default=settings.model_id)
+    ap.add_argument("--base", default=settings.base_model_path)
+    ap.add_argument("--cache-dir", default=settings.merged_cache_dir or ".cache/merged")
+    ap.add_argument("--dtype", default=settings.dtype)
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    print(ensure_merged_model(args.adapter, args.base, args.cache_dir, task=args.task, dtype=args.dtype))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,10 @@
 
 from __future__ import annotations
 import logging
-from typing import Optional, Tuple, Union
+import os
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -17,7 +20,10 @@ from transformers.pipelines import Pipeline
 from peft import PeftModel, PeftConfig
 
 from core.settings import BaseAppSettings
-from core.runtime import SingletonFactory, model_kwargs_from_settings, limited_infer
+from core.runtime import SingletonFactory, model_kwargs_from_settings, limited_infer, startup_profile
+from core import timing
+
+from .merge import ensure_merged_model
 
 log = logging.getLogger(__name__)
 
@@ -26,14 +32,37 @@ log = logging.getLogger(__name__)
 # Helpers: adapter detection & builders
 # ---------------------------
 
+@lru_cache(maxsize=None)
 def _is_peft_adapter(path: str) -> bool:
-    try:
-        _ = PeftConfig.from_pretrained(path, local_files_only=True)
+    if os.path.isdir(path):
+        # Local dirs: the adapter config file is the marker, no need to probe by exception
+        is_adapter = os.path.isfile(os.path.join(path, "adapter_config.json"))
+    else:
+        try:
+            _ = PeftConfig.from_pretrained(path, local_files_only=True)
+            is_adapter = True
+        except Exception:
+            is_adapter = False
+    if is_adapter:
         log.info("Model path %s is a PEFT/LoRA adapter.", path)
-        return True
-    except Exception:
+    else:
         log.info("Model path %s is a full model (not an adapter).", path)
-        return False
+    return is_adapter
+
+
+def _resolve_merged(
+    model_or_adapter_path: str,
+    base_model_path: Optional[str],
+    merged_cache_dir: Optional[str],
+    **merge_kwargs,
+) -> str:
+    """Swap an adapter path for its cached merged artifact (building it once); other paths pass through."""
+    if not merged_cache_dir or not _is_peft_adapter(model_or_adapter_path):
+        return model_or_adapter_path
+    if not base_model_path:
+        raise ValueError("base_model_path is required when model_id points to a PEFT/LoRA adapter.")
+    with startup_profile.phase("merged_artifact"):
+        return ensure_merged_model(model_or_adapter_path, base_model_path, merged_cache_dir, **merge_kwargs)
 
 
 def _build_model_and_tokenizer_for_pipeline(
@@ -43,41 +72,53 @@ def _build_model_and_tokenizer_for_pipeline(
     *,
     local_files_only: bool = True,
     trust_remote_code: bool = True,
+    merged_cache_dir: Optional[str] = None,
+    merge_dtype: str = "float16",
 ) -> Tuple[Union[str, torch.nn.Module], AutoTokenizer, AutoConfig, bool]:
     """
     Returns (model_for_pipeline, tokenizer, config, used_adapter) for SEQ_CLS pipeline usage.
     If adapter: attaches to base model and returns a model object (ready for pipeline).
     Else: returns the model path (pipeline will lazy-load).
+    With merged_cache_dir set, an adapter is served from its pre-merged full-model artifact.
     """
+    model_or_adapter_path = _resolve_merged(
+        model_or_adapter_path, base_model_path, merged_cache_dir,
+        task="seq-cls", dtype=merge_dtype, trust_remote_code=trust_remote_code,
+    )
     if _is_peft_adapter(model_or_adapter_path):
         if not base_model_path:
             raise ValueError("base_model_path is required when model_id points to a PEFT/LoRA adapter.")
 
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
-        )
+        with startup_profile.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(
+                model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
+            )
         config = AutoConfig.from_pretrained(base_model_path, local_files_only=local_files_only, trust_remote_code=trust_remote_code)
-        base_model = AutoModelForSequenceClassification.from_pretrained(base_model_path, **model_kwargs)
+        with startup_profile.phase("base_weights"):
+            base_model = AutoModelForSequenceClassification.from_pretrained(base_model_path, **model_kwargs)
 
         # Resize embeddings if adapter tokenizer expanded vocab
         new_vocab = len(tokenizer)
         if getattr(base_model.config, "vocab_size", None) != new_vocab:
-            base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
+            with startup_profile.phase("resize_embeddings"):
+                base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
             base_model.config.vocab_size = new_vocab
 
-        peft_model = PeftModel.from_pretrained(
-            base_model,
-            model_id=model_or_adapter_path,
-            is_trainable=False,
-            local_files_only=local_files_only,
-        )
+        with startup_profile.phase("adapter_attach"):
+            peft_model = PeftModel.from_pretrained(
+                base_model,
+                model_id=model_or_adapter_path,
+                is_trainable=False,
+                local_files_only=local_files_only,
+            )
         peft_model.eval()
         return peft_model, tokenizer, base_model.config, True
 
     # Full model path (pipeline can lazy load the weights)
-    tokenizer = AutoTokenizer.from_pretrained(
-        model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
-    )
+    with startup_profile.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
+        )
     config = AutoConfig.from_pretrained(model_or_adapter_path, local_files_only=local_files_only, trust_remote_code=trust_remote_code)
     return model_or_adapter_path, tokenizer, config, False
 
@@ -89,46 +130,60 @@ def _build_causal_model_and_tokenizer(
     *,
     local_files_only: bool = True,
     trust_remote_code: bool = True,
+    merged_cache_dir: Optional[str] = None,
+    merge_dtype: str = "float16",
 ) -> Tuple[torch.nn.Module, AutoTokenizer, AutoConfig, bool]:
     """
     Returns (model, tokenizer, config, used_adapter) for CAUSAL_LM inference.
     If adapter: attaches to base causal LM and returns the model object.
     Else: loads a full causal LM.
+    With merged_cache_dir set, an adapter is served from its pre-merged full-model artifact.
     """
+    model_or_adapter_path = _resolve_merged(
+        model_or_adapter_path, base_model_path, merged_cache_dir,
+        task="causal-lm", dtype=merge_dtype, trust_remote_code=trust_remote_code,
+    )
     if _is_peft_adapter(model_or_adapter_path):
         if not base_model_path:
             raise ValueError("base_model_path is required when model_id points to a PEFT/LoRA adapter.")
 
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
-        )
+        with startup_profile.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(
+                model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
+            )
         config = AutoConfig.from_pretrained(base_model_path, local_files_only=local_files_only, trust_remote_code=trust_remote_code)
-        base_model = AutoModelForCausalLM.from_pretrained(base_model_path, **model_kwargs)
+        with startup_profile.phase("base_weights"):
+            base_model = AutoModelForCausalLM.from_pretrained(base_model_path, **model_kwargs)
 
         new_vocab = len(tokenizer)
         if getattr(base_model.config, "vocab_size", None) != new_vocab:
-            base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
+            with startup_profile.phase("resize_embeddings"):
+                base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
             base_model.config.vocab_size = new_vocab
 
-        peft_model = PeftModel.from_pretrained(
-            base_model,
-            model_id=model_or_adapter_path,
-            is_trainable=False,
-            local_files_only=local_files_only,
-        )
+        with startup_profile.phase("adapter_attach"):
+            peft_model = PeftModel.from_pretrained(
+                base_model,
+                model_id=model_or_adapter_path,
+                is_trainable=False,
+                local_files_only=local_files_only,
+            )
         peft_model.eval()
         return peft_model, tokenizer, base_model.config, True
 
-    tokenizer = AutoTokenizer.from_pretrained(
-        model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
-    )
+    with startup_profile.phase("tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_or_adapter_path, use_fast=True, local_files_only=local_files_only, trust_remote_code=trust_remote_code
+        )
     config = AutoConfig.from_pretrained(model_or_adapter_path, local_files_only=local_files_only, trust_remote_code=trust_remote_code)
-    model = AutoModelForCausalLM.from_pretrained(model_or_adapter_path, **model_kwargs)
+    with startup_profile.phase("model_weights"):
+        model = AutoModelForCausalLM.from_pretrained(model_or_adapter_path, **model_kwargs)
     model.eval()
 
     new_vocab = len(tokenizer)
     if getattr(model.config, "vocab_size", None) != new_vocab:
-        model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
+        with startup_profile.phase("resize_embeddings"):
+            model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
         model.config.vocab_size = new_vocab
 
     return model, tokenizer, config, False
@@ -219,12 +274,77 @@ class CLMSeqClsPipeline(Pipeline):
 # Classifiers (Seq-Cls & CLM→Seq-Cls) with a common API
 # ---------------------------
 
+class DirectSeqClsEngine:
+    """
+    Pipeline-free seq-cls inference: tokenize, one padded forward under inference_mode,
+    then softmax/argmax on the model's device so only (label id, score) pairs cross to the
+    host. Same labels and scores as the text-classification pipeline, without its per-call
+    argument sanitizing, per-item preprocess/postprocess and DataLoader batching.
+    """
+    def __init__(self, model: torch.nn.Module, tokenizer, max_length: int, *, compile: bool = False,
+                 embeddings: bool = False):
+        self.model = model
+        self._tokenizer = tokenizer
+        self._max_length = max_length
+        config = model.config
+        self._id2label = config.id2label
+        # Mirrors the pipeline's default function_to_apply
+        self._sigmoid = config.problem_type == "multi_label_classification" or config.num_labels == 1
+        # With device_map="auto" the inputs belong wherever the embeddings were placed
+        self._device = model.get_input_embeddings().weight.device
+        self._forward = torch.compile(model, dynamic=True) if compile else model
+        # embeddings: the head's input is captured (per thread) so calls with embed=True can also
+        # return the pooled hidden state the head scored
+        self.embeddings = embeddings
+        self._captured = threading.local()
+        if embeddings:
+            head = getattr(model, "score", None) or getattr(model, "classifier", None)
+            if head is None:
+                raise ValueError(f"{type(model).__name__} has no score/classifier head to take embeddings from")
+            head.register_forward_pre_hook(self._capture)
+
+    def _capture(self, _module, args):
+        if getattr(self._captured, "on", False):
+            self._captured.hidden = args[0]
+
+    def _pooled(self, attention_mask: torch.Tensor) -> np.ndarray:
+        """L2-normalized head input at each row's last real token (what the head scores), as float32."""
+        hidden = self._captured.hidden
+        self._captured.hidden = None
+        if hidden.dim() == 3:
+            positions = torch.arange(attention_mask.shape[1], device=attention_mask.device)
+            last = (attention_mask * positions).argmax(dim=-1).to(hidden.device)
+            hidden = hidden[torch.arange(hidden.shape[0], device=hidden.device), last]
+        return torch.nn.functional.normalize(hidden.float(), dim=-1).cpu().numpy()
+
+    def __call__(self, texts: List[str], embed: bool = False) -> list:
+        """[(label, score)] per text, or [(label, score, embedding)] with embed=True."""
+        with timing.stage("tokenize"):
+            enc = self._tokenizer(
+                texts, return_tensors="pt", padding=len(texts) > 1, truncation=True, max_length=self._max_length,
+                return_token_type_ids=False,
+            )
+        timing.count("input_tokens", int(enc["attention_mask"].sum()))
+        enc = {k: v.to(self._device, non_blocking=True) for k, v in enc.items()}
+        with timing.stage("forward"), torch.inference_mode():
+            self._captured.on = embed
+            try:
+                logits = self._forward(**enc, use_cache=False).logits.float()
+            finally:
+                self._captured.on = False
+            probs = logits.sigmoid() if self._sigmoid else logits.softmax(dim=-1)
+            scores, ids = probs.max(dim=-1)
+            # One device->host copy per batch
+            scores, ids = scores.tolist(), ids.tolist()
+            if embed:
+                vectors = self._pooled(enc["attention_mask"])
+                return [(self._id2label[i], s, v) for i, s, v in zip(ids, scores, vectors)]
+        return [(self._id2label[i], s) for i, s in zip(ids, scores)]
+
+
 class HFSeqClassifier:
     def __init__(self, settings: BaseAppSettings):
-        tok = AutoTokenizer.from_pretrained(
-            settings.model_id, use_fast=True, local_files_only=settings.local_files_only, trust_remote_code=settings.trust_remote_code
-        )
-        # Build adapter/full model for pipeline
+        # Build adapter/full model (the builder also loads the tokenizer)
         kwargs = model_kwargs_from_settings(settings, for_4bit_quant=settings.load_in_4bit)
         kwargs["device_map"] = settings.device_map
         model_for_pipeline, tok, _config, used_adapter = _build_model_and_tokenizer_for_pipeline(
@@ -233,13 +353,8 @@ class HFSeqClassifier:
             model_kwargs=kwargs,
             local_files_only=settings.local_files_only,
             trust_remote_code=settings.trust_remote_code,
-        )
-        log.info("Setting up text-classification pipeline (used_adapter=%s)", used_adapter)
-        self.pipe = hf_pipeline(
-            task="text-classification",
-            model=model_for_pipeline,
-            tokenizer=tok,
-            model_kwargs=(kwargs if isinstance(model_for_pipeline, str) else {}),
+            merged_cache_dir=settings.merged_cache_dir,
+            merge_dtype=settings.dtype,
         )
         self._tokenizer = tok
         self._max_length = settings.max_length
@@ -249,16 +364,69 @@ class HFSeqClassifier:
             self._tokenizer.pad_token_id = self._tokenizer.eos_token_id
             self._tokenizer.pad_token = self._tokenizer.eos_token
 
+        self.pipe = None
+        self._engine: Optional[DirectSeqClsEngine] = None
+        if settings.seq_cls_engine == "direct":
+            model = model_for_pipeline
+            if isinstance(model, str):
+                with startup_profile.phase("model_weights"):
+                    model = AutoModelForSequenceClassification.from_pretrained(
+                        model, trust_remote_code=settings.trust_remote_code, **kwargs
+                    )
+            model.eval()
+            log.info("Setting up direct seq-cls engine (used_adapter=%s, compile=%s)", used_adapter, settings.torch_compile)
+            self._engine = DirectSeqClsEngine(model, tok, self._max_length, compile=settings.torch_compile,
+                                              embeddings=bool(settings.similar_index_dir))
+            model_config = model.config
+        else:
+            if settings.similar_index_dir:
+                log.warning("The similar-commit index needs DRSLLM_SEQ_CLS_ENGINE=direct; /similar is disabled")
+            log.info("Setting up text-classification pipeline (used_adapter=%s)", used_adapter)
+            # For a full-model path this phase includes the (lazy) weight load
+            with startup_profile.phase("pipeline"):
+                self.pipe = hf_pipeline(
+                    task="text-classification",
+                    model=model_for_pipeline,
+                    tokenizer=tok,
+                    model_kwargs=(kwargs if isinstance(model_for_pipeline, str) else {}),
+                )
+            model_config = self.pipe.model.config
+        # Batched forwards locate each row's last token through the model's pad_token_id
+        if model_config.pad_token_id is None:
+            model_config.pad_token_id = self._tokenizer.pad_token_id
+
+    def residency_modules(self) -> dict:
+        return {"model": self._engine.model if self._engine is not None else self.pipe.model}
+
     @limited_infer
     def predict(self, text: str) -> tuple[str, float]:
         """
-        Returns (label, confidence) using top-1 from the HF pipeline.
+        Returns (label, confidence) using top-1 from the direct engine or the HF pipeline.
         """
+        if self._engine is not None:
+            return self._engine([text])[0]
         out = self.pipe(text, truncation=True, max_length=self._max_length)
         # HF may return dict or [dict]; normalize
         item = out[0] if isinstance(out, list) else out
         return item["label"], float(item["score"])
 
+    @limited_infer
+    def predict_batch(self, texts: List[str]) -> List[tuple[str, float]]:
+        """Batched top-1 (label, confidence) per text, one padded forward per call."""
+        if self._engine is not None:
+            return self._engine(texts)
+        out = self.pipe(texts, batch_size=len(texts), truncation=True, max_length=self._max_length)
+        return [(item["label"], float(item["score"])) for item in out]
+
+    @property
+    def supports_embeddings(self) -> bool:
+        return self._engine is not None and self._engine.embeddings
+
+    @limited_infer
+    def predict_embed_batch(self, texts: List[str]) -> List[tuple[str, float, np.ndarray]]:
+        """predict_batch plus each text's normalized pooled hidden state (similar-commit index)."""
+        return self._engine(texts, embed=True)
+
 
 class HFCLMSeqClsClassifier:
     """
@@ -275,28 +443,34 @@ class HFCLMSeqClsClassifier:
             model_kwargs=kwargs,
             local_files_only=settings.local_files_only,
             trust_remote_code=settings.trust_remote_code,
+            merged_cache_dir=settings.merged_cache_dir,
+            merge_dtype=settings.dtype,
         )
         # LLaMA-like padding
         if tok.pad_token_id is None and tok.eos_token_id is not None:
             tok.pad_token_id = tok.eos_token_id
             tok.pad_token = tok.eos_token
 
-        self.pipe = CLMSeqClsPipeline(
-            model=model,
-            tokenizer=tok,
-            task="text-generation",  # label only
-            drs_token=settings.drs_token,
-            zero_token=settings.zero_token,
-            one_token=settings.one_token,
-            strict_single_token=settings.strict_single_token,
-            truncation=True,
-            max_length=settings.max_length,
-        )
+        with startup_profile.phase("pipeline"):
+            self.pipe = CLMSeqClsPipeline(
+                model=model,
+                tokenizer=tok,
+                task="text-generation",  # label only
+                drs_token=settings.drs_token,
+                zero_token=settings.zero_token,
+                one_token=settings.one_token,
+                strict_single_token=settings.strict_single_token,
+                truncation=True,
+                max_length=settings.max_length,
+            )
         self._zero = settings.zero_token
         self._one  = settings.one_token
 
         log.info("CLM→Seq-Cls pipeline ready (used_adapter=%s).", used_adapter)
 
+    def residency_modules(self) -> dict:
+        return {"model": self.pipe.model}
+
     @limited_infer
     def predict(self, text: str) -> tuple[str, float]:
         out = self.pipe(text)  # returns [{"logits": (logit0, logit1), "top_in_set": bool}]
@@ -319,6 +493,24 @@ class HFCLMSeqClsClassifier:
 # ---------------------------
 
 def _make_classifier(settings: BaseAppSettings):
+    clf = _make_main_classifier(settings)
+    if settings.cascade_first_stage:
+        if settings.adapters:
+            raise ValueError("The confidence cascade does not support multi-adapter serving.")
+        from .cascade import CascadeClassifier
+        return CascadeClassifier(settings, clf)
+    return clf
+
+def _make_main_classifier(settings: BaseAppSettings):
+    if settings.combined_serving:
+        from api_combined.backbone import shared_backbone
+        return shared_backbone(settings).classifier
+    if settings.backend == "onnx":
+        from .onnx_backend import ONNXSeqClassifier
+        return ONNXSeqClassifier(settings)
+    if settings.adapters:
+        from .registry import AdapterRegistry
+        return AdapterRegistry(settings)
     if settings.clm_for_seq_cls:
         return HFCLMSeqClsClassifier(settings)
     return HFSeqClassifier(settings)
@@ -327,4 +519,4 @@ def get_classifier(settings: BaseAppSettings) -> SingletonFactory:
     """
     Public entrypoint for the API layer. Singleton-ized to reuse loaded weights.
     """
-    return SingletonFactory(lambda: _make_classifier(settings))
+    return SingletonFactory(lambda: _make_classifier(settings), name="seq-cls")
@@ -0,0 +1,173 @@
+# /drs-llm/api_cls/onnx_backend.py
+
+"""
+CPU inference for the seq-cls model with ONNX Runtime.
+
+The model (model_id, its pre-merged artifact when model_id is an adapter, or
+onnx_source_model, e.g. a distilled classifier) is exported once to ONNX, optionally
+dynamically quantized to int8, and cached under onnx_cache_dir. ONNXSeqClassifier
+offers the same predict / predict_batch API as HFSeqClassifier.
+
+Needs `onnx` and `onnxruntime`, which are optional (requirements-onnx.txt, or build the image
+with WITH_ONNX=1); they are imported only when this backend is selected.
+"""
+
+from __future__ import annotations
+import logging
+import os
+import shutil
+from typing import List
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoConfig
+
+from core.settings import BaseAppSettings
+from core.runtime import limited_infer, startup_profile
+from core import timing
+
+from .merge import base_hash
+
+log = logging.getLogger(__name__)
+
+_FP32_FILE = "model.onnx"
+_INT8_FILE = "model.int8.onnx"
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Export wrapper: plain (input_ids, attention_mask) -> logits, no cache or dict outputs."""
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).logits
+
+
+def export_onnx(model_path: str, out_dir: str, *, quantize_int8: bool = True, opset: int = 18) -> str:
+    """Export a full seq-cls model dir to `out_dir` (graph + tokenizer + config); returns the graph to serve."""
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    tok = AutoTokenizer.from_pretrained(model_path, use_fast=True, local_files_only=True)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_path, torch_dtype=torch.float32, low_cpu_mem_usage=True, local_files_only=True
+    )
+    model.eval()
+    if model.config.pad_token_id is None:
+        # Batched Llama seq-cls finds each row's last token through pad_token_id
+        model.config.pad_token_id = tok.pad_token_id if tok.pad_token_id is not None else tok.eos_token_id
+
+    sample = tok(
+        ["warm up export", "a slightly longer warm up export sample"],
+        return_tensors="pt", padding=True, return_token_type_ids=False,
+    )
+    fp32_path = os.path.join(tmp_dir, _FP32_FILE)
+    # torch.export-based exporter: the TorchScript tracer cannot follow the vmap-built attention masks
+    dims = {0: torch.export.Dim("batch"), 1: torch.export.Dim("seq")}
+    torch.onnx.export(
+        _LogitsOnly(model).eval(),
+        (sample["input_ids"], sample["attention_mask"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_shapes=(dims, dims),
+        opset_version=opset,
+        dynamo=True,
+    )
+    if quantize_int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, os.path.join(tmp_dir, _INT8_FILE), weight_type=QuantType.QInt8)
+
+    tok.save_pretrained(tmp_dir)
+    model.config.save_pretrained(tmp_dir)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    log.info("Exported %s to ONNX at %s (int8=%s)", model_path, out_dir, quantize_int8)
+    return os.path.join(out_dir, _INT8_FILE if quantize_int8 else _FP32_FILE)
+
+
+def ensure_onnx_model(model_path: str, cache_dir: str, *, quantize_int8: bool = True) -> str:
+    """Cached ONNX graph for `model_path` (keyed by its config/weights fingerprint), exported on a miss."""
+    out_dir = os.path.join(cache_dir, f"seq-cls-{base_hash(model_path)[:16]}")
+    graph = os.path.join(out_dir, _INT8_FILE if quantize_int8 else _FP32_FILE)
+    if os.path.exists(graph):
+        log.info("Using cached ONNX model %s", graph)
+        return graph
+    if os.path.exists(os.path.join(out_dir, _FP32_FILE)) and quantize_int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(os.path.join(out_dir, _FP32_FILE), graph, weight_type=QuantType.QInt8)
+        return graph
+    os.makedirs(cache_dir, exist_ok=True)
+    return export_onnx(model_path, out_dir, quantize_int8=quantize_int8)
+
+
+def _source_model(settings: BaseAppSettings) -> str:
+    """Full-model dir to export: an explicit (distilled) source, or model_id with adapters pre-merged."""
+    if settings.onnx_source_model:
+        return settings.onnx_source_model
+    from .model_cls import _resolve_merged
+    return _resolve_merged(
+        settings.model_id, settings.base_model_path, settings.merged_cache_dir or ".cache/merged",
+        task="seq-cls", dtype="float32", trust_remote_code=settings.trust_remote_code,
+    )
+
+
+class ONNXSeqClassifier:
+    def __init__(self, settings: BaseAppSettings):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("backend='onnx' needs the onnx and onnxruntime packages") from e
+
+        with startup_profile.phase("onnx_export"):
+            graph = ensure_onnx_model(
+                _source_model(settings), settings.onnx_cache_dir, quantize_int8=settings.onnx_quantize_int8
+            )
+        model_dir = os.path.dirname(graph)
+        with startup_profile.phase("tokenizer"):
+            self._tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True, local_files_only=True)
+        if self._tokenizer.pad_token_id is None and self._tokenizer.eos_token_id is not None:
+            self._tokenizer.pad_token_id = self._tokenizer.eos_token_id
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+        config = AutoConfig.from_pretrained(model_dir, local_files_only=True)
+        self._id2label = config.id2label
+        # Same score function as the torch engines (the pipeline's default function_to_apply)
+        self._sigmoid = config.problem_type == "multi_label_classification" or config.num_labels == 1
+        self._max_length = settings.max_length
+
+        opts = ort.SessionOptions()
+        if settings.onnx_intra_op_threads > 0:
+            opts.intra_op_num_threads = settings.onnx_intra_op_threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        with startup_profile.phase("onnx_session"):
+            self._session = ort.InferenceSession(graph, sess_options=opts, providers=["CPUExecutionProvider"])
+        log.info("ONNX Runtime session ready (%s, intra_op_threads=%s)", graph, settings.onnx_intra_op_threads or "auto")
+
+    def _run(self, texts: List[str]) -> List[tuple[str, float]]:
+        with timing.stage("tokenize"):
+            enc = self._tokenizer(
+                texts, return_tensors="np", padding=True, truncation=True, max_length=self._max_length,
+                return_token_type_ids=False,
+            )
+        timing.count("input_tokens", int(enc["attention_mask"].sum()))
+        with timing.stage("forward"):
+            (logits,) = self._session.run(
+                ["logits"], {"input_ids": enc["input_ids"].astype(np.int64), "attention_mask": enc["attention_mask"].astype(np.int64)}
+            )
+        if self._sigmoid:
+            probs = 1.0 / (1.0 + np.exp(-logits))
+        else:
+            e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs = e / e.sum(axis=-1, keepdims=True)
+        top = probs.argmax(axis=-1)
+        return [(self._id2label[int(i)], float(probs[row, i])) for row, i in enumerate(top)]
+
+    @limited_infer
+    def predict(self, text: str) -> tuple[str, float]:
+        return self._run([text])[0]
+
+    @limited_infer
+    def predict_batch(self, texts: List[str]) -> List[tuple[str, float]]:
+        return self._run(texts)
@@ -0,0 +1,64 @@
+# /drs-llm/api_cls/prediction_cache.py
+
+"""
+In-memory LRU of seq-cls predictions keyed by core.diff_utils.commit_fingerprint.
+
+The fingerprint ignores line numbers, hunk offsets, context and whitespace, so a commit
+that was rebased, cherry-picked or force-pushed under a new SHA hits the entry written
+for its earlier version. Entries are also keyed by adapter, since each adapter is a
+different model, and by input kind: routes build the model input from the same commit in
+different ways (see api_cls.app), and each gives a slightly different prediction.
+"""
+
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+Prediction = Tuple[str, float, Optional[str]]  # (label, confidence, cascade stage)
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Prediction]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, evictions=0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, fingerprint: str, adapter: Optional[str], input_kind: str) -> Optional[Prediction]:
+        if not self.enabled:
+            return None
+        key = (fingerprint, adapter, input_kind)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return hit
+
+    def put(self, fingerprint: str, adapter: Optional[str], input_kind: str, prediction: Prediction) -> None:
+        if not self.enabled:
+            return
+        key = (fingerprint, adapter, input_kind)
+        with self._lock:
+            self._entries[key] = prediction
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            }
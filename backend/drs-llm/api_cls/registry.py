@@ -0,0 +1,212 @@
+# /drs-llm/api_cls/registry.py
+
+"""
+Multi-adapter serving: one base model in memory, several PEFT adapters attached to it.
+
+Adapters are loaded lazily on first use and evicted least-recently-used once their
+combined size exceeds `adapter_memory_budget_mb`. A single dispatcher thread owns the
+model; it groups pending requests for the same adapter into one pipeline batch, so the
+active adapter only switches between batches.
+"""
+
+from __future__ import annotations
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Optional, Tuple
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline as hf_pipeline
+from peft import PeftModel
+
+from core.settings import BaseAppSettings
+from core.runtime import model_kwargs_from_settings, max_concurrency, startup_profile
+
+log = logging.getLogger(__name__)
+
+
+class AdapterUnavailable(RuntimeError):
+    """The adapter cannot be attached to the shared base model (e.g. its vocabulary differs)."""
+
+
+class AdapterRegistry:
+    def __init__(self, settings: BaseAppSettings):
+        if settings.clm_for_seq_cls:
+            raise ValueError("Multi-adapter serving supports sequence-classification adapters only.")
+        if not settings.base_model_path:
+            raise ValueError("base_model_path is required for multi-adapter serving.")
+        self._paths: Dict[str, str] = dict(settings.adapters)
+        self.default_adapter = settings.default_adapter or next(iter(self._paths))
+        if self.default_adapter not in self._paths:
+            raise ValueError(f"default_adapter {self.default_adapter!r} is not in adapters.")
+
+        self._budget_bytes = settings.adapter_memory_budget_mb * 1024 * 1024
+        self._max_batch = settings.adapter_batch_size
+        self._batch_wait_s = settings.adapter_batch_wait_ms / 1000.0
+        # Most callers that can be waiting in predict() at once: every executor slot of every
+        # HTTP worker (central mode forwards all of them here). Once that many are pending,
+        # nobody else can join the batch
+        self._max_callers = max_concurrency() * max(1, settings.workers)
+        self._max_length = settings.max_length
+
+        # All adapters must share the default adapter's (possibly extended) vocabulary
+        with startup_profile.phase("tokenizer"):
+            tok = AutoTokenizer.from_pretrained(
+                self._paths[self.default_adapter], use_fast=True,
+                local_files_only=settings.local_files_only, trust_remote_code=settings.trust_remote_code,
+            )
+        if tok.pad_token_id is None and tok.eos_token_id is not None:
+            tok.pad_token_id = tok.eos_token_id
+            tok.pad_token = tok.eos_token
+
+        kwargs = model_kwargs_from_settings(settings, for_4bit_quant=settings.load_in_4bit)
+        kwargs["device_map"] = settings.device_map
+        with startup_profile.phase("base_weights"):
+            base_model = AutoModelForSequenceClassification.from_pretrained(settings.base_model_path, **kwargs)
+        new_vocab = len(tok)
+        if getattr(base_model.config, "vocab_size", None) != new_vocab:
+            with startup_profile.phase("resize_embeddings"):
+                base_model.resize_token_embeddings(new_vocab, mean_resizing=False, pad_to_multiple_of=8)
+            base_model.config.vocab_size = new_vocab
+        # Batched seq-cls forwards locate the last token through pad_token_id
+        base_model.config.pad_token_id = tok.pad_token_id
+
+        self._tokenizer = tok
+        self._base_model = base_model
+        self._peft: Optional[PeftModel] = None
+        self.pipe = None
+        self._loaded: "OrderedDict[str, int]" = OrderedDict()  # name -> bytes, in LRU order
+        self._unavailable: Dict[str, str] = {}  # name -> why it cannot be attached
+        self._counters = dict(loads=0, evictions=0, batches=0, items=0)
+
+        self._start_dispatcher()
+
+        with startup_profile.phase("adapter_attach"):
+            self._ensure_loaded(self.default_adapter)
+
+    def _start_dispatcher(self) -> None:
+        self._pending: Deque[Tuple[str, str, Future]] = deque()
+        self._cond = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="adapter-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def after_fork(self) -> None:
+        """Threads do not survive fork; core.serve calls this in each worker forked after loading."""
+        self._start_dispatcher()
+
+    # ---- adapter residency ----
+
+    def _adapter_bytes(self, name: str) -> int:
+        marker = f".{name}."
+        return sum(p.numel() * p.element_size() for n, p in self._peft.named_parameters() if marker in n)
+
+    def _ensure_loaded(self, name: str) -> None:
+        """Attach `name` if needed (dispatcher thread or __init__ only) and mark it most recently used."""
+        if name in self._loaded:
+            self._loaded.move_to_end(name)
+            return
+        path = self._paths[name]
+        adapter_tok_len = len(AutoTokenizer.from_pretrained(path, use_fast=True, local_files_only=True))
+        if adapter_tok_len != len(self._tokenizer):
+            self._unavailable[name] = (
+                f"Adapter {name!r} vocab ({adapter_tok_len}) differs from the shared tokenizer ({len(self._tokenizer)})."
+            )
+            raise AdapterUnavailable(self._unavailable[name])
+
+        t0 = time.perf_counter()
+        if self._peft is None:
+            self._peft = PeftModel.from_pretrained(
+                self._base_model, model_id=path, adapter_name=name, is_trainable=False, local_files_only=True
+            )
+            self._peft.eval()
+            self.pipe = hf_pipeline(task="text-classification", model=self._peft, tokenizer=self._tokenizer)
+        else:
+            self._peft.load_adapter(path, adapter_name=name, is_trainable=False, local_files_only=True)
+        self._loaded[name] = self._adapter_bytes(name)
+        self._counters["loads"] += 1
+        log.info("Loaded adapter %s (%.1f MB) in %.2fs", name, self._loaded[name] / 2**20, time.perf_counter() - t0)
+        self._evict_over_budget(keep=name)
+
+    def _evict_over_budget(self, keep: str) -> None:
+        while sum(self._loaded.values()) > self._budget_bytes and len(self._loaded) > 1:
+            victim = next(n for n in self._loaded if n != keep)
+            if victim == self._peft.active_adapter:
+                self._peft.set_adapter(keep)
+            self._peft.delete_adapter(victim)
+            del self._loaded[victim]
+            self._counters["evictions"] += 1
+            log.info("Evicted adapter %s (memory budget %d MB)", victim, self._budget_bytes // 2**20)
+
+    # ---- batching dispatcher ----
+
+    def _next_batch(self) -> Tuple[str, List[Tuple[str, Future]]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            name = self._pending[0][0]
+            # Give concurrent callers up to batch_wait_s to join, unless the batch is already full
+            # or every caller that could join is already pending
+            deadline = time.monotonic() + self._batch_wait_s
+            while (len(self._pending) < self._max_callers
+                   and sum(1 for item in self._pending if item[0] == name) < self._max_batch):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, rest = [], deque()
+            while self._pending:
+                item = self._pending.popleft()
+                if item[0] == name and len(batch) < self._max_batch:
+                    batch.append((item[1], item[2]))
+                else:
+                    rest.append(item)
+            self._pending = rest
+        return name, batch
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            name, batch = self._next_batch()
+            try:
+                self._ensure_loaded(name)
+                self._peft.set_adapter(name)
+                texts = [text for text, _ in batch]
+                out = self.pipe(texts, batch_size=len(texts), truncation=True, max_length=self._max_length)
+                self._counters["batches"] += 1
+                self._counters["items"] += len(batch)
+                for (_, fut), item in zip(batch, out):
+                    fut.set_result((item["label"], float(item["score"])))
+            except Exception as e:
+                log.exception("Batch for adapter %s failed", name)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    # ---- public API (same shape as HFSeqClassifier) ----
+
+    def has_adapter(self, name: str) -> bool:
+        return name in self._paths
+
+    def predict(self, text: str, adapter: Optional[str] = None) -> tuple[str, float]:
+        """Blocking; the dispatcher thread batches this call with others for the same adapter."""
+        name = adapter or self.default_adapter
+        if name not in self._paths:
+            raise ValueError(f"Unknown adapter {name!r}")
+        if name in self._unavailable:
+            raise AdapterUnavailable(self._unavailable[name])
+        fut: Future = Future()
+        with self._cond:
+            self._pending.append((name, text, fut))
+            self._cond.notify()
+        return fut.result()
+
+    def stats(self) -> dict:
+        return {
+            "default_adapter": self.default_adapter,
+            "available": sorted(self._paths),
+            "loaded": {n: round(b / 2**20, 1) for n, b in self._loaded.items()},
+            "unavailable": dict(self._unavailable),
+            "budget_mb": self._budget_bytes // 2**20,
+            "pending": len(self._pending),
+            **self._counters,
+        }
@@ -1,14 +1,61 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class PredictRequest(BaseModel):
     commit_message: str = Field(...)
     code_diff: str = Field(...)
+    # Multi-adapter mode only; defaults to the server's default adapter
+    adapter: Optional[str] = Field(None, example="apachejit_small")
 
 class PredictBySHARequest(BaseModel):
     repo: str = Field(..., example="octocat/Hello-World")
     sha: str = Field(..., example="f9c2a5d...")
+    adapter: Optional[str] = Field(None, example="apachejit_small")
 
 class PredictResponse(BaseModel):
     label: str = Field(...)
     confidence: float = Field(..., ge=0.0, le=1.0)
+    adapter: Optional[str] = None
+    # Cascade mode only: "first" (small model) or "second" (main model) answered
+    stage: Optional[str] = None
+    # Fingerprint of the change (patch-id of the diff + cleaned message); patch_id_match is true
+    # when the result was served from the cache, e.g. for a rebased or cherry-picked commit
+    fingerprint: Optional[str] = None
+    patch_id_match: bool = False
+    # Stage timings and input sizes, only when requested with ?timing=true
+    timing: Optional[dict] = None
+
+class SimilarRequest(BaseModel):
+    # Either the change itself or a commit to fetch from GitHub
+    commit_message: Optional[str] = None
+    code_diff: Optional[str] = None
+    repo: Optional[str] = Field(None, example="octocat/Hello-World")
+    sha: Optional[str] = None
+    k: int = Field(10, ge=1)
+
+class SimilarCommit(BaseModel):
+    score: float
+    fingerprint: str
+    label: Optional[str] = None
+    confidence: Optional[float] = None
+    # "scored" (label predicted by the model) or "labeled" (label supplied via /similar/add)
+    source: str
+    repo: Optional[str] = None
+    sha: Optional[str] = None
+    subject: Optional[str] = None
+
+class SimilarResponse(BaseModel):
+    fingerprint: str
+    # The query was already indexed, so no model call was needed
+    indexed: bool
+    label: Optional[str] = None
+    confidence: Optional[float] = None
+    results: List[SimilarCommit]
+    search_ms: float
+
+class LabeledCommit(BaseModel):
+    commit_message: str
+    code_diff: str
+    label: str
+    repo: Optional[str] = None
+    sha: Optional[str] = None
@@ -0,0 +1,233 @@
+# /drs-llm/api_cls/similar_index.py
+
+"""
+On-disk vector index of commits the seq-cls model has seen, for /similar.
+
+Each commit is stored as the L2-normalized pooled hidden state the classifier head scores
+(the last non-padding token), so cosine similarity is a dot product. Layout under the
+index directory:
+
+    index.json     dim, model_id and projection settings; a mismatch starts a fresh index
+    vectors.f32    (capacity, dim) float32, memory-mapped; capacity doubles as rows are added
+    proj.f32       (capacity, approx_dim) float32 random projection of each row (approx mode)
+    meta.jsonl     one JSON line per write: {"row", "fingerprint", "label", ...}; later
+                   lines for a row replace earlier ones (e.g. a labeled commit over a scored one)
+
+A row's vector is flushed before its metadata line, so a crash mid-add leaves at most
+an unreferenced vector. Rows are keyed by commit_fingerprint; adding a fingerprint again
+updates its metadata and keeps the vector.
+
+Several processes may share one directory (python -m core.serve --workers N). Adds take
+an exclusive lock on index.lock and first read the meta.jsonl lines other processes have
+appended, so each new row number is claimed once; searches and lookups read those lines too.
+
+"exact" scores every row. "approx" scores the projected rows (approx_dim dims instead of
+the model's hidden size), then re-ranks the best `candidates` with the full vectors; it
+searches exactly while the index is smaller than that or approx_dim is not below the hidden size.
+"""
+
+from __future__ import annotations
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+_INITIAL_CAPACITY = 1024
+_PROJECTION_SEED = 1234
+
+
+class SimilarIndex:
+    def __init__(self, path: str, model_id: str, *, mode: str = "exact", approx_dim: int = 256,
+                 candidates: int = 256):
+        self.path = path
+        self.model_id = model_id
+        self.mode = mode
+        self.approx_dim = approx_dim
+        self.candidates = candidates
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._meta: List[dict] = []
+        self._rows: Dict[str, int] = {}
+        self._meta_offset = 0  # bytes of meta.jsonl applied to _meta so far
+        self._vectors: Optional[np.memmap] = None
+        self._proj_vectors: Optional[np.memmap] = None
+        self._projection: Optional[np.ndarray] = None
+        self._counters = dict(added=0, updated=0, searches=0)
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # ---- storage ----
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        header_path = self._file("index.json")
+        if not os.path.exists(header_path):
+            return
+        with open(header_path) as f:
+            header = json.load(f)
+        if header.get("model_id") != self.model_id or header.get("approx_dim") != self.approx_dim:
+            log.warning("Similar index at %s was built for %s (approx_dim %s); starting a new one",
+                        self.path, header.get("model_id"), header.get("approx_dim"))
+            for name in ("index.json", "vectors.f32", "proj.f32", "meta.jsonl"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            return
+        self._sync()
+        log.info("Loaded similar index: %d commits, dim %d", len(self._meta), self.dim)
+
+    def _sync(self) -> None:
+        """Catch up with what other processes wrote since this one last looked (caller holds _lock):
+        the index they created, files they grew, and the meta.jsonl lines they appended."""
+        if self.dim is None:
+            if not os.path.exists(self._file("index.json")):
+                return
+            with open(self._file("index.json")) as f:
+                self._init_dim(json.load(f)["dim"])
+        capacity = os.path.getsize(self._file("vectors.f32")) // (4 * self.dim)
+        if self._vectors is None or self._vectors.shape[0] != capacity:
+            self._open(capacity)
+        meta_path = self._file("meta.jsonl")
+        if not os.path.exists(meta_path) or os.path.getsize(meta_path) == self._meta_offset:
+            return
+        with open(meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # still being written, or torn by a crash (add() terminates it)
+                self._meta_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._set_meta(entry)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Exclusive across processes; released when the file is closed."""
+        with open(self._file("index.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _init_dim(self, dim: int) -> None:
+        self.dim = dim
+        rng = np.random.default_rng(_PROJECTION_SEED)
+        self._projection = (rng.standard_normal((dim, self.approx_dim)) / np.sqrt(self.approx_dim)).astype(np.float32)
+
+    def _open(self, capacity: int) -> None:
+        self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._proj_vectors = np.memmap(self._file("proj.f32"), dtype=np.float32, mode="r+",
+                                       shape=(capacity, self.approx_dim))
+
+    def _grow(self, capacity: int) -> None:
+        for name, width in (("vectors.f32", self.dim), ("proj.f32", self.approx_dim)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * width * 4)
+        self._open(capacity)
+
+    def _create(self, dim: int) -> None:
+        self._init_dim(dim)
+        with open(self._file("index.json"), "w") as f:
+            json.dump({"dim": dim, "model_id": self.model_id, "approx_dim": self.approx_dim}, f)
+        for name in ("vectors.f32", "proj.f32"):
+            open(self._file(name), "wb").close()
+        self._grow(_INITIAL_CAPACITY)
+
+    def _set_meta(self, entry: dict) -> None:
+        row = entry["row"]
+        if row == len(self._meta):
+            self._meta.append(entry)
+        else:
+            self._meta[row] = entry
+        self._rows[entry["fingerprint"]] = row
+
+    # ---- public API ----
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def lookup(self, fingerprint: str) -> Optional[Tuple[np.ndarray, dict]]:
+        """(vector, metadata) of an indexed commit, or None."""
+        with self._lock:
+            self._sync()
+            row = self._rows.get(fingerprint)
+            return None if row is None else (np.array(self._vectors[row]), self._meta[row])
+
+    def add(self, vector: np.ndarray, meta: dict) -> None:
+        """Insert (or update the metadata of) the commit meta["fingerprint"]; vector must be L2-normalized."""
+        with self._lock, self._file_lock():
+            self._sync()
+            if self.dim is None:
+                self._create(vector.shape[-1])
+            row = self._rows.get(meta["fingerprint"])
+            if row is not None:
+                old = self._meta[row]
+                if old.get("source") == "labeled" and meta.get("source") != "labeled":
+                    return  # a prediction never replaces a known label
+                self._counters["updated"] += 1
+            else:
+                row = len(self._meta)
+                if row >= self._vectors.shape[0]:
+                    self._grow(2 * self._vectors.shape[0])
+                self._vectors[row] = vector
+                self._proj_vectors[row] = vector @ self._projection
+                self._vectors.flush()
+                self._proj_vectors.flush()
+                self._counters["added"] += 1
+            entry = {**meta, "row": row, "ts": time.time()}
+            with open(self._file("meta.jsonl"), "ab") as f:
+                # Under the file lock nobody else is writing, so bytes past what _sync read are a
+                # line torn by a crash: end it, and readers skip it
+                torn = f.tell() > self._meta_offset
+                f.write((b"\n" if torn else b"") + (json.dumps(entry) + "\n").encode())
+                self._meta_offset = f.tell()
+            self._set_meta(entry)
+
+    def search(self, vector: np.ndarray, k: int, exclude: Optional[str] = None) -> List[dict]:
+        """Top-k most similar commits (cosine), best first, skipping fingerprint `exclude`."""
+        with self._lock:
+            self._sync()
+            n = len(self._meta)
+            if n == 0:
+                return []
+            self._counters["searches"] += 1
+            if self.mode == "approx" and n > self.candidates and self.approx_dim < self.dim:
+                q = vector @ self._projection
+                rough = self._proj_vectors[:n] @ q
+                rows = np.argpartition(-rough, self.candidates - 1)[:self.candidates]
+                scores = self._vectors[rows] @ vector
+            else:
+                rows = np.arange(n)
+                scores = self._vectors[:n] @ vector
+            want = min(len(scores), k + 1)  # one extra in case the query itself is indexed
+            top = np.argpartition(-scores, want - 1)[:want]
+            top = top[np.argsort(-scores[top])]
+            out = []
+            for i in top:
+                entry = self._meta[int(rows[i])]
+                if entry["fingerprint"] == exclude:
+                    continue
+                out.append({"score": round(float(scores[i]), 4),
+                            **{key: v for key, v in entry.items() if key not in ("row", "ts")}})
+            return out[:k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sync()
+            return {
+                "commits": len(self._meta),
+                "labeled": sum(1 for m in self._meta if m.get("source") == "labeled"),
+                "dim": self.dim,
+                "mode": self.mode,
+                "capacity": 0 if self._vectors is None else self._vectors.shape[0],
+                **self._counters,
+            }
@@ -0,0 +1,79 @@
+# backend/drs-llm/api_combined/app.py
+
+"""
+Combined serving mode: seq-cls and CLM routes in one process on one copy of the base model.
+
+    DRSLLM_COMBINED_SERVING=true uvicorn api_combined.app:app
+
+The routes of both services are mounted unchanged under /seq-cls and /clm (point the
+gateway's SEQ_BASE / CLM_BASE at those prefixes). Each keeps its own inference queue,
+and the shared model alternates between them, so explanation decoding cannot starve
+classification.
+"""
+
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from core.settings import get_settings
+from core.runtime import SingletonFactory, startup_profile, start_model, run_warmup
+from core.timing import ServerTimingMiddleware
+from api_cls import app as cls_service
+from api_clm import app as clm_service
+
+from .backbone import shared_backbone
+
+settings = get_settings()
+log = logging.getLogger(__name__)
+
+if not settings.combined_serving:
+    raise RuntimeError("api_combined requires DRSLLM_COMBINED_SERVING=true")
+
+backbone_singleton = SingletonFactory(lambda: shared_backbone(settings), name="combined")
+
+
+def _warmup(backbone) -> None:
+    # Through the services' singletons (backbone.classifier / .generator), which core.serve may proxy
+    lengths = [min(n, settings.max_length) for n in settings.warmup_lengths]
+    run_warmup(cls_service.clf_singleton.get().predict, cls_service.warmup_input, lengths, name="warmup_cls")
+    run_warmup(clm_service.gen_singleton.get().infer_text, clm_service.warmup_input, lengths, name="warmup_clm")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log.info("Initializing shared backbone for seq-cls + CLM (in background)...")
+    startup = asyncio.create_task(start_model(backbone_singleton, _warmup))
+    cls_service.job_runner.start()
+    clm_service.job_runner.start()
+    yield
+    cls_service.job_runner.stop()
+    clm_service.job_runner.stop()
+    startup.cancel()
+
+app = FastAPI(title="DRS-LLM API (Combined SeqCls + CLM)", version="0.1.0", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(ServerTimingMiddleware)
+
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "model_id": settings.model_id,
+        "base_model_path": settings.base_model_path,
+        "startup": startup_profile.as_dict(),
+        "inference": {"seq_cls": cls_service.executor.stats(), "clm": clm_service.executor.stats()},
+    }
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the shared model is loaded and both paths are warmed up."""
+    if not startup_profile.ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True}
+
+
+app.include_router(cls_service.router, prefix="/seq-cls")
+app.include_router(clm_service.router, prefix="/clm")
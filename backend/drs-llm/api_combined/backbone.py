@@ -0,0 +1,156 @@
+# /drs-llm/api_combined/backbone.py
+
+"""
+One copy of the base Llama weights serving both tasks.
+
+The causal LM is loaded once; a sequence-classification view is built on the same decoder
+(only the small `score` head is new) and the seq-cls PEFT adapter is attached to that view.
+The LoRA layers therefore live inside the shared decoder: classification runs with them,
+and generation runs inside `disable_adapter()`, i.e. on the plain base weights, exactly
+what the standalone CLM service serves.
+"""
+
+from __future__ import annotations
+import copy
+import logging
+import threading
+from typing import Optional
+
+import torch
+from transformers import (AutoTokenizer, AutoModelForCausalLM, AutoModelForSequenceClassification, StoppingCriteriaList,
+                          pipeline as hf_pipeline)
+from peft import PeftModel
+
+from core.settings import BaseAppSettings
+from core.runtime import LaneLock, model_kwargs_from_settings, startup_profile
+from api_cls.model_cls import _is_peft_adapter
+from api_clm.model_clm import Generation, _StopControl
+
+log = logging.getLogger(__name__)
+
+_backbone: Optional["SharedBackbone"] = None
+_backbone_lock = threading.Lock()
+
+
+def _seq_cls_view(clm: torch.nn.Module, num_labels: int, pad_token_id: Optional[int]) -> torch.nn.Module:
+    """A seq-cls model whose decoder *is* `clm`'s decoder; only the score head is allocated."""
+    config = copy.deepcopy(clm.config)
+    config.num_labels = num_labels
+    config.pad_token_id = pad_token_id
+    with torch.device("meta"):
+        seq = AutoModelForSequenceClassification.from_config(config)
+    setattr(seq, seq.base_model_prefix, getattr(clm, clm.base_model_prefix))
+    head = clm.get_output_embeddings().weight
+    # Real values come from the adapter's modules_to_save; this only materializes the shape
+    seq.score = torch.nn.Linear(config.hidden_size, num_labels, bias=False, device=head.device, dtype=head.dtype)
+    if hasattr(clm, "hf_device_map"):
+        seq.hf_device_map = clm.hf_device_map
+    return seq
+
+
+class SharedBackbone:
+    def __init__(self, settings: BaseAppSettings):
+        if settings.adapters or settings.clm_for_seq_cls:
+            raise ValueError("Combined serving supports a single sequence-classification adapter only.")
+        if not settings.base_model_path or not _is_peft_adapter(settings.model_id):
+            raise ValueError("Combined serving needs model_id to be a PEFT adapter on base_model_path.")
+
+        with startup_profile.phase("tokenizer"):
+            gen_tok = AutoTokenizer.from_pretrained(
+                settings.base_model_path, use_fast=True, local_files_only=True, trust_remote_code=settings.trust_remote_code
+            )
+            cls_tok = AutoTokenizer.from_pretrained(
+                settings.model_id, use_fast=True, local_files_only=True, trust_remote_code=settings.trust_remote_code
+            )
+        gen_tok.truncation_side = "right"
+        gen_tok.model_max_length = settings.max_length
+        if cls_tok.pad_token_id is None and cls_tok.eos_token_id is not None:
+            cls_tok.pad_token_id = cls_tok.eos_token_id
+            cls_tok.pad_token = cls_tok.eos_token
+
+        kwargs = model_kwargs_from_settings(settings, for_4bit_quant=settings.load_in_4bit)
+        kwargs["device_map"] = settings.device_map
+        with startup_profile.phase("base_weights"):
+            clm = AutoModelForCausalLM.from_pretrained(settings.base_model_path, **kwargs)
+        clm.eval()
+
+        # The adapter tokenizer may add tokens; generation must never emit those ids
+        base_vocab = clm.config.vocab_size
+        if len(cls_tok) != base_vocab:
+            with startup_profile.phase("resize_embeddings"):
+                clm.resize_token_embeddings(len(cls_tok), mean_resizing=False, pad_to_multiple_of=8)
+        padded_vocab = clm.get_input_embeddings().weight.shape[0]
+        suppress = list(range(base_vocab, padded_vocab))
+
+        with startup_profile.phase("adapter_attach"):
+            # Same label count the standalone service gets from the base config
+            seq = _seq_cls_view(clm, clm.config.num_labels, cls_tok.pad_token_id)
+            self._peft = PeftModel.from_pretrained(
+                seq, model_id=settings.model_id, is_trainable=False, local_files_only=True
+            )
+            self._peft.eval()
+
+        with startup_profile.phase("pipeline"):
+            cls_pipe = hf_pipeline(task="text-classification", model=self._peft, tokenizer=cls_tok)
+
+        self.lock = LaneLock(("classify", "generate"))
+        self.classifier = SharedClassifier(self, cls_pipe, settings.max_length)
+        self.generator = SharedGenerator(self, clm, gen_tok, settings, suppress)
+        log.info("Combined backbone ready (suppressed %d adapter-only token ids in generation).", len(suppress))
+
+
+class SharedClassifier:
+    """Same API as HFSeqClassifier, on the shared backbone with the adapter enabled."""
+    def __init__(self, backbone: SharedBackbone, pipe, max_length: int):
+        self._backbone = backbone
+        self.pipe = pipe
+        self._max_length = max_length
+
+    def predict(self, text: str) -> tuple[str, float]:
+        with self._backbone.lock.hold("classify"):
+            out = self.pipe(text, truncation=True, max_length=self._max_length)
+        item = out[0] if isinstance(out, list) else out
+        return item["label"], float(item["score"])
+
+
+class SharedGenerator:
+    """Same API as HFGenerator, on the shared backbone with the adapter disabled."""
+    def __init__(self, backbone: SharedBackbone, model, tok, settings: BaseAppSettings, suppress_tokens: list):
+        self._backbone = backbone
+        self._model = model
+        self.tok = tok
+        self._max_length = settings.max_length
+        self.stop_strings = list(settings.clm_stop_strings)
+        self.generate_params = dict(
+            max_new_tokens=settings.clm_max_new_tokens,
+            do_sample=False,
+            eos_token_id=tok.eos_token_id,
+            pad_token_id=tok.eos_token_id,
+        )
+        if suppress_tokens:
+            self.generate_params["suppress_tokens"] = suppress_tokens
+
+    def infer(self, prompt: str, max_new_tokens: Optional[int] = None, max_time_s: Optional[float] = None) -> Generation:
+        enc = self.tok(prompt, return_tensors="pt", truncation=True, max_length=self._max_length, return_token_type_ids=False)
+        enc = enc.to(self._model.device)
+        n_tokens = enc["input_ids"].shape[1]
+        limit = max_new_tokens or self.generate_params["max_new_tokens"]
+        control = _StopControl(self.tok, n_tokens, [limit], [max_time_s], self.stop_strings)
+        with self._backbone.lock.hold("generate"), self._backbone._peft.disable_adapter(), torch.inference_mode():
+            out = self._model.generate(**enc, stopping_criteria=StoppingCriteriaList([control]),
+                                       **{**self.generate_params, "max_new_tokens": limit})
+        text = self.tok.decode(out[0, n_tokens:], skip_special_tokens=True)
+        return control.results([text], [prompt])[0]
+
+    def infer_text(self, prompt: str) -> str:
+        return self.infer(prompt).text
+
+
+def shared_backbone(settings: BaseAppSettings) -> SharedBackbone:
+    """Process-wide backbone; both service singletons resolve to views of this one object."""
+    global _backbone
+    if _backbone is None:
+        with _backbone_lock:
+            if _backbone is None:
+                _backbone = SharedBackbone(settings)
+    return _backbone
@@ -0,0 +1,126 @@
+# /drs-llm/bench/cascade.py
+
+"""
+Confidence cascade: throughput gain vs. accuracy delta against the main classifier alone.
+
+    DRSLLM_CASCADE_FIRST_STAGE=/models/small-cls python -m bench.cascade --data labeled.jsonl
+
+`--data` is JSONL with commit_message, code_diff and label per line. Without it,
+synthetic diffs are scored and the main model's own predictions act as labels (so
+"accuracy" is agreement with the main model).
+
+Both stages score every item once; each upper band edge in --highs is then evaluated
+offline (escalate when low <= first-stage confidence < high), with throughput
+estimated from the measured per-item cost of each stage. The configured band is also
+run end to end through CascadeClassifier.predict_batch.
+"""
+
+import argparse
+import json
+import time
+
+from core.settings import BaseAppSettings
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from api_cls.model_cls import _make_main_classifier
+from api_cls.cascade import CascadeClassifier, FIRST_STAGE
+
+
+def _load(path: str, n: int):
+    texts, labels = [], []
+    if path:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                texts.append(diff_to_structured_xml(item["code_diff"], item.get("commit_message", ""), strict=False))
+                labels.append(str(item["label"]))
+                if len(texts) == n:
+                    break
+        return texts, labels
+    tiers = [64, 256, 1024]
+    texts = [
+        diff_to_structured_xml(synthetic_diff(tiers[i % len(tiers)] + i), f"Benchmark commit {i}", strict=False)
+        for i in range(n)
+    ]
+    return texts, None
+
+
+def _timed_batches(fn, texts, batch: int):
+    fn(texts[:batch])  # warm-up
+    out = []
+    t0 = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        out.extend(fn(texts[i:i + batch]))
+    return out, time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default=None, help="labeled JSONL (commit_message, code_diff, label)")
+    ap.add_argument("--items", type=int, default=64)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--highs", default="0.6,0.7,0.8,0.9,0.95,0.99", help="upper band edges to evaluate")
+    args = ap.parse_args()
+
+    settings = BaseAppSettings()
+    if not settings.cascade_first_stage:
+        ap.error("set DRSLLM_CASCADE_FIRST_STAGE to the first-stage model")
+    main_clf = _make_main_classifier(settings)
+    cascade = CascadeClassifier(settings, main_clf)
+    texts, labels = _load(args.data, args.items)
+    n = len(texts)
+
+    def second(batch):
+        if hasattr(main_clf, "predict_batch"):
+            return main_clf.predict_batch(batch)
+        return [main_clf.predict(t) for t in batch]
+
+    first_out, t_first = _timed_batches(cascade._first, texts, args.batch)
+    second_out, t_second = _timed_batches(second, texts, args.batch)
+    if labels is None:
+        labels = [label for label, _ in second_out]
+
+    def accuracy(preds):
+        return round(sum(p == y for p, y in zip(preds, labels)) / n, 4)
+
+    full_acc = accuracy([label for label, _ in second_out])
+    low = settings.cascade_band[0]
+    sweep = []
+    for high in (float(h) for h in args.highs.split(",")):
+        escalated = [low <= conf < high for _, conf in first_out]
+        preds = [s[0] if esc else f[0] for f, s, esc in zip(first_out, second_out, escalated)]
+        frac = sum(escalated) / n
+        est_s = t_first + t_second * frac
+        sweep.append({
+            "band": [low, high],
+            "escalation_rate": round(frac, 4),
+            "accuracy": accuracy(preds),
+            "accuracy_delta": round(accuracy(preds) - full_acc, 4),
+            "est_items_per_s": round(n / est_s, 2),
+            "est_speedup": round(t_second / est_s, 2),
+        })
+
+    measured, t_cascade = _timed_batches(cascade.predict_batch, texts, args.batch)
+    results = {
+        "items": n,
+        "labels": "data" if args.data else "main-model predictions",
+        "main_only": {"items_per_s": round(n / t_second, 2), "accuracy": full_acc},
+        "first_stage_only": {
+            "items_per_s": round(n / t_first, 2),
+            "accuracy": accuracy([label for label, _ in first_out]),
+        },
+        "band_sweep": sweep,
+        "configured_band": {
+            "band": settings.cascade_band,
+            "items_per_s": round(n / t_cascade, 2),
+            "speedup": round(t_second / t_cascade, 2),
+            "escalation_rate": round(sum(stage != FIRST_STAGE for _, _, stage in measured) / n, 4),
+            "accuracy": accuracy([label for label, _, _ in measured]),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
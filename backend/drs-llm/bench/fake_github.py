@@ -0,0 +1,55 @@
+# /drs-llm/bench/fake_github.py
+
+"""
+Local stand-in for the GitHub commits API used by /predict_by_sha.
+
+Serves GET /repos/{owner}/{repo}/commits/{sha} as JSON (commit.message) or, with
+`Accept: application/vnd.github.v3.diff`, as a unified diff, and
+GET /repos/{owner}/{repo}/pulls/{number}/commits as `number` commits on the default tiers. A sha of the form
+"tier-<tokens>-<anything>" returns a synthetic diff of roughly that many tokens;
+other shas map deterministically onto the default tiers. Point the services at it
+with DRSLLM_GITHUB_API_BASE.
+
+    uvicorn bench.fake_github:app --port 8090
+"""
+
+import hashlib
+import os
+import re
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from core.diff_utils import synthetic_diff
+
+TIERS = [int(t) for t in os.getenv("FAKE_GITHUB_TIERS", "64,256,1024,4000").split(",")]
+_TIER_SHA = re.compile(r"^tier-(\d+)(?:-.*)?$")
+
+app = FastAPI(title="Fake GitHub API", version="0.1.0")
+
+
+def tokens_for_sha(sha: str) -> int:
+    m = _TIER_SHA.match(sha)
+    if m:
+        return int(m.group(1))
+    return TIERS[int(hashlib.sha1(sha.encode()).hexdigest(), 16) % len(TIERS)]
+
+
+@app.get("/repos/{owner}/{repo}/commits/{sha}")
+def commit(owner: str, repo: str, sha: str, request: Request):
+    diff = synthetic_diff(tokens_for_sha(sha))
+    if "diff" in request.headers.get("accept", ""):
+        return PlainTextResponse(diff)
+    patch = diff[diff.index("@@"):]
+    return JSONResponse({
+        "sha": sha,
+        "commit": {"message": f"Synthetic commit {sha} in {owner}/{repo}\n\nFixes #123"},
+        "stats": {"additions": patch.count("\n+"), "deletions": 0, "total": patch.count("\n+")},
+        "files": [{"filename": "src/Synthetic.java", "status": "modified", "patch": patch}],
+    })
+
+
+@app.get("/repos/{owner}/{repo}/pulls/{number}/commits")
+def pull_commits(owner: str, repo: str, number: int, per_page: int = Query(30, le=100), page: int = 1):
+    shas = [f"pr{number}-{i}" for i in range(min(number, 250))]
+    return JSONResponse([{"sha": sha} for sha in shas[(page - 1) * per_page:page * per_page]])
@@ -0,0 +1,78 @@
+# /drs-llm/bench/import_time.py
+
+"""
+Import time of the non-model modules, each in a fresh interpreter, and whether importing
+them loaded any of the ML stack (torch, transformers, bitsandbytes, peft).
+
+    python -m bench.import_time                   # exits 1 if a light module is slow or heavy
+    python -m bench.import_time --also api_cls.app --max-s 0.5
+
+Each module is imported --repeat times (fresh process each) and the best time is kept,
+so one slow filesystem cache miss does not fail the check. --also adds modules that are
+reported but not checked (e.g. the apps, which load torch for their models).
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+LIGHT = [
+    "core.diff_utils",
+    "core.preprocess",
+    "core.settings",
+    "core.github_client",
+    "core.timing",
+    "core.runtime",
+    "core.streaming",
+    "core.jobs",
+    "api_cls.schemas",
+    "api_clm.schemas",
+]
+HEAVY = ("torch", "transformers", "bitsandbytes", "peft")
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t0
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"module": module, "error": out.stderr.strip().splitlines()[-1]}
+        run = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or run["seconds"] < best["seconds"]:
+            best = run
+    return {"module": module, "seconds": round(best["seconds"], 3), "heavy": best["heavy"]}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-s", type=float, default=1.0, help="limit for each light module")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--also", nargs="*", default=[], help="extra modules to report without checking")
+    args = ap.parse_args()
+
+    failures = []
+    results = []
+    for module in LIGHT + args.also:
+        r = measure(module, args.repeat)
+        if module in LIGHT:
+            if "error" in r:
+                failures.append(f"{module}: {r['error']}")
+            elif r["heavy"] or r["seconds"] > args.max_s:
+                failures.append(f"{module}: {r['seconds']}s, loaded {r['heavy'] or 'nothing heavy'}")
+        results.append(r)
+    print(json.dumps({"max_s": args.max_s, "modules": results, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
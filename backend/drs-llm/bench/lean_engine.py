@@ -0,0 +1,83 @@
+# /drs-llm/bench/lean_engine.py
+
+"""
+Per-request overhead: HF text-classification pipeline vs. the direct seq-cls engine.
+
+    python -m bench.lean_engine --requests 50 --batch 8
+
+Both paths run on the same loaded weights (the engine wraps the pipeline's model), so
+the latency difference is pipeline bookkeeping, not the forward. Short inputs make that
+overhead visible; parity is label agreement and max |score diff| against the pipeline.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from core.settings import BaseAppSettings
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from api_cls.model_cls import HFSeqClassifier, DirectSeqClsEngine
+
+
+def _latency_ms(fn, arg, n: int) -> dict:
+    fn(arg)  # warm-up
+    lat = []
+    for _ in range(n):
+        t = time.perf_counter()
+        fn(arg)
+        lat.append((time.perf_counter() - t) * 1000.0)
+    return {"p50_ms": round(statistics.median(lat), 3), "mean_ms": round(statistics.fmean(lat), 3)}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=50)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--tokens", type=int, default=64, help="approximate input length per item")
+    ap.add_argument("--compile", action="store_true", help="also time the engine under torch.compile")
+    args = ap.parse_args()
+
+    settings = BaseAppSettings().model_copy(update={"seq_cls_engine": "pipeline"})
+    clf = HFSeqClassifier(settings)
+    pipe, max_length = clf.pipe, settings.max_length
+    texts = [
+        diff_to_structured_xml(synthetic_diff(args.tokens + 8 * i), f"Benchmark commit {i}", strict=False)
+        for i in range(args.batch)
+    ]
+
+    def pipe_one(text):
+        item = pipe(text, truncation=True, max_length=max_length)
+        item = item[0] if isinstance(item, list) else item
+        return item["label"], float(item["score"])
+
+    def pipe_batch(batch):
+        return [(o["label"], float(o["score"])) for o in pipe(batch, batch_size=len(batch), truncation=True, max_length=max_length)]
+
+    engines = {"direct": DirectSeqClsEngine(pipe.model, pipe.tokenizer, max_length)}
+    if args.compile:
+        engines["direct_compiled"] = DirectSeqClsEngine(pipe.model, pipe.tokenizer, max_length, compile=True)
+
+    ref = pipe_batch(texts)
+    results = {
+        "pipeline": {
+            "single": _latency_ms(pipe_one, texts[0], args.requests),
+            "batch": _latency_ms(pipe_batch, texts, args.requests),
+        }
+    }
+    for name, engine in engines.items():
+        out = engine(texts)
+        results[name] = {
+            "single": _latency_ms(lambda t: engine([t]), texts[0], args.requests),
+            "batch": _latency_ms(engine, texts, args.requests),
+            "label_agreement": sum(a[0] == b[0] for a, b in zip(ref, out)) / len(ref),
+            "max_abs_score_diff": round(max(abs(a[1] - b[1]) for a, b in zip(ref, out)), 6),
+        }
+        for mode in ("single", "batch"):
+            saved = results["pipeline"][mode]["p50_ms"] - results[name][mode]["p50_ms"]
+            results[name][mode]["overhead_removed_ms"] = round(saved, 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+# /drs-llm/bench/loadtest.py
+
+"""
+End-to-end load test: gateway + seq-cls + CLM services on tiny random Llama models,
+with a local fake GitHub behind /predict_by_sha.
+
+    python -m bench.loadtest --rates 1,4 --duration 15 --out run.json
+    python -m bench.loadtest --workload workload.jsonl --rates 2
+    python -m bench.loadtest --target http://localhost:8080 --tiers 64,1024   # existing stack
+    python -m bench.loadtest --compare old.json new.json
+
+Workloads are synthetic diffs in size tiers (approximate tokens) per endpoint, or a
+JSONL replay file with one request per line:
+    {"endpoint": "seq-cls/predict", "commit_message": "...", "code_diff": "..."}
+    {"endpoint": "clm/predict_by_sha", "repo": "apache/flink", "sha": "tier-1024-a"}
+("endpoint" defaults to seq-cls/predict; the other keys are the request body).
+
+Arrivals are open-loop: requests are sent on a Poisson schedule at each rate whether
+or not earlier ones have finished, so queueing shows up in the latency tail instead of
+silently lowering the offered load. Each scenario reports p50/p95/p99 latency of
+successful requests, throughput, status counts and peak RSS of every local service.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from core.diff_utils import synthetic_diff
+
+DRS_LLM_DIR = Path(__file__).resolve().parents[1]
+GATEWAY_DIR = DRS_LLM_DIR.parent / "gateway"
+
+ENDPOINTS = ("seq-cls/predict", "seq-cls/predict_by_sha", "seq-cls/predict_batch", "clm/predict", "clm/predict_by_sha")
+
+
+# ---- local stack ----
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status_mb(pid: int, field: str) -> Optional[float]:
+    """VmRSS / VmHWM of a process in MB (Linux /proc; None elsewhere or once it exited)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+class _Stack:
+    """Fake GitHub, seq-cls, CLM and gateway as uvicorn subprocesses on free local ports."""
+
+    def __init__(self, workdir: Path, models: Dict[str, str], args: argparse.Namespace):
+        self.workdir = workdir
+        self.models = models
+        self.args = args
+        self.procs: Dict[str, subprocess.Popen] = {}
+        self.ports = {name: _free_port() for name in ("github", "seq_cls", "clm", "gateway")}
+
+    @property
+    def gateway_url(self) -> str:
+        return f"http://127.0.0.1:{self.ports['gateway']}"
+
+    def _spawn(self, name: str, app: str, cwd: Path, env: Dict[str, str]) -> None:
+        log_dir = self.workdir / "logs"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log = open(log_dir / f"{name}.log", "w")
+        self.procs[name] = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(self.ports[name])],
+            cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+        )
+
+    def _model_env(self, model_path: str) -> Dict[str, str]:
+        return {
+            "DRSLLM_MODEL_ID": model_path,
+            "DRSLLM_BASE_MODEL_PATH": "",
+            "DRSLLM_MERGED_CACHE_DIR": "",
+            "DRSLLM_LOAD_IN_4BIT": "false",
+            "DRSLLM_DTYPE": "float32",
+            "DRSLLM_DEVICE_MAP": "cpu",
+            "DRSLLM_MAX_LENGTH": str(self.args.max_length),
+            "DRSLLM_CLM_FOR_SEQ_CLS": "false",
+            "DRSLLM_WARMUP_LENGTHS": "[64]",
+            "DRSLLM_LOG_LEVEL": "WARNING",
+            "DRSLLM_ACCESS_LOG_LEVEL": "WARNING",
+            "DRSLLM_GITHUB_API_BASE": f"http://127.0.0.1:{self.ports['github']}",
+            "DRSLLM_MAX_QUEUE": str(self.args.max_queue),
+            "DRSLLM_JOBS_DB_PATH": str(self.workdir / "jobs" / "{service}.sqlite3"),
+            # The payloads repeat, so cached predictions would stand in for inference; keep
+            # results comparable across runs by measuring the model every time
+            "DRSLLM_PREDICTION_CACHE_SIZE": "0",
+        }
+
+    def start(self) -> None:
+        self._spawn("github", "bench.fake_github:app", DRS_LLM_DIR, {})
+        self._spawn("seq_cls", "api_cls.app:app", DRS_LLM_DIR, self._model_env(self.models["seq_cls"]))
+        self._spawn("clm", "api_clm.app:app", DRS_LLM_DIR, self._model_env(self.models["clm"]))
+        self._spawn("gateway", "app:app", GATEWAY_DIR, {
+            "SEQ_BASE": f"http://127.0.0.1:{self.ports['seq_cls']}",
+            "CLM_BASE": f"http://127.0.0.1:{self.ports['clm']}",
+            "GATEWAY_TIMEOUT_S": str(self.args.timeout),
+            "GATEWAY_READY_TTL_S": "1",
+            "GATEWAY_GITHUB_API_BASE": f"http://127.0.0.1:{self.ports['github']}",
+        })
+
+    def stop(self) -> None:
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def rss_mb(self) -> Dict[str, Optional[float]]:
+        return {name: _proc_status_mb(p.pid, "VmRSS") for name, p in self.procs.items()}
+
+    def peak_rss_mb(self) -> Dict[str, Optional[float]]:
+        return {name: _proc_status_mb(p.pid, "VmHWM") for name, p in self.procs.items()}
+
+    def check_alive(self) -> None:
+        for name, proc in self.procs.items():
+            if proc.poll() is not None:
+                raise RuntimeError(f"{name} exited with {proc.returncode}; see {self.workdir / 'logs' / (name + '.log')}")
+
+
+async def wait_ready(client: httpx.AsyncClient, gateway_url: str, timeout_s: float, stack: Optional[_Stack]) -> dict:
+    """Poll the gateway until both upstreams report ready; returns the gateway /health body."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        if stack is not None:
+            stack.check_alive()
+        try:
+            r = await client.get(f"{gateway_url}/health")
+            body = r.json()
+            if all(u.get("ready") for u in body["upstreams"].values()):
+                return body
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Stack at {gateway_url} not ready after {timeout_s}s")
+        await asyncio.sleep(0.5)
+
+
+# ---- workloads ----
+
+def synthetic_workload(endpoints: List[str], tiers: List[int], n: int) -> List[Tuple[str, str, List]]:
+    """(scenario name, endpoint, request bodies) for every endpoint x size tier."""
+    out = []
+    for endpoint in endpoints:
+        for tier in tiers:
+            if endpoint.endswith("predict_by_sha"):
+                bodies = [{"repo": "bench/repo", "sha": f"tier-{tier}-{i}"} for i in range(n)]
+            else:
+                bodies = [
+                    {"commit_message": f"Benchmark commit {i}", "code_diff": synthetic_diff(tier + i % 8)}
+                    for i in range(n)
+                ]
+                if endpoint.endswith("predict_batch"):
+                    bodies = [bodies[i:i + 4] for i in range(0, n, 4)]
+            out.append((f"{endpoint}@{tier}", endpoint, bodies))
+    return out
+
+
+def replay_workload(path: str) -> List[Tuple[str, str, List]]:
+    """Group a JSONL replay file by endpoint."""
+    by_endpoint: Dict[str, List] = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            endpoint = item.pop("endpoint", "seq-cls/predict").strip("/")
+            by_endpoint.setdefault(endpoint, []).append(item.pop("body", item))
+    return [(f"{endpoint}@replay", endpoint, bodies) for endpoint, bodies in by_endpoint.items()]
+
+
+# ---- open-loop driver ----
+
+def _latency_summary(lat_ms: List[float]) -> dict:
+    if not lat_ms:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    if len(lat_ms) == 1:
+        q = lat_ms * 99
+    else:
+        q = statistics.quantiles(lat_ms, n=100, method="inclusive")
+    return {
+        "p50_ms": round(q[49], 2),
+        "p95_ms": round(q[94], 2),
+        "p99_ms": round(q[98], 2),
+        "mean_ms": round(statistics.fmean(lat_ms), 2),
+        "max_ms": round(max(lat_ms), 2),
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    base_url: str,
+    name: str,
+    endpoint: str,
+    bodies: List,
+    *,
+    rate: float,
+    duration_s: float,
+    stack: Optional[_Stack],
+    seed: int = 0,
+) -> dict:
+    rng = random.Random(seed)
+    url = f"{base_url}/{endpoint}"
+    results: List[Tuple[float, int]] = []
+    peak_rss: Dict[str, float] = {}
+    done = asyncio.Event()
+
+    async def one(body) -> None:
+        t = time.perf_counter()
+        try:
+            r = await client.post(url, json=body)
+            status = r.status_code
+        except httpx.TimeoutException:
+            status = 0
+        except httpx.HTTPError:
+            status = -1
+        results.append(((time.perf_counter() - t) * 1000.0, status))
+
+    async def sample_memory() -> None:
+        while not done.is_set():
+            for proc, mb in stack.rss_mb().items():
+                if mb is not None:
+                    peak_rss[proc] = max(peak_rss.get(proc, 0.0), mb)
+            await asyncio.sleep(0.25)
+
+    sampler = asyncio.create_task(sample_memory()) if stack is not None else None
+    tasks = []
+    t0 = time.perf_counter()
+    next_at = 0.0
+    i = 0
+    while next_at < duration_s:
+        delay = t0 + next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(bodies[i % len(bodies)])))
+        i += 1
+        next_at += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    done.set()
+    if sampler is not None:
+        await sampler
+
+    statuses: Dict[str, int] = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [ms for ms, status in results if 200 <= status < 300]
+    items_per_request = len(bodies[0]) if isinstance(bodies[0], list) else 1
+    return {
+        "name": name,
+        "endpoint": endpoint,
+        "offered_rps": rate,
+        "duration_s": round(elapsed, 3),
+        "sent": len(results),
+        "ok": len(ok),
+        "statuses": statuses,
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "throughput_items_per_s": round(len(ok) * items_per_request / elapsed, 3),
+        **_latency_summary(ok),
+        "peak_rss_mb": {k: round(v, 1) for k, v in peak_rss.items()},
+    }
+
+
+# ---- results ----
+
+def _meta(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=DRS_LLM_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    versions = {}
+    for mod in ("torch", "transformers", "fastapi"):
+        try:
+            versions[mod] = __import__(mod).__version__
+        except ImportError:
+            versions[mod] = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+        "args": {k: v for k, v in vars(args).items() if k != "compare"},
+    }
+
+
+def compare(old_path: str, new_path: str) -> dict:
+    """Per-scenario relative change (new/old - 1) of latency percentiles and throughput."""
+    def load(path):
+        with open(path) as f:
+            return {(s["name"], s["offered_rps"]): s for s in json.load(f)["scenarios"]}
+
+    old, new = load(old_path), load(new_path)
+    out = {}
+    for key in sorted(set(old) & set(new), key=str):
+        o, n = old[key], new[key]
+        row = {}
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if o.get(metric) and n.get(metric) is not None:
+                row[metric] = {"old": o[metric], "new": n[metric], "change": round(n[metric] / o[metric] - 1.0, 4)}
+        out[f"{key[0]} @ {key[1]} rps"] = row
+    return out
+
+
+async def _main(args: argparse.Namespace) -> dict:
+    workdir = Path(args.workdir).resolve()
+    stack = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        from bench.tiny_model import build_tiny_models
+        models = build_tiny_models(
+            str(workdir / "models"), hidden_size=args.hidden_size, num_layers=args.layers,
+            max_positions=max(args.max_length, 512),
+        )
+        stack = _Stack(workdir, models, args)
+        stack.start()
+        base_url = stack.gateway_url
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            t0 = time.perf_counter()
+            health = await wait_ready(client, base_url, args.startup_timeout, stack)
+            startup_s = time.perf_counter() - t0
+            startup = {}
+            for svc in ("seq-cls", "clm"):
+                with contextlib.suppress(httpx.HTTPError, ValueError):
+                    startup[svc] = (await client.get(f"{base_url}/{svc}/health")).json().get("startup")
+
+            if args.workload:
+                scenarios = replay_workload(args.workload)
+            else:
+                scenarios = synthetic_workload(args.endpoints, args.tiers, args.items)
+            report = {
+                "meta": _meta(args),
+                "stack": {"ready_after_s": round(startup_s, 2), "gateway_health": health, "startup": startup},
+                "scenarios": [],
+            }
+            for name, endpoint, bodies in scenarios:
+                for rate in args.rates:
+                    result = await run_scenario(
+                        client, base_url, name, endpoint, bodies,
+                        rate=rate, duration_s=args.duration, stack=stack, seed=args.seed,
+                    )
+                    print(
+                        f"{name:<36} {rate:>6.2f} rps  ok={result['ok']}/{result['sent']}  "
+                        f"p50={result['p50_ms']} p95={result['p95_ms']} p99={result['p99_ms']} ms  "
+                        f"tput={result['throughput_rps']} rps",
+                        file=sys.stderr,
+                    )
+                    report["scenarios"].append(result)
+            if stack is not None:
+                report["stack"]["peak_rss_mb"] = {k: v and round(v, 1) for k, v in stack.peak_rss_mb().items()}
+            return report
+    finally:
+        if stack is not None:
+            stack.stop()
+
+
+def _csv(cast):
+    return lambda s: [cast(x) for x in s.split(",") if x]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Open-loop load test of the gateway and both services.")
+    ap.add_argument("--target", default=None, help="gateway URL of a running stack (default: start a local tiny stack)")
+    ap.add_argument("--workload", default=None, help="JSONL replay file instead of synthetic tiers")
+    ap.add_argument("--endpoints", type=_csv(str), default=["seq-cls/predict", "seq-cls/predict_by_sha", "clm/predict"])
+    ap.add_argument("--tiers", type=_csv(int), default=[64, 1024, 4000], help="approximate diff sizes in tokens")
+    ap.add_argument("--items", type=int, default=16, help="distinct payloads per synthetic scenario")
+    ap.add_argument("--rates", type=_csv(float), default=[1.0, 4.0], help="open-loop arrival rates (requests/s)")
+    ap.add_argument("--duration", type=float, default=15.0, help="seconds of arrivals per scenario and rate")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--startup-timeout", type=float, default=600.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", default=".cache/loadtest")
+    ap.add_argument("--hidden-size", type=int, default=64)
+    ap.add_argument("--layers", type=int, default=2)
+    ap.add_argument("--max-length", type=int, default=4096)
+    ap.add_argument("--max-queue", type=int, default=64)
+    ap.add_argument("--out", default=None, help="results JSON (default: <workdir>/results/loadtest-<time>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None, help="diff two result files and exit")
+    args = ap.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    unknown = [e for e in args.endpoints if e not in ENDPOINTS]
+    if unknown:
+        ap.error(f"unknown endpoints {unknown}; choose from {list(ENDPOINTS)}")
+
+    report = asyncio.run(_main(args))
+    out = Path(args.out or Path(args.workdir) / "results" / f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# /drs-llm/bench/merged_adapter.py
+
+"""
+Startup time and per-request latency: adapter-on-base (PeftModel) vs. pre-merged artifact.
+
+    python -m bench.merged_adapter --requests 20
+
+Uses the model/adapter from settings (DRSLLM_MODEL_ID / DRSLLM_BASE_MODEL_PATH). The first
+merged run includes the one-time export; the reported "merged" numbers are from a warm cache.
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from core.settings import BaseAppSettings
+from api_cls.model_cls import _make_classifier
+
+SAMPLE_TEXT = (
+    "<COMMIT_MESSAGE>Fix NPE when user is null</COMMIT_MESSAGE>\n"
+    "<FILE>\n  src/U.java\n  <REMOVED>\n      return u.getId().toString();\n  </REMOVED>\n"
+    "  <ADDED>\n      return u != null ? String.valueOf(u.getId()) : \"\";\n  </ADDED>\n</FILE>\n"
+)
+
+
+def _measure(settings: BaseAppSettings, n_requests: int) -> dict:
+    t0 = time.perf_counter()
+    clf = _make_classifier(settings)
+    startup_s = time.perf_counter() - t0
+    clf.predict(SAMPLE_TEXT)  # first call pays lazy init; keep it out of the latency numbers
+    lat_ms = []
+    for _ in range(n_requests):
+        t = time.perf_counter()
+        label, conf = clf.predict(SAMPLE_TEXT)
+        lat_ms.append((time.perf_counter() - t) * 1000.0)
+    return {
+        "startup_s": round(startup_s, 3),
+        "latency_ms_p50": round(statistics.median(lat_ms), 2),
+        "latency_ms_mean": round(statistics.fmean(lat_ms), 2),
+        "label": label,
+        "confidence": round(conf, 6),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--cache-dir", default=None, help="merged cache dir (default: a fresh temp dir)")
+    args = ap.parse_args()
+
+    base = BaseAppSettings()
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="drs-merged-")
+    results = {"adapter": _measure(base.model_copy(update={"merged_cache_dir": None}), args.requests)}
+
+    t0 = time.perf_counter()
+    _make_classifier(base.model_copy(update={"merged_cache_dir": cache_dir}))
+    results["merge_export_s"] = round(time.perf_counter() - t0, 3)
+    results["merged"] = _measure(base.model_copy(update={"merged_cache_dir": cache_dir}), args.requests)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
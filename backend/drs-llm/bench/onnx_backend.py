@@ -0,0 +1,105 @@
+# /drs-llm/bench/onnx_backend.py
+
+"""
+Parity and throughput: PyTorch CPU pipeline vs. ONNX Runtime (fp32 and dynamic int8).
+
+    python -m bench.onnx_backend --items 32 --batch 8 --threads 4
+
+Inputs are synthetic diffs in several size tiers. Parity is label agreement and the
+max absolute difference in P(predicted label) against the PyTorch path. The model is also
+checked with a single-logit head (num_labels=1, scored by sigmoid rather than softmax),
+re-initialized from the same weights; --no-single-logit skips that.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from core.settings import BaseAppSettings
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from api_cls.model_cls import _make_classifier
+
+
+def _texts(n: int) -> list:
+    tiers = [64, 256, 1024]
+    return [
+        diff_to_structured_xml(synthetic_diff(tiers[i % len(tiers)] + i), f"Benchmark commit {i}", strict=False)
+        for i in range(n)
+    ]
+
+
+def _run(clf, texts: list, batch: int) -> tuple:
+    clf.predict_batch(texts[:batch])  # warm-up
+    t0 = time.perf_counter()
+    out = []
+    for i in range(0, len(texts), batch):
+        out.extend(clf.predict_batch(texts[i:i + batch]))
+    return out, len(texts) / (time.perf_counter() - t0)
+
+
+def _parity(ref: list, out: list) -> dict:
+    return {
+        "label_agreement": sum(a[0] == b[0] for a, b in zip(ref, out)) / len(ref),
+        "max_abs_score_diff": round(max(abs(a[1] - b[1]) for a, b in zip(ref, out)), 6),
+    }
+
+
+def _single_logit_copy(model_path: str, out_dir: str) -> str:
+    """The model with its head replaced by a (random) one-logit head."""
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_path, num_labels=1, ignore_mismatched_sizes=True, torch_dtype=torch.float32, local_files_only=True
+    )
+    model.save_pretrained(out_dir, safe_serialization=True)
+    AutoTokenizer.from_pretrained(model_path, local_files_only=True).save_pretrained(out_dir)
+    return out_dir
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=32)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--threads", type=int, default=0, help="torch threads and ORT intra-op threads (0 = default)")
+    ap.add_argument("--no-single-logit", action="store_true", help="skip the num_labels=1 parity check")
+    args = ap.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    base = BaseAppSettings().model_copy(update={"load_in_4bit": False, "dtype": "float32", "device_map": "cpu"})
+    texts = _texts(args.items)
+    cache_dir = tempfile.mkdtemp(prefix="drs-onnx-")
+
+    ref, ref_tput = _run(_make_classifier(base), texts, args.batch)
+    results = {"torch_cpu": {"items_per_s": round(ref_tput, 2)}}
+    for name, int8 in (("onnx_fp32", False), ("onnx_int8", True)):
+        clf = _make_classifier(base.model_copy(update={
+            "backend": "onnx", "onnx_cache_dir": cache_dir, "onnx_quantize_int8": int8,
+            "onnx_intra_op_threads": args.threads,
+        }))
+        out, tput = _run(clf, texts, args.batch)
+        results[name] = {
+            "items_per_s": round(tput, 2),
+            "speedup_vs_torch": round(tput / ref_tput, 2),
+            **_parity(ref, out),
+        }
+
+    if not args.no_single_logit:
+        single = base.model_copy(update={
+            "model_id": _single_logit_copy(base.model_id, os.path.join(cache_dir, "single-logit-src")),
+            "base_model_path": None,
+        })
+        ref, _ = _run(_make_classifier(single), texts, args.batch)
+        out, _ = _run(_make_classifier(single.model_copy(update={
+            "backend": "onnx", "onnx_cache_dir": cache_dir, "onnx_quantize_int8": False,
+            "onnx_intra_op_threads": args.threads,
+        })), texts, args.batch)
+        results["onnx_fp32_single_logit"] = _parity(ref, out)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
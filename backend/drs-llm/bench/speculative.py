@@ -0,0 +1,120 @@
+# /drs-llm/bench/speculative.py
+
+"""
+Assisted (speculative) decoding for CLM explanations: tokens/sec and acceptance rate
+against plain greedy decoding, and a check that the text is identical.
+
+    python -m bench.speculative                       # tiny CPU target + draft
+    DRSLLM_MODEL_ID=/models/clm DRSLLM_DRAFT_MODEL_ID=/models/small-clm python -m bench.speculative
+
+Without DRSLLM_DRAFT_MODEL_ID a tiny random Llama target is built together with a draft
+made of its first --draft-layers layers (same embeddings and head). The target's other
+layers are damped by --tail-scale so that the two agree on part of their greedy tokens,
+the way a real distilled draft does; random weights would agree on none. Every
+--draft-tokens value is run over the same prompts. On tiny CPU models per-step overhead
+outweighs the cost of the layers themselves, so acceptance and tokens per main-model
+forward carry over to the 8B model; the measured speedup does not.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from core.settings import BaseAppSettings
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from api_clm.model_clm import HFGenerator
+from api_clm.prompts import SYSTEM_PROMPT, USER_TEMPLATE
+from bench.tiny_model import build_tiny_models
+
+
+def _tiny_pair(out_dir: str, layers: int, draft_layers: int, tail_scale: float):
+    from transformers import AutoTokenizer, LlamaForCausalLM
+
+    base = build_tiny_models(out_dir, hidden_size=256, num_layers=layers)["clm"]
+    target = os.path.join(out_dir, f"clm-target-{draft_layers}-{tail_scale}")
+    draft = os.path.join(out_dir, f"clm-draft-{draft_layers}-{tail_scale}")
+    if not os.path.exists(os.path.join(draft, "config.json")):
+        tok = AutoTokenizer.from_pretrained(base)
+        model = LlamaForCausalLM.from_pretrained(base)
+        # Damp the layers the draft will not have, so its greedy tokens often match the target's
+        for layer in model.model.layers[draft_layers:]:
+            layer.self_attn.o_proj.weight.data.mul_(tail_scale)
+            layer.mlp.down_proj.weight.data.mul_(tail_scale)
+        model.save_pretrained(target, safe_serialization=True)
+        tok.save_pretrained(target)
+        model.model.layers = model.model.layers[:draft_layers]
+        model.config.num_hidden_layers = draft_layers
+        model.save_pretrained(draft, safe_serialization=True)
+        tok.save_pretrained(draft)
+    return target, draft
+
+
+def _prompts(n: int):
+    return [
+        SYSTEM_PROMPT + "\n\n" + USER_TEMPLATE.format(
+            structured_diff=diff_to_structured_xml(synthetic_diff(64 + 32 * i), f"Benchmark commit {i}", strict=False)
+        )
+        for i in range(n)
+    ]
+
+
+def _run(gen: HFGenerator, prompts):
+    gen.infer_text(prompts[0])  # warm-up
+    gen.decode_stats.__init__(gen.decode_stats.assisted)
+    t0 = time.perf_counter()
+    texts = [gen.infer_text(p) for p in prompts]
+    return texts, time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--prompts", type=int, default=8)
+    ap.add_argument("--max-new-tokens", type=int, default=100)
+    ap.add_argument("--draft-tokens", default="2,4,8", help="draft tokens per step to compare")
+    ap.add_argument("--tiny-dir", default=".cache/tiny-spec")
+    ap.add_argument("--layers", type=int, default=8, help="tiny target layers")
+    ap.add_argument("--draft-layers", type=int, default=2, help="tiny draft: first N target layers")
+    ap.add_argument("--tail-scale", type=float, default=0.05, help="tiny target: output scale of the other layers")
+    args = ap.parse_args()
+
+    settings = BaseAppSettings()
+    if not settings.draft_model_id:
+        target, draft = _tiny_pair(args.tiny_dir, args.layers, args.draft_layers, args.tail_scale)
+        settings = settings.model_copy(update=dict(
+            model_id=target, draft_model_id=draft, base_model_path=None,
+            load_in_4bit=False, dtype="float32", device_map="cpu",
+        ))
+    prompts = _prompts(args.prompts)
+
+    base = HFGenerator(settings.model_copy(update={"draft_model_id": None}))
+    base.generate_params["max_new_tokens"] = args.max_new_tokens
+    base_texts, base_s = _run(base, prompts)
+    baseline = base.stats()
+    results = {
+        "target": settings.model_id,
+        "draft": settings.draft_model_id,
+        "prompts": len(prompts),
+        "greedy": {"tokens_per_s": baseline["tokens_per_s"], "seconds": round(base_s, 3)},
+        "assisted": [],
+    }
+    del base
+
+    for k in (int(x) for x in args.draft_tokens.split(",")):
+        gen = HFGenerator(settings.model_copy(update={"draft_num_tokens": k}))
+        gen.generate_params["max_new_tokens"] = args.max_new_tokens
+        texts, secs = _run(gen, prompts)
+        st = gen.stats()
+        results["assisted"].append({
+            "draft_tokens": k,
+            "identical_output": sum(a == b for a, b in zip(texts, base_texts)),
+            "acceptance_rate": st["acceptance_rate"],
+            "tokens_per_target_forward": st["tokens_per_target_forward"],
+            "tokens_per_s": st["tokens_per_s"],
+            "speedup": round(base_s / secs, 2),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# /drs-llm/bench/stop_sequences.py
+
+"""
+Stop strings for CLM explanations: new tokens (decode steps) per explanation and time with
+and without DRSLLM_CLM_STOP_STRINGS, and a check that each stopped text is the full text cut
+at the stop string.
+
+    python -m bench.stop_sequences --tiny                   # tiny random CPU model
+    DRSLLM_MODEL_ID=/models/clm python -m bench.stop_sequences --max-new-tokens 256
+
+A random model never writes </ANSWER>, so with --tiny (or --derive-stop) the stop
+string is the 3-character substring that occurs in the most baseline outputs. The numbers
+then only show the mechanism; run it against the fine-tuned model for real savings.
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+
+from core.settings import BaseAppSettings
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+from api_clm.model_clm import HFGenerator
+from api_clm.prompts import SYSTEM_PROMPT, USER_TEMPLATE
+from bench.tiny_model import build_tiny_models
+
+
+def _prompts(n: int):
+    return [
+        SYSTEM_PROMPT + "\n\n" + USER_TEMPLATE.format(
+            structured_diff=diff_to_structured_xml(synthetic_diff(64 + 32 * i), f"Benchmark commit {i}", strict=False)
+        )
+        for i in range(n)
+    ]
+
+
+def _derive_stop(texts) -> str:
+    seen = Counter()
+    for t in texts:
+        seen.update({t[i:i + 3] for i in range(len(t) - 2) if t[i:i + 3].strip() == t[i:i + 3]})
+    return seen.most_common(1)[0][0]
+
+
+def _run(gen: HFGenerator, prompts, max_new_tokens: int, batch: int):
+    t0 = time.perf_counter()
+    results = []
+    for i in range(0, len(prompts), batch):
+        group = prompts[i:i + batch]
+        results += gen.infer_many(group, [max_new_tokens] * len(group))
+    return results, time.perf_counter() - t0
+
+
+def _summary(results, seconds: float) -> dict:
+    return {
+        "new_tokens_per_explanation": round(sum(r.new_tokens for r in results) / len(results), 2),
+        "tokens_saved": sum(r.tokens_saved for r in results),
+        "stop_reasons": dict(Counter(r.stop_reason for r in results)),
+        "seconds": round(seconds, 3),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--prompts", type=int, default=16)
+    ap.add_argument("--batch", type=int, default=1, help="prompts per generate() call")
+    ap.add_argument("--max-new-tokens", type=int, default=100)
+    ap.add_argument("--derive-stop", action="store_true", help="use a substring common in the baseline outputs")
+    ap.add_argument("--tiny", action="store_true", help="build and use a tiny random CPU model")
+    ap.add_argument("--tiny-dir", default=".cache/tiny")
+    args = ap.parse_args()
+
+    settings = BaseAppSettings()
+    if args.tiny:
+        settings = settings.model_copy(update=dict(
+            model_id=build_tiny_models(args.tiny_dir)["clm"], base_model_path=None, draft_model_id=None,
+            load_in_4bit=False, dtype="float32", device_map="cpu",
+        ))
+        args.derive_stop = True
+    gen = HFGenerator(settings)
+    prompts = _prompts(args.prompts)
+    stops = gen.stop_strings
+    gen.infer_text(prompts[0])  # warm-up
+
+    gen.stop_strings = []
+    base, base_s = _run(gen, prompts, args.max_new_tokens, args.batch)
+    gen.stop_strings = [_derive_stop([r.text for r in base])] if args.derive_stop else stops
+    stopped, stopped_s = _run(gen, prompts, args.max_new_tokens, args.batch)
+
+    def cut(text: str) -> str:
+        at = min((i for i in (text.find(s) for s in gen.stop_strings) if i >= 0), default=-1)
+        return (text[:at] if at >= 0 else text).strip()
+
+    print(json.dumps({
+        "model": settings.model_id,
+        "stop_strings": gen.stop_strings,
+        "prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "without_stops": _summary(base, base_s),
+        "with_stops": _summary(stopped, stopped_s),
+        "same_text_up_to_stop": sum(cut(b.text) == s.text for b, s in zip(base, stopped)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# /drs-llm/bench/tiny_model.py
+
+"""
+Tiny randomly-initialized Llama models for load tests and CI-sized benchmarks.
+
+Writes a byte-level BPE tokenizer trained on synthetic diffs, a full
+LlamaForSequenceClassification (seq-cls service) and a full LlamaForCausalLM (CLM
+service) that load through the same code paths as the real 8B checkpoints.
+
+    python -m bench.tiny_model --out .cache/tiny-llama
+"""
+
+import argparse
+import json
+import os
+from typing import Dict
+
+from core.diff_utils import diff_to_structured_xml, synthetic_diff
+
+_DONE_MARKER = ".tiny-ok"
+
+
+def _corpus(n: int = 64):
+    from api_clm.prompts import SYSTEM_PROMPT
+    for i in range(n):
+        diff = synthetic_diff(16 * (i + 1))
+        yield SYSTEM_PROMPT
+        yield diff
+        yield diff_to_structured_xml(diff, f"Fix NPE in handler #{i} when user is null", strict=False)
+
+
+def _train_tokenizer(vocab_size: int):
+    from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast
+
+    tk = Tokenizer(models.BPE(unk_token="<unk>"))
+    tk.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tk.decoder = decoders.ByteLevel()
+    tk.train_from_iterator(_corpus(), trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<unk>", "<s>", "</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    tok = PreTrainedTokenizerFast(tokenizer_object=tk, unk_token="<unk>", bos_token="<s>", eos_token="</s>")
+    tok.pad_token = tok.eos_token
+    return tok
+
+
+def build_tiny_models(
+    out_dir: str,
+    *,
+    hidden_size: int = 64,
+    num_layers: int = 2,
+    vocab_size: int = 2048,
+    max_positions: int = 4096,
+    seed: int = 0,
+) -> Dict[str, str]:
+    """Build (or reuse) the tiny models under `out_dir`; returns {"seq_cls": path, "clm": path}."""
+    paths = {"seq_cls": os.path.join(out_dir, "seq-cls"), "clm": os.path.join(out_dir, "clm")}
+    spec = dict(hidden_size=hidden_size, num_layers=num_layers, vocab_size=vocab_size, max_positions=max_positions, seed=seed)
+    marker = os.path.join(out_dir, _DONE_MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return paths
+
+    import torch
+    from transformers import LlamaConfig, LlamaForSequenceClassification, LlamaForCausalLM
+
+    tok = _train_tokenizer(vocab_size)
+    cfg = dict(
+        vocab_size=len(tok),
+        hidden_size=hidden_size,
+        intermediate_size=2 * hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=max_positions,
+        bos_token_id=tok.bos_token_id,
+        eos_token_id=tok.eos_token_id,
+        pad_token_id=tok.pad_token_id,
+    )
+    torch.manual_seed(seed)
+    seq_cls = LlamaForSequenceClassification(LlamaConfig(num_labels=2, **cfg))
+    clm = LlamaForCausalLM(LlamaConfig(tie_word_embeddings=False, **cfg))
+    for key, model in (("seq_cls", seq_cls), ("clm", clm)):
+        model.save_pretrained(paths[key], safe_serialization=True)
+        tok.save_pretrained(paths[key])
+
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+    return paths
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build tiny random Llama models for benchmarks.")
+    ap.add_argument("--out", default=".cache/tiny-llama")
+    ap.add_argument("--hidden-size", type=int, default=64)
+    ap.add_argument("--layers", type=int, default=2)
+    ap.add_argument("--max-positions", type=int, default=4096)
+    args = ap.parse_args()
+    paths = build_tiny_models(
+        args.out, hidden_size=args.hidden_size, num_layers=args.layers, max_positions=args.max_positions
+    )
+    print(json.dumps(paths, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # app/utils.py
 
+import hashlib
 import re
 from typing import List, Tuple, Optional
 
@@ -303,3 +304,109 @@ def diff_to_structured_xml(diff_string: str,
 
     flush_file()
     return "\n".join(output)
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def patch_id(diff_string: str) -> str:
+    """
+    Stable fingerprint of a diff's content, in the spirit of `git patch-id --stable`.
+
+    Only the file paths and the added/removed lines count; hunk headers (line numbers,
+    offsets), context lines, index/mode lines and all whitespace are ignored, and files
+    are hashed independently so their order does not matter. A rebased or cherry-picked
+    commit therefore keeps its patch id. (Context lines are dropped because a rebase can
+    change them; the model input built by diff_to_structured_xml ignores them too.)
+    """
+    files: List[str] = []
+    current: Optional[str] = None
+    h = None
+    # Lines still expected in the current hunk (old side, new side), from its @@ header; file
+    # headers are only parsed outside hunks, so a removed "-- comment" line is not mistaken for one
+    old_left = new_left = 0
+
+    def flush():
+        if h is not None:
+            files.append(h.hexdigest())
+
+    for line in diff_string.splitlines():
+        if line.startswith(("diff --git ", "@@")):
+            old_left = new_left = 0  # never hunk content; ends a hunk whose counts were off
+        if old_left > 0 or new_left > 0:
+            if line.startswith("-"):
+                old_left -= 1
+            elif line.startswith("+"):
+                new_left -= 1
+            elif line.startswith("\\"):
+                continue  # "\ No newline at end of file"
+            else:
+                old_left -= 1
+                new_left -= 1
+                continue
+            body = _WS_RE.sub("", line[1:])
+            if h is not None and body:
+                h.update(line[0].encode() + body.encode() + b"\n")
+            continue
+        m = HUNK_RE.match(line)
+        if m:
+            old_left = int(m.group("oc") or 1)
+            new_left = int(m.group("nc") or 1)
+            continue
+        if line.startswith("diff --git "):
+            flush()
+            m = re.match(r"diff --git a/(.+?) b/(.+)", line)
+            current = m.group(2) if m else line
+            h = hashlib.sha1(current.encode())
+            continue
+        if line.startswith(("--- ", "+++ ")):
+            if line.startswith("+++ ") and h is None:
+                # ---/+++ diffs without a diff --git header
+                current = line[4:].strip()
+                current = current[2:] if current.startswith("b/") else current
+                h = hashlib.sha1(current.encode())
+            continue
+        if h is None or not line.startswith(("+", "-")):
+            continue
+        body = _WS_RE.sub("", line[1:])
+        if body:
+            h.update(line[0].encode() + body.encode() + b"\n")
+    flush()
+    return hashlib.sha1("\n".join(sorted(files)).encode()).hexdigest()
+
+
+# The seq-cls model input built from a commit. /predict has always put the message inside the
+# structured diff (INLINE); the other routes prepend it (PREFIXED). The two give slightly
+# different predictions, so the service caches them separately.
+INLINE, PREFIXED = "inline", "prefixed"
+INPUT_KINDS = (INLINE, PREFIXED)
+
+
+def model_input(kind: str, diff_string: str, commit_message: str) -> str:
+    """The text the seq-cls model scores for this commit, built the `kind` way (non-strict)."""
+    if kind == INLINE:
+        return diff_to_structured_xml(diff_string, commit_message, strict=False)
+    return commit_message + "\n\n" + diff_to_structured_xml(diff_string, strict=False)
+
+
+def commit_fingerprint(diff_string: str, commit_message: Optional[str]) -> str:
+    """patch_id of the diff combined with the cleaned commit message: same change, same fingerprint."""
+    message = _WS_RE.sub(" ", clean_commit_message(commit_message or "")).strip()
+    return hashlib.sha1(f"{patch_id(diff_string)}\n{message}".encode()).hexdigest()
+
+
+def synthetic_diff(approx_tokens: int) -> str:
+    """
+    Build a well-formed single-file unified diff of roughly `approx_tokens` tokens
+    (about 12 per added line for Llama-style tokenizers). Used for warm-up and benchmarks.
+    """
+    n = max(1, approx_tokens // 12)
+    body = [f"+    int value_{i} = compute(value_{i - 1}) + {i};" for i in range(1, n + 1)]
+    header = [
+        "diff --git a/src/Synthetic.java b/src/Synthetic.java",
+        "index 1111111..2222222 100644",
+        "--- a/src/Synthetic.java",
+        "+++ b/src/Synthetic.java",
+        f"@@ -1,0 +1,{n} @@",
+    ]
+    return "\n".join(header + body) + "\n"
@@ -1,13 +1,14 @@
 # github_client.py
 import logging
-from typing import Tuple
+from typing import List, Tuple
 import requests
-from .settings import settings
+from .settings import get_settings
 from fastapi import HTTPException, status
 
 log = logging.getLogger(__name__)
 
 def _session() -> requests.Session:
+    settings = get_settings()
     s = requests.Session()
     # Base headers for JSON calls
     s.headers.update({
@@ -32,6 +33,7 @@ def fetch_commit_message_and_diff(repo_full: str, sha: str) -> Tuple[str, str]:
     """
     Returns (commit_message, unified_diff)
     """
+    settings = get_settings()
     owner, repo = _split_repo(repo_full)
     url = f"{settings.github_api_base}/repos/{owner}/{repo}/commits/{sha}"
     timeout = settings.github_timeout_s
@@ -60,3 +62,26 @@ def fetch_commit_message_and_diff(repo_full: str, sha: str) -> Tuple[str, str]:
         diff_text = r2.text
 
     return message, diff_text
+
+
+def fetch_pr_commit_shas(repo_full: str, number: int) -> List[str]:
+    """
+    SHAs of a pull request's commits, oldest first (GitHub lists at most 250).
+    """
+    settings = get_settings()
+    owner, repo = _split_repo(repo_full)
+    url = f"{settings.github_api_base}/repos/{owner}/{repo}/pulls/{number}/commits"
+    shas: List[str] = []
+    with _session() as s:
+        for page in range(1, 4):
+            r = s.get(url, params={"per_page": 100, "page": page}, timeout=settings.github_timeout_s)
+            if r.status_code == 404:
+                raise HTTPException(status_code=404, detail="Pull request not found (check repo/number and token)")
+            if not r.ok:
+                log.error("GitHub PR commits error %s: %s", r.status_code, r.text[:500])
+                raise HTTPException(status_code=502, detail="Failed to fetch pull request commits from GitHub")
+            batch = r.json()
+            shas.extend(c["sha"] for c in batch)
+            if len(batch) < 100:
+                break
+    return shas
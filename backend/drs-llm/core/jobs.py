@@ -0,0 +1,517 @@
+# /drs-llm/core/jobs.py
+
+"""
+Background jobs: POST /jobs, GET /jobs/{id}, DELETE /jobs/{id}.
+
+A job is a list of commits, commit SHAs or a pull request (expanded to its commits when
+the job starts). Jobs and per-item results live in a local SQLite file, so they survive
+restarts (a job that was running is resumed from its first unfinished item).
+
+One JobRunner task per service processes jobs a batch at a time through the same
+batched path as /predict_stream. Before each batch it picks the highest-priority job
+that still has work, so a later high-priority job overtakes a bulk job at the next batch
+boundary, and it waits until no interactive request is queued on the InferenceExecutor,
+so /predict never waits behind more than one job batch.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, status
+from pydantic import BaseModel, Field, ValidationError
+
+from .github_client import fetch_commit_message_and_diff, fetch_pr_commit_shas
+from .runtime import HTTP_CLIENT_CLOSED_REQUEST, WORKER_ID_ENV, InferenceExecutor, primary_worker, startup_profile
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+TERMINAL = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    total INTEGER,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    options TEXT NOT NULL,
+    pr TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_pick ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    input TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+# ---- API models ----
+
+class JobCommit(BaseModel):
+    commit_message: str
+    code_diff: str
+
+class JobSHA(BaseModel):
+    repo: str = Field(..., example="octocat/Hello-World")
+    sha: str
+
+class JobPR(BaseModel):
+    repo: str = Field(..., example="octocat/Hello-World")
+    number: int = Field(..., gt=0)
+
+class JobRequest(BaseModel):
+    commits: List[JobCommit] = []
+    shas: List[JobSHA] = []
+    pr: Optional[JobPR] = None
+    # Higher runs first; equal priorities run in submission order
+    priority: int = 0
+    # Seq-cls multi-adapter mode only; applies to every item
+    adapter: Optional[str] = None
+
+
+# ---- storage ----
+
+class JobStore:
+    """SQLite persistence. Calls are blocking; the runner and routes use them via asyncio.to_thread."""
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _job(self, row: Optional[sqlite3.Row]) -> Optional[dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["pr"] = json.loads(job["pr"]) if job["pr"] else None
+        return job
+
+    def create(self, priority: int, options: dict, inputs: List[dict], pr: Optional[dict]) -> dict:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, created_at, total, options, pr) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, priority, time.time(), None if pr else len(inputs), json.dumps(options),
+                 json.dumps(pr) if pr else None),
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, idx, input) VALUES (?, ?, ?)",
+                ((job_id, i, json.dumps(x)) for i, x in enumerate(inputs)),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._job(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, result FROM items WHERE job_id = ? AND result IS NOT NULL ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return [{"index": r["idx"], **json.loads(r["result"])} for r in rows]
+
+    def data_version(self) -> int:
+        """Changes whenever another connection (e.g. another core.serve worker) commits to the file."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def queued_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+
+    def next_work(self, limit: int) -> Optional[Tuple[dict, List[Tuple[int, dict]]]]:
+        """Highest-priority unfinished job and up to `limit` of its pending items (none if it needs PR expansion)."""
+        with self._lock:
+            job = self._job(self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY priority DESC, created_at LIMIT 1",
+                (QUEUED, RUNNING),
+            ).fetchone())
+            if job is None:
+                return None
+            if job["status"] == QUEUED:
+                self._conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                                   (RUNNING, time.time(), job["id"]))
+            rows = self._conn.execute(
+                "SELECT idx, input FROM items WHERE job_id = ? AND result IS NULL ORDER BY idx LIMIT ?",
+                (job["id"], limit),
+            ).fetchall()
+        return job, [(r["idx"], json.loads(r["input"])) for r in rows]
+
+    def set_inputs(self, job_id: str, inputs: List[dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (job_id, idx, input) VALUES (?, ?, ?)",
+                ((job_id, i, json.dumps(x)) for i, x in enumerate(inputs)),
+            )
+            self._conn.execute("UPDATE jobs SET total = ? WHERE id = ?", (len(inputs), job_id))
+
+    def save_results(self, job_id: str, results: List[Tuple[int, dict]]) -> Optional[str]:
+        """Store item results; returns the job's status afterwards (SUCCEEDED once every item has one)."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE items SET result = ? WHERE job_id = ? AND idx = ? AND result IS NULL",
+                ((json.dumps(r), job_id, idx) for idx, r in results),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET done = done + ?, failed = failed + ? WHERE id = ?",
+                (len(results), sum("error" in r for _, r in results), job_id),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ? AND done >= total",
+                (SUCCEEDED, time.time(), job_id, RUNNING),
+            )
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return row[0] if row else None
+
+    def finish(self, job_id: str, status_: str, error: Optional[str] = None) -> bool:
+        """Move a job that is not finished yet to a terminal status; False if it already was."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ? AND status IN (?, ?)",
+                (status_, time.time(), error, job_id, QUEUED, RUNNING),
+            )
+            return cur.rowcount > 0
+
+    def recover(self) -> int:
+        """Requeue jobs that were running when the process stopped."""
+        with self._lock:
+            return self._conn.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING)).rowcount
+
+    def sweep(self, retention_s: float, max_finished: int) -> int:
+        """Delete finished jobs older than retention_s, and the oldest beyond max_finished."""
+        placeholders = ",".join("?" * len(TERMINAL))
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            expired = [r[0] for r in self._conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?",
+                (*TERMINAL, time.time() - retention_s),
+            )]
+            expired += [r[0] for r in self._conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY finished_at DESC LIMIT -1 OFFSET ?",
+                (*TERMINAL, max_finished),
+            )]
+            for job_id in set(expired):
+                self._conn.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(set(expired))
+
+
+# ---- runner ----
+
+class _JobClient:
+    """Request stand-in for InferenceExecutor.run: a cancelled job counts as a disconnected client."""
+    headers: Dict[str, str] = {}
+
+    def __init__(self, runner: "JobRunner", job_id: str):
+        self._runner = runner
+        self._job_id = job_id
+
+    async def is_disconnected(self) -> bool:
+        return self._job_id in self._runner._cancelled
+
+
+class JobRunner:
+    """
+    `process(client, items)` is the service's batched path (the one behind /predict_stream):
+    it gets `item_model` instances and returns one dict or HTTPException per item.
+    """
+    def __init__(self, store: JobStore, executor: InferenceExecutor, item_model: type[BaseModel],
+                 process: Callable[[Any, List[BaseModel]], Awaitable[List[Any]]], *,
+                 batch_size: int, retention_s: float, max_finished: int,
+                 idle_poll_s: float = 0.05, sweep_every_s: float = 300.0, store_poll_s: float = 0.5):
+        self.store = store
+        self._executor = executor
+        self._item_model = item_model
+        self._process = process
+        self._batch_size = batch_size
+        self._retention_s = retention_s
+        self._max_finished = max_finished
+        self._idle_poll_s = idle_poll_s
+        self._sweep_every_s = sweep_every_s
+        # Under core.serve jobs are also submitted through the other workers, whose submitted() only
+        # wakes their own (idle) runner; the running one notices their writes by polling data_version
+        self._store_poll_s = store_poll_s if os.getenv(WORKER_ID_ENV) is not None else sweep_every_s
+        self._wake = asyncio.Event()
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self._cancelled: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._counters = dict(batches=0, items=0, yielded_ms=0.0)
+
+    def start(self) -> None:
+        if not primary_worker():
+            # Under core.serve worker 0 processes the jobs; the others only accept and report them
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {"db": self.store.path, "queued_or_running": self.store.queued_count(),
+                **self._counters, "yielded_ms": round(self._counters["yielded_ms"], 1)}
+
+    # ---- called from the routes ----
+
+    def submitted(self) -> None:
+        self._wake.set()
+
+    async def cancel(self, job_id: str) -> bool:
+        if not await asyncio.to_thread(self.store.finish, job_id, CANCELLED):
+            return False
+        self._cancelled.add(job_id)
+        self._notify(job_id)
+        return True
+
+    async def wait(self, job_id: str, timeout: float, poll_s: float = 0.5) -> None:
+        # The event fires when this process finishes the job; polling covers jobs run by another worker.
+        # Only the runner sets it: a waiter that gives up just drops out, the others keep waiting
+        deadline = time.monotonic() + timeout
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            while True:
+                job = await asyncio.to_thread(self.store.get, job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in TERMINAL or remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(poll_s, remaining))
+                    return
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                # Last waiter gone: drop the event unless the runner already has
+                del self._waiters[job_id]
+                if self._finished.get(job_id) is event:
+                    del self._finished[job_id]
+
+    def _notify(self, job_id: str) -> None:
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    # ---- background loop ----
+
+    async def _loop(self) -> None:
+        recovered = await asyncio.to_thread(self.store.recover)
+        if recovered:
+            log.info("Resuming %d unfinished job(s) from %s", recovered, self.store.path)
+        last_sweep = 0.0
+        while True:
+            try:
+                if not startup_profile.ready:
+                    await asyncio.sleep(0.5)
+                    continue
+                if time.monotonic() - last_sweep > self._sweep_every_s:
+                    last_sweep = time.monotonic()
+                    if n := await asyncio.to_thread(self.store.sweep, self._retention_s, self._max_finished):
+                        log.info("Removed %d finished job(s) past retention", n)
+                work = await asyncio.to_thread(self.store.next_work, self._batch_size)
+                if work is None:
+                    await self._idle()
+                    continue
+                job, items = work
+                if job["total"] is None:
+                    await self._expand(job)
+                elif not items:
+                    # Every item has a result already (e.g. finished just before a restart)
+                    await asyncio.to_thread(self.store.save_results, job["id"], [])
+                    self._notify(job["id"])
+                else:
+                    await self._yield_to_interactive()
+                    await self._run_batch(job, items)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Job runner iteration failed")
+                await asyncio.sleep(1.0)
+
+    async def _idle(self) -> None:
+        """Wait for a job submitted here or through another worker, or for the next sweep."""
+        self._wake.clear()
+        version = await asyncio.to_thread(self.store.data_version)
+        until = time.monotonic() + self._sweep_every_s
+        while (remaining := until - time.monotonic()) > 0:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=min(self._store_poll_s, remaining))
+                return
+            except asyncio.TimeoutError:
+                if await asyncio.to_thread(self.store.data_version) != version:
+                    return
+
+    async def _yield_to_interactive(self) -> None:
+        t0 = time.perf_counter()
+        while self._executor.stats()["waiting"] > 0:
+            await asyncio.sleep(self._idle_poll_s)
+        self._counters["yielded_ms"] += (time.perf_counter() - t0) * 1000.0
+
+    async def _expand(self, job: dict) -> None:
+        pr = job["pr"]
+        try:
+            shas = await asyncio.to_thread(fetch_pr_commit_shas, pr["repo"], pr["number"])
+        except HTTPException as e:
+            await asyncio.to_thread(self.store.finish, job["id"], FAILED, str(e.detail))
+            self._notify(job["id"])
+            return
+        log.info("Job %s: PR %s#%d has %d commits", job["id"], pr["repo"], pr["number"], len(shas))
+        await asyncio.to_thread(self.store.set_inputs, job["id"], [{"repo": pr["repo"], "sha": s} for s in shas])
+        if not shas:
+            await asyncio.to_thread(self.store.save_results, job["id"], [])
+            self._notify(job["id"])
+
+    async def _resolve(self, item: dict, options: dict):
+        """Item model instance for a stored input, or an error result dict."""
+        try:
+            if "sha" in item:
+                msg, diff = await asyncio.to_thread(fetch_commit_message_and_diff, item["repo"], item["sha"])
+                item = {"commit_message": msg, "code_diff": diff}
+            return self._item_model(**item, **options)
+        except HTTPException as e:
+            return {"error": str(e.detail), "status": e.status_code}
+        except ValidationError as e:
+            return {"error": str(e), "status": 422}
+
+    async def _run_batch(self, job: dict, items: List[Tuple[int, dict]]) -> None:
+        job_id = job["id"]
+        options = {k: v for k, v in job["options"].items() if v is not None}
+        resolved = [await self._resolve(x, options) for _, x in items]
+        results: List[Tuple[int, dict]] = []
+        todo = [(idx, r) for (idx, _), r in zip(items, resolved) if isinstance(r, BaseModel)]
+        results.extend((idx, r) for (idx, _), r in zip(items, resolved) if not isinstance(r, BaseModel))
+        if todo:
+            try:
+                outs = await self._process(_JobClient(self, job_id), [r for _, r in todo])
+            except HTTPException as e:
+                if e.status_code == HTTP_CLIENT_CLOSED_REQUEST:
+                    return  # cancelled while queued
+                if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+                    await asyncio.sleep(1.0)  # executor queue full; retry the batch
+                    return
+                outs = [e] * len(todo)
+            except Exception:
+                log.exception("Job %s: batch failed", job_id)
+                outs = [HTTPException(status_code=500, detail="Inference failed")] * len(todo)
+            for (idx, _), out in zip(todo, outs):
+                if isinstance(out, HTTPException):
+                    results.append((idx, {"error": str(out.detail), "status": out.status_code}))
+                else:
+                    results.append((idx, out))
+        if job_id in self._cancelled:
+            return
+        self._counters["batches"] += 1
+        self._counters["items"] += len(results)
+        if await asyncio.to_thread(self.store.save_results, job_id, results) in TERMINAL:
+            self._notify(job_id)
+
+
+# ---- routes ----
+
+def _job_view(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "total": job["total"],
+        "done": job["done"],
+        "failed": job["failed"],
+        "pr": job["pr"],
+        "error": job["error"],
+    }
+
+
+def make_jobs_router(runner: JobRunner, *, max_items: int, max_queued: int, max_wait_s: float) -> APIRouter:
+    router = APIRouter()
+
+    @router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+    async def create_job(req: JobRequest):
+        inputs = [c.model_dump() for c in req.commits] + [s.model_dump() for s in req.shas]
+        if req.pr is not None and inputs:
+            raise HTTPException(status_code=422, detail="Give either a pr or commits/shas, not both")
+        if req.pr is None and not inputs:
+            raise HTTPException(status_code=422, detail="A job needs commits, shas or a pr")
+        if len(inputs) > max_items:
+            raise HTTPException(status_code=413, detail=f"A job may hold at most {max_items} items")
+        if await asyncio.to_thread(runner.store.queued_count) >= max_queued:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many unfinished jobs, retry later")
+        job = await asyncio.to_thread(
+            runner.store.create, req.priority, {"adapter": req.adapter}, inputs,
+            req.pr.model_dump() if req.pr else None,
+        )
+        runner.submitted()
+        log.info("Job %s queued: %s items, priority %d", job["id"], job["total"] or "PR", job["priority"])
+        return _job_view(job)
+
+    @router.get("/jobs/{job_id}")
+    async def get_job(
+        job_id: str,
+        wait: float = Query(0.0, ge=0, le=max_wait_s, description="long-poll: seconds to wait for completion"),
+        offset: int = Query(0, ge=0),
+        limit: int = Query(1000, ge=0, le=10000),
+    ):
+        """Job status and progress, plus results [offset, offset+limit) in input order."""
+        if wait > 0:
+            await runner.wait(job_id, wait)
+        job = await asyncio.to_thread(runner.store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        results = await asyncio.to_thread(runner.store.results, job_id, offset, limit) if limit else []
+        return {**_job_view(job), "results": results}
+
+    @router.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str):
+        """Cancel a queued or running job; results stored so far are kept."""
+        cancelled = await runner.cancel(job_id)
+        job = await asyncio.to_thread(runner.store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job")
+        if not cancelled:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job already {job['status']}")
+        return _job_view(job)
+
+    return router
+
+
+def make_job_runner(settings, service: str, executor: InferenceExecutor, item_model: type[BaseModel], process) -> JobRunner:
+    return JobRunner(
+        JobStore(settings.jobs_db_path.format(service=service)), executor, item_model, process,
+        batch_size=settings.jobs_batch_size,
+        retention_s=settings.jobs_retention_hours * 3600.0,
+        max_finished=settings.jobs_max_finished,
+    )
@@ -1,9 +1,10 @@
 # backend/drs-llm/core/logging_setup.py
 
 import logging
-from .settings import settings
+from .settings import get_settings
 
 def setup_logging():
+    settings = get_settings()
     logging.basicConfig(
         level=settings.log_level,
         format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
@@ -0,0 +1,84 @@
+# /drs-llm/core/preprocess.py
+
+"""
+Show what the services would feed the model for a commit, without loading one.
+
+    python -m core.preprocess --diff change.diff --message "Fix NPE in parser"
+    git show --format=%B HEAD | python -m core.preprocess --git
+    python -m core.preprocess --repo apache/flink --sha d7b5213 --json
+
+Prints the seq-cls model input. --kind picks how it is built, as the service does: "inline"
+(message inside the structured diff, what /predict scores; the default for --diff) or
+"prefixed" (message, blank line, structured diff: /predict_by_sha, /predict_batch, streams
+and jobs; the default for --git and --repo/--sha). --json prints it with
+the commit fingerprint, patch-id, diff validation problems and the token estimate the
+inference executor admits requests by. Only diff_utils, the GitHub client and the
+executor's estimator are imported, so this starts in a fraction of a second.
+"""
+
+import argparse
+import json
+import sys
+from typing import List, Optional, Tuple
+
+from .diff_utils import INLINE, INPUT_KINDS, PREFIXED, commit_fingerprint, model_input, patch_id, validate_unified_diff
+
+
+def _split_git_show(text: str) -> Tuple[str, str]:
+    """`git show --format=%B` output -> (message, diff): the diff starts at the first "diff --git"."""
+    at = text.find("\ndiff --git ")
+    if at < 0:
+        return text.strip(), ""
+    return text[:at].strip(), text[at + 1:]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Print the model input built from a commit (no model is loaded).")
+    ap.add_argument("--diff", help="unified diff file ('-' for stdin)")
+    ap.add_argument("--message", default="", help="commit message")
+    ap.add_argument("--git", action="store_true", help="read `git show --format=%%B` output from stdin")
+    ap.add_argument("--repo", help="fetch the commit from GitHub: owner/repo")
+    ap.add_argument("--sha", help="fetch the commit from GitHub: commit sha")
+    ap.add_argument("--kind", choices=INPUT_KINDS,
+                    help="how the input is built (default: inline for --diff, prefixed otherwise)")
+    ap.add_argument("--max-length", type=int, default=4096, help="model max_length for the token estimate")
+    ap.add_argument("--json", action="store_true", help="print the input with fingerprint, validation and size")
+    args = ap.parse_args(argv)
+
+    if args.repo and args.sha:
+        from .github_client import fetch_commit_message_and_diff
+
+        message, diff = fetch_commit_message_and_diff(args.repo, args.sha)
+        default_kind = PREFIXED  # what /predict_by_sha scores
+    elif args.git:
+        message, diff = _split_git_show(sys.stdin.read())
+        default_kind = PREFIXED
+    elif args.diff:
+        with (sys.stdin if args.diff == "-" else open(args.diff)) as f:
+            diff = f.read()
+        message = args.message
+        default_kind = INLINE  # what /predict scores
+    else:
+        ap.error("give --diff, --git, or --repo and --sha")
+
+    kind = args.kind or default_kind
+    text = model_input(kind, diff, message)
+    if not args.json:
+        print(text)
+        return
+    from .runtime import estimate_tokens
+
+    valid, problems = validate_unified_diff(diff)
+    print(json.dumps({
+        "kind": kind,
+        "fingerprint": commit_fingerprint(diff, message),
+        "patch_id": patch_id(diff),
+        "valid_diff": valid,
+        "problems": problems,
+        "estimated_tokens": estimate_tokens(text, args.max_length),
+        "text": text,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
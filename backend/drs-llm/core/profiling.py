@@ -0,0 +1,267 @@
+# /drs-llm/core/profiling.py
+
+"""
+On-demand profiling for the inference services (/debug/profile).
+
+A ProfileSession runs for N seconds and collects:
+  - a torch.profiler trace of the inference calls made meanwhile (the profiler is
+    thread-local, so InferenceExecutor wraps each call on its worker thread; traces are
+    merged into one Chrome trace). Only one call is traced at a time: a call that starts
+    while another is being traced runs untraced and is counted in untraced_calls,
+  - a Python sampling profile of all threads as collapsed stacks (flamegraph.pl / speedscope),
+  - per-request peak CPU RSS (from the sampler), and peak accelerator memory for the session
+    and for each call that ran alone (the device's peak counter is shared by concurrent calls).
+
+When no session is active the only cost on the request path is one module-global read
+in InferenceExecutor.run.
+"""
+
+from __future__ import annotations
+import asyncio
+import hmac
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import Response
+
+log = logging.getLogger(__name__)
+
+_active: Optional["ProfileSession"] = None
+_session_lock = threading.Lock()
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 2**20 if hasattr(os, "sysconf") else 0.0
+FORMATS = ("zip", "chrome", "collapsed", "summary")
+
+
+def active_session() -> Optional["ProfileSession"]:
+    return _active
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ProfileSession:
+    def __init__(self, seconds: float, *, sample_interval_s: float = 0.005):
+        import torch  # only needed once a profile is requested
+
+        self.seconds = seconds
+        self._interval = sample_interval_s
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+        self._stacks: Counter = Counter()
+        self._rss: List[tuple] = []
+        self._samples = 0
+        self._requests: List[dict] = []
+        self._trace_events: List[dict] = []
+        self._trace_meta: Dict[str, object] = {}
+        self._ops: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._profiles: list = []
+        self._inflight = 0
+        self._calls_started = 0
+        self._inflight_cond = threading.Condition()
+        self._accelerator_peak_mb: Optional[float] = None
+        # Kineto allows one active profiler per process; overlapping calls are timed but not traced
+        self._trace_lock = threading.Lock()
+        self._cuda = torch.cuda.is_available()
+        self._activities = [torch.profiler.ProfilerActivity.CPU]
+        if self._cuda:
+            self._activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.started_at = time.time()
+
+    # ---- Python sampler ----
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[";".join([names.get(ident, str(ident))] + stack[::-1])] += 1
+            self._samples += 1
+            rss = _rss_mb()
+            if rss is not None:
+                self._rss.append((time.monotonic(), rss))
+
+    # ---- per-call tracing (runs on the inference worker thread) ----
+
+    def wrap(self, fn):
+        import torch
+
+        def _traced(*args, **kw):
+            record = {"thread": threading.current_thread().name, "start": time.monotonic(), "traced": False}
+            traced = self._trace_lock.acquire(blocking=False)
+            with self._inflight_cond:
+                self._inflight += 1
+                self._calls_started += 1
+                started = self._calls_started
+                # Reset the device-wide peak only when no other call is running: every earlier
+                # call has already folded its peak into the session's
+                alone = self._inflight == 1
+                if self._cuda and alone:
+                    torch.cuda.reset_peak_memory_stats()
+            try:
+                if not traced:
+                    return fn(*args, **kw)
+                record["traced"] = True
+                with torch.profiler.profile(activities=self._activities) as prof:
+                    result = fn(*args, **kw)
+                # Exporting is slow for long generations; it happens in stop(), off the request path
+                self._profiles.append(prof)
+                return result
+            finally:
+                if traced:
+                    self._trace_lock.release()
+                record["end"] = time.monotonic()
+                with self._inflight_cond:
+                    if self._cuda:
+                        peak = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+                        self._accelerator_peak_mb = max(self._accelerator_peak_mb or 0.0, peak)
+                        # Per call only if nothing overlapped it; otherwise the peak is not its own
+                        alone = alone and self._calls_started == started
+                        record["accelerator_peak_mb"] = peak if alone else None
+                    self._requests.append(record)
+                    self._inflight -= 1
+                    self._inflight_cond.notify_all()
+        return _traced
+
+    def _collect(self, prof) -> None:
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            prof.export_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        finally:
+            os.unlink(path)
+        events = trace.get("traceEvents", [])
+        with self._lock:
+            for k in ("schemaVersion", "deviceProperties", "displayTimeUnit", "baseTimeNanoseconds"):
+                self._trace_meta.setdefault(k, trace.get(k))
+            self._trace_events.extend(events)
+            # Aggregated from the trace: prof.key_averages() takes seconds for a single generate() call
+            for e in events:
+                if e.get("ph") == "X" and e.get("cat") in ("cpu_op", "kernel"):
+                    agg = self._ops.setdefault((e["cat"], e["name"]), [0, 0.0])
+                    agg[0] += 1
+                    agg[1] += float(e.get("dur", 0.0))
+
+    # ---- lifecycle and artifacts ----
+
+    def start(self) -> None:
+        global _active
+        self._sampler.start()
+        _active = self
+
+    def stop(self, *, drain_s: float = 30.0) -> None:
+        """Stop wrapping new calls, let in-flight ones finish (up to drain_s), then merge their traces."""
+        global _active
+        _active = None
+        with self._inflight_cond:
+            self._inflight_cond.wait_for(lambda: self._inflight == 0, timeout=drain_s)
+        self._stop.set()
+        self._sampler.join()
+        for prof in self._profiles:
+            self._collect(prof)
+        self._profiles.clear()
+
+    def chrome_trace(self) -> dict:
+        with self._lock:
+            return {**self._trace_meta, "traceEvents": list(self._trace_events)}
+
+    def collapsed_stacks(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self._stacks.most_common())
+
+    def summary(self) -> dict:
+        requests = []
+        for r in self._requests:
+            window = [mb for t, mb in self._rss if r["start"] <= t <= r["end"]]
+            requests.append({
+                "thread": r["thread"],
+                "duration_ms": round((r["end"] - r["start"]) * 1000.0, 2),
+                "traced": r["traced"],
+                "cpu_rss_peak_mb": round(max(window), 1) if window else None,
+                "accelerator_peak_mb": r.get("accelerator_peak_mb"),
+            })
+        top_ops = sorted(self._ops.items(), key=lambda kv: kv[1][1], reverse=True)[:30]
+        return {
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "python_samples": self._samples,
+            "sample_interval_ms": self._interval * 1000.0,
+            "cpu_rss_peak_mb": round(max(mb for _, mb in self._rss), 1) if self._rss else None,
+            "accelerator_peak_mb": self._accelerator_peak_mb,
+            "untraced_calls": sum(not r["traced"] for r in requests),
+            "requests": requests,
+            # Inclusive durations: nested ops (aten::linear -> aten::mm) are each counted
+            "top_ops_by_total_us": [
+                {"kind": kind, "op": name, "count": n, "total_us": round(t, 1)} for (kind, name), (n, t) in top_ops
+            ],
+        }
+
+
+def check_debug_token(request: Request, token: Optional[str]) -> None:
+    """Bearer-token guard for debug endpoints; they are disabled when no token is configured."""
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    auth = request.headers.get("authorization", "")
+    given = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+    if not hmac.compare_digest(given.encode(), token.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid debug token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+async def capture_profile(seconds: float, fmt: str, *, name: str) -> Response:
+    """Profile the process for `seconds` and return the artifact in `fmt` as a download."""
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {list(FORMATS)}")
+    if not _session_lock.acquire(blocking=False):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already being captured")
+    try:
+        session = ProfileSession(seconds)
+        session.start()
+        log.info("Profiling for %.1fs", seconds)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(session.stop)
+    finally:
+        _session_lock.release()
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if fmt == "chrome":
+        body, media, ext = json.dumps(session.chrome_trace()).encode(), "application/json", "trace.json"
+    elif fmt == "collapsed":
+        body, media, ext = session.collapsed_stacks().encode(), "text/plain", "stacks.collapsed"
+    elif fmt == "summary":
+        return Response(json.dumps(session.summary()), media_type="application/json")
+    else:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("trace.json", json.dumps(session.chrome_trace()))
+            z.writestr("stacks.collapsed", session.collapsed_stacks())
+            z.writestr("summary.json", json.dumps(session.summary(), indent=2))
+        body, media, ext = buf.getvalue(), "application/zip", "zip"
+    return Response(body, media_type=media,
+                    headers={"Content-Disposition": f'attachment; filename="profile-{name}-{stamp}.{ext}"'})
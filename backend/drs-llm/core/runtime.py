@@ -1,19 +1,60 @@
+from __future__ import annotations
 import os
+import math
+import time
 import threading
 import asyncio
 import logging
-import torch
-from transformers import BitsAndBytesConfig
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request, status
+
+from .timing import stage
+from .profiling import active_session
+
+# torch / transformers are imported where models are loaded or touched, so that the executor,
+# jobs and streaming helpers (and everything importing them) start without them
+if TYPE_CHECKING:
+    import torch
 
 _MAX_CONCURRENCY = int(os.getenv("DRSLLM_MAX_CONCURRENCY", "1"))
+_MAX_QUEUE = int(os.getenv("DRSLLM_MAX_QUEUE", "32"))
+_QUEUE_POLL_S = float(os.getenv("DRSLLM_QUEUE_POLL_S", "0.25"))
+# Token budget for work inside the model at once (padded length x batch); 0 counts requests only.
+# Sized from memory per token, e.g. (free accelerator memory after load) / (peak bytes per token)
+_MAX_INFLIGHT_TOKENS = int(os.getenv("DRSLLM_MAX_INFLIGHT_TOKENS", "0"))
+# Request costs are estimated from UTF-8 size before tokenizing; ~3 bytes per token is conservative for code
+_BYTES_PER_TOKEN = float(os.getenv("DRSLLM_BYTES_PER_TOKEN", "3.0"))
+
+# Remaining time budget (milliseconds) forwarded by the gateway with every request
+DEADLINE_HEADER = "X-DRS-Timeout-Ms"
+# nginx convention for "client closed request"
+HTTP_CLIENT_CLOSED_REQUEST = 499
+
+# Set by core.serve in each forked HTTP worker; absent when serving from a single process
+WORKER_ID_ENV = "DRSLLM_WORKER_ID"
+
 _init_lock = threading.Lock()
 log = logging.getLogger(__name__)
 
+
+def primary_worker() -> bool:
+    """True in single-process serving and in worker 0 of core.serve (which owns background duties)."""
+    return os.getenv(WORKER_ID_ENV, "0") == "0"
+
+def max_concurrency() -> int:
+    """Inference calls an InferenceExecutor runs at once by default (DRSLLM_MAX_CONCURRENCY)."""
+    return _MAX_CONCURRENCY
+
 class _InferLimiter:
     sema = threading.Semaphore(_MAX_CONCURRENCY)
 
 
 def torch_dtype(name: str):
+    import torch
+
     name = (name or "float16").lower()
     if name in ("fp16", "float16", "half"): return torch.float16
     if name in ("bf16", "bfloat16"): return torch.bfloat16
@@ -21,28 +62,48 @@ def torch_dtype(name: str):
 
 
 def model_kwargs_from_settings(settings, *, for_4bit_quant: bool):
+    import torch
+    from transformers import BitsAndBytesConfig
+
     dtype = torch_dtype(settings.dtype)
-    kwargs = dict(
-        device_map="auto",
-        torch_dtype=(dtype if not settings.load_in_4bit else (torch.bfloat16 if dtype == torch.bfloat16 else torch.float32)),
-        low_cpu_mem_usage=True,
-        local_files_only=True,
-    )
-    if for_4bit_quant and settings.load_in_4bit:
-        kwargs["quantization_config"] = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=dtype,
+    if settings.load_in_4bit and not torch.cuda.is_available():
+        # bitsandbytes 4-bit needs CUDA; CPU-only nodes fall back to plain float32 weights
+        log.warning("DRSLLM_LOAD_IN_4BIT is set but no CUDA device is available; loading float32 on CPU.")
+        kwargs = dict(device_map="cpu", torch_dtype=torch.float32, low_cpu_mem_usage=True, local_files_only=True)
+    else:
+        kwargs = dict(
+            device_map="auto",
+            torch_dtype=(dtype if not settings.load_in_4bit else (torch.bfloat16 if dtype == torch.bfloat16 else torch.float32)),
+            low_cpu_mem_usage=True,
+            local_files_only=True,
         )
+        if for_4bit_quant and settings.load_in_4bit:
+            kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=dtype,
+            )
+    if settings.attn_implementation:
+        kwargs["attn_implementation"] = settings.attn_implementation
     return kwargs
 
 
+# Named singletons, so core.serve can build them before forking workers (or swap in proxies)
+model_singletons: Dict[str, "SingletonFactory"] = {}
+
+
 class SingletonFactory:
     """Thread-safe lazy singleton factory for heavy model objects."""
-    def __init__(self, builder):
+    def __init__(self, builder, name: Optional[str] = None):
         self._builder = builder
         self._obj = None
+        if name is not None:
+            model_singletons[name] = self
+
+    def override(self, obj) -> None:
+        """Serve `obj` instead of building (core.serve hands workers a proxy to the model process)."""
+        self._obj = obj
 
     def get(self):
         if self._obj is None:
@@ -57,9 +118,606 @@ async def preload_singleton(singleton_factory):
     await asyncio.to_thread(singleton_factory.get)
 
 
+class StartupProfile:
+    """Records how long each cold-start phase took and whether the process is ready to serve."""
+    def __init__(self):
+        self.phases: list[dict] = []
+        self.ready = False
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            self.phases.append({"phase": name, "seconds": round(seconds, 3)})
+            log.info("Startup phase %s took %.2fs", name, seconds)
+
+    def as_dict(self) -> dict:
+        return {"ready": self.ready, "error": self.error, "phases": list(self.phases)}
+
+    def require_ready(self) -> None:
+        """Reject requests that arrive while the model is still loading or warming up."""
+        if not self.ready:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Model is not ready yet",
+                headers={"Retry-After": "5"},
+            )
+
+
+# Process-wide: model builders and the app lifespan both record into it
+startup_profile = StartupProfile()
+
+
+async def start_model(singleton_factory, warmup: Callable[[object], None]) -> None:
+    """
+    Load the model and warm it up off the event loop, then flip readiness.
+    Meant to run as a background task so /health and /ready answer during cold start.
+    """
+    try:
+        with startup_profile.phase("model_load"):
+            await preload_singleton(singleton_factory)
+        await asyncio.to_thread(warmup, singleton_factory.get())
+        startup_profile.ready = True
+        log.info("Model ready after %.1fs", sum(p["seconds"] for p in startup_profile.phases if p["phase"] == "model_load"))
+    except Exception as e:
+        startup_profile.error = repr(e)
+        log.exception("Model startup failed")
+
+
+def run_warmup(infer: Callable[[str], object], make_input: Callable[[int], str], lengths: Iterable[int],
+               name: str = "warmup") -> None:
+    """
+    Push synthetic inputs of each approximate token length through `infer` so lazy
+    initialization (kernels, allocator growth, caches) is paid before readiness flips.
+    """
+    for n in lengths:
+        with startup_profile.phase(f"{name}_{n}"):
+            infer(make_input(n))
+
+
+class LaneLock:
+    """
+    Exclusive access to one model shared by several request lanes (e.g. classification and
+    generation). When more than one lane has waiters, turns alternate between lanes, so a
+    lane of long calls can delay another lane by at most one call.
+    """
+    def __init__(self, lanes: Iterable[str]):
+        self._cond = threading.Condition()
+        self._waiting = {lane: 0 for lane in lanes}
+        self._busy = False
+        self._last: Optional[str] = None
+
+    def _my_turn(self, lane: str) -> bool:
+        others_waiting = any(n for l, n in self._waiting.items() if l != lane)
+        return not (others_waiting and self._last == lane)
+
+    @contextmanager
+    def hold(self, lane: str):
+        with self._cond:
+            self._waiting[lane] += 1
+            while self._busy or not self._my_turn(lane):
+                self._cond.wait()
+            self._waiting[lane] -= 1
+            self._busy = True
+            self._last = lane
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
 def limited_infer(fn):
     """Decorator to gate concurrent inference across the process."""
     def _wrap(*args, **kw):
         with _InferLimiter.sema:
             return fn(*args, **kw)
-    return _wrap
\ No newline at end of file
+    return _wrap
+
+
+def estimate_tokens(text: str, max_length: Optional[int] = None) -> int:
+    """Token count estimate for budget admission (inputs are truncated to max_length)."""
+    n = max(1, math.ceil(len(text.encode()) / _BYTES_PER_TOKEN))
+    return min(n, max_length) if max_length else n
+
+
+class TokenBudget:
+    """
+    Process-wide cap on the tokens inside the model at once, where a call costs its padded
+    sequence length x batch size. With it, DRSLLM_MAX_CONCURRENCY can be raised: short
+    requests run side by side while long ones wait for room instead of running out of
+    activation / KV memory.
+
+    Admission is FIFO, so a long request is not starved by a stream of short ones. A call
+    larger than the whole budget runs alone once everything before it has finished;
+    batches are split with `batches` so that each part fits.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: Deque[list] = deque()  # [cost, future] in arrival order
+        self._peak = 0
+        self._start = self._last = time.monotonic()
+        self._area = 0.0  # integral of in_use over time
+        self._waits_ms: Deque[float] = deque(maxlen=1024)  # admission waits of the recent requests
+        self._counters = dict(admitted=0, waited=0, oversize=0, splits=0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def _fits(self, cost: int) -> bool:
+        return self.in_use == 0 or self.in_use + cost <= self.limit
+
+    def _advance(self) -> None:
+        now = time.monotonic()
+        self._area += self.in_use * (now - self._last)
+        self._last = now
+
+    def _take(self, cost: int) -> None:
+        self._advance()
+        self.in_use += cost
+        self._peak = max(self._peak, self.in_use)
+        self._counters["admitted"] += 1
+        if cost > self.limit:
+            self._counters["oversize"] += 1
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, fut = self._waiters.popleft()
+            self._take(cost)
+            fut.set_result(None)
+
+    def try_acquire(self, cost: int) -> Optional[asyncio.Future]:
+        """Take `cost` now and return None, or join the queue and return a future set on admission."""
+        if not self._waiters and self._fits(cost):
+            self._take(cost)
+            self._waits_ms.append(0.0)
+            return None
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append([cost, fut])
+        self._counters["waited"] += 1
+        return fut
+
+    def admitted(self, waited_s: float) -> None:
+        self._waits_ms.append(waited_s * 1000.0)
+
+    def abandon(self, fut: asyncio.Future, cost: int) -> None:
+        """A queued caller gave up (deadline, disconnect): leave the queue, or give back an admission."""
+        for i, (_, f) in enumerate(self._waiters):
+            if f is fut:
+                del self._waiters[i]
+                self._wake()
+                return
+        if fut.done():
+            self.release(cost)
+
+    def release(self, cost: int) -> None:
+        self._advance()
+        self.in_use -= cost
+        self._wake()
+
+    def batches(self, costs: List[int]) -> List[List[int]]:
+        """Indices of `costs` grouped so that each group's padded cost (longest x size) fits the
+        budget; groups hold similar lengths, which also cuts padding. One group when disabled."""
+        if not self.enabled or max(costs, default=0) * len(costs) <= self.limit:
+            return [list(range(len(costs)))]
+        groups: List[List[int]] = []
+        for i in sorted(range(len(costs)), key=costs.__getitem__):
+            if groups and costs[i] * (len(groups[-1]) + 1) <= self.limit:
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        self._counters["splits"] += 1
+        return groups
+
+    def stats(self) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        self._advance()
+        waits = sorted(self._waits_ms)
+        elapsed = max(self._last - self._start, 1e-9)
+        return {
+            "limit_tokens": self.limit,
+            "in_use_tokens": self.in_use,
+            "utilization": round(self.in_use / self.limit, 3),
+            "mean_utilization": round(self._area / (elapsed * self.limit), 3),
+            "peak_tokens": self._peak,
+            "waiting": len(self._waiters),
+            **self._counters,
+            "wait_ms_p50": round(waits[len(waits) // 2], 2) if waits else None,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else None,
+        }
+
+
+# Shared by every InferenceExecutor in the process (they drive the same model)
+token_budget = TokenBudget(_MAX_INFLIGHT_TOKENS)
+
+
+def _param_refs(module: torch.nn.Module):
+    """(owner module, attribute, canonical name, parameter) for every parameter slot; tied weights
+    appear once per slot and share the canonical name of their first occurrence."""
+    canonical: Dict[int, str] = {}
+    for full, p in module.named_parameters(remove_duplicate=False):
+        owner, _, attr = full.rpartition(".")
+        yield module.get_submodule(owner), attr, canonical.setdefault(id(p), full), p
+
+
+def _offload_weights(module: torch.nn.Module) -> dict:
+    """Move parameter data to (pinned) host memory; returns what _restore_offloaded needs."""
+    import torch
+
+    pin = torch.cuda.is_available()
+    devices = {}
+    for _, _, name, p in _param_refs(module):
+        if name in devices:
+            continue
+        devices[name] = p.data.device
+        host = p.data.to("cpu")
+        p.data = host.pin_memory() if pin else host
+    return devices
+
+
+def _restore_offloaded(module: torch.nn.Module, devices: dict) -> None:
+    import torch
+
+    for _, _, name, p in _param_refs(module):
+        if p.data.device != devices[name]:
+            p.data = p.data.to(devices[name], non_blocking=True)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _unload_weights(module: torch.nn.Module, path: str) -> dict:
+    """Write the parameters to a safetensors snapshot and replace them with meta tensors."""
+    import torch
+    from safetensors.torch import save_file
+
+    refs = list(_param_refs(module))
+    unique = {name: p for _, _, name, p in refs}
+    save_file({name: p.detach().to("cpu").contiguous() for name, p in unique.items()}, path)
+    placement = {name: p.device for name, p in unique.items()}
+    for owner, attr, _, p in refs:
+        owner._parameters[attr] = torch.nn.Parameter(torch.empty_like(p, device="meta"), requires_grad=False)
+    return placement
+
+
+def _reload_weights(module: torch.nn.Module, path: str, placement: dict) -> None:
+    """Map the snapshot back in; tied slots get the same Parameter again."""
+    import torch
+    from safetensors import safe_open
+
+    params: Dict[str, torch.nn.Parameter] = {}
+    with safe_open(path, framework="pt") as f:
+        for owner, attr, name, _ in list(_param_refs(module)):
+            if name not in params:
+                params[name] = torch.nn.Parameter(f.get_tensor(name).to(placement[name]), requires_grad=False)
+            owner._parameters[attr] = params[name]
+
+
+class ResidencyManager:
+    """
+    Releases the model's memory after `idle_s` seconds without inference and brings it back
+    on the next call, which waits for it (reported as the "restore" stage).
+
+    offload: parameter data goes to pinned host memory and is copied back on demand; frees
+        accelerator memory only, works for 4-bit weights.
+    unload:  parameters are written to a safetensors snapshot (once per eviction) and
+        dropped; they are read back memory-mapped, from the page cache while it is warm.
+        Frees host and accelerator memory; not for quantized weights.
+    auto:    offload when the weights are on an accelerator, unload on CPU.
+
+    If bringing the model back fails, state is "failed" (reported in /health), requests get 503
+    and each one retries restoring the modules that are still released.
+
+    The model object opts in with `residency_modules()` -> {name: nn.Module}; objects
+    without it (shared backbone, ONNX, adapter registry) stay resident. Not used under
+    core.serve, where weights are shared between worker processes.
+    """
+    def __init__(self, singleton: "SingletonFactory", name: str, idle_s: float, mode: str, snapshot_dir: str):
+        self._singleton = singleton
+        self.name = name
+        self.idle_s = idle_s
+        self.mode = mode
+        self._snapshot_dir = snapshot_dir
+        self.state = "resident"
+        self._lock = asyncio.Lock()
+        self._inflight = 0
+        self._last_used = time.monotonic()
+        self._saved: Dict[str, tuple] = {}  # module name -> (how, restore info)
+        self._task: Optional[asyncio.Task] = None
+        self._restore_s: Deque[float] = deque(maxlen=256)
+        self._latency_ms = {"cold": deque(maxlen=1024), "warm": deque(maxlen=1024)}
+        self._counters = dict(evictions=0, restores=0, cold_requests=0, warm_requests=0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_s > 0 and os.getenv(WORKER_ID_ENV) is None
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        for how, info in self._saved.values():
+            if how == "unload" and os.path.exists(info[0]):
+                os.remove(info[0])
+
+    async def _loop(self) -> None:
+        poll_s = min(5.0, self.idle_s / 4)
+        while True:
+            await asyncio.sleep(poll_s)
+            if not startup_profile.ready or self.state != "resident" or self._inflight:
+                continue
+            if time.monotonic() - self._last_used < self.idle_s:
+                continue
+            async with self._lock:
+                if self._inflight or self.state != "resident":
+                    continue
+                self.state = "evicting"
+                try:
+                    await asyncio.to_thread(self._evict)
+                except Exception:
+                    log.exception("Releasing %s failed; keeping it resident", self.name)
+                    self.idle_s = 0.0
+                    try:
+                        await asyncio.to_thread(self._restore)
+                    except Exception:
+                        # Requests retry the restore of whatever is still released (and get 503 meanwhile)
+                        log.exception("Restoring %s after the failed release failed too", self.name)
+                        self.state = "failed"
+                    return
+
+    def _modules(self) -> Dict[str, torch.nn.Module]:
+        obj = self._singleton.get()
+        get = getattr(obj, "residency_modules", None)
+        return get() if get is not None else {}
+
+    def _evict(self) -> None:
+        import torch
+
+        modules = self._modules()
+        if not modules:
+            log.info("%s does not support residency management; keeping it resident", self.name)
+            self.state, self.idle_s = "resident", 0.0
+            return
+        t0 = time.perf_counter()
+        for key, module in modules.items():
+            how = self.mode
+            quantized = getattr(module.config, "quantization_config", None) is not None
+            on_accelerator = any(p.device.type != "cpu" for p in module.parameters())
+            if how == "auto":
+                how = "offload" if on_accelerator else "unload"
+            if how == "unload" and quantized:
+                how = "offload"
+            if how == "offload":
+                self._saved[key] = ("offload", _offload_weights(module))
+            else:
+                os.makedirs(self._snapshot_dir, exist_ok=True)
+                path = os.path.join(self._snapshot_dir, f"{self.name}-{key}.safetensors")
+                self._saved[key] = ("unload", (path, _unload_weights(module, path)))
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.state = "unloaded" if all(how == "unload" for how, _ in self._saved.values()) else "offloaded"
+        self._counters["evictions"] += 1
+        log.info("Released %s after %.0fs idle (%s in %.2fs)", self.name, self.idle_s, self.state,
+                 time.perf_counter() - t0)
+
+    def _restore(self) -> None:
+        t0 = time.perf_counter()
+        modules = self._modules()
+        # Each module leaves _saved once it is back, so a retry after a failure does not restore it twice
+        for key, (how, info) in list(self._saved.items()):
+            if how == "offload":
+                _restore_offloaded(modules[key], info)
+            else:
+                _reload_weights(modules[key], *info)
+            del self._saved[key]
+        self.state = "resident"
+        seconds = time.perf_counter() - t0
+        self._restore_s.append(seconds)
+        self._counters["restores"] += 1
+        log.info("Restored %s in %.2fs", self.name, seconds)
+
+    async def acquire(self) -> bool:
+        """Mark a call as in flight, restoring the model first if needed; True when it had to wait (cold)."""
+        self._inflight += 1
+        self._last_used = time.monotonic()
+        if self.state == "resident":
+            return False
+        try:
+            async with self._lock:
+                if self.state != "resident":
+                    self.state = "restoring"
+                    try:
+                        await asyncio.to_thread(self._restore)
+                    except Exception as e:
+                        log.exception("Restoring %s failed", self.name)
+                        self.state = "failed"
+                        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                            detail="The model could not be brought back into memory, retry later") from e
+        except BaseException:
+            self._inflight -= 1
+            raise
+        return True
+
+    def release(self, cold: bool, seconds: float) -> None:
+        self._inflight -= 1
+        self._last_used = time.monotonic()
+        kind = "cold" if cold else "warm"
+        self._counters[f"{kind}_requests"] += 1
+        self._latency_ms[kind].append(seconds * 1000.0)
+
+    def stats(self) -> dict:
+        def p50(values):
+            v = sorted(values)
+            return round(v[len(v) // 2], 2) if v else None
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "mode": self.mode,
+            "idle_s": self.idle_s,
+            "idle_for_s": round(time.monotonic() - self._last_used, 1),
+            **self._counters,
+            "restore_s_p50": p50(self._restore_s),
+            "restore_s_last": round(self._restore_s[-1], 3) if self._restore_s else None,
+            "cold_ms_p50": p50(self._latency_ms["cold"]),
+            "warm_ms_p50": p50(self._latency_ms["warm"]),
+        }
+
+
+def make_residency(settings, singleton: "SingletonFactory", name: str) -> ResidencyManager:
+    return ResidencyManager(singleton, name, settings.residency_idle_s, settings.residency_mode,
+                            settings.residency_snapshot_dir)
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Monotonic deadline derived from the forwarded timeout header, or None if absent."""
+    raw = request.headers.get(DEADLINE_HEADER)
+    if not raw:
+        return None
+    try:
+        budget_ms = float(raw)
+    except ValueError:
+        log.warning("Ignoring malformed %s header: %r", DEADLINE_HEADER, raw)
+        return None
+    return time.monotonic() + max(budget_ms, 0.0) / 1000.0
+
+
+class InferenceExecutor:
+    """
+    Bounded async front door for blocking inference calls.
+
+    Requests wait for one of `max_concurrency` slots; at most `max_queue` may wait at once.
+    Calls given a `cost` (estimated tokens, padded length x batch) then wait, holding their
+    slot, for room in the process-wide token_budget when DRSLLM_MAX_INFLIGHT_TOKENS is set. While waiting, a
+    request is dropped if its client disconnects or its deadline passes, so abandoned work
+    never reaches the model.
+    """
+    def __init__(self, max_concurrency: int = _MAX_CONCURRENCY, max_queue: int = _MAX_QUEUE,
+                 poll_s: float = _QUEUE_POLL_S, residency: Optional[ResidencyManager] = None):
+        self._residency = residency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._poll_s = poll_s
+        self._waiting = 0
+        self._running = 0
+        self._counters = dict(queued=0, completed=0, failed=0, dropped=0, expired=0, rejected=0)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self._max_concurrency,
+            "max_queue": self._max_queue,
+            "waiting": self._waiting,
+            "running": self._running,
+            **self._counters,
+            "token_budget": token_budget.stats(),
+        }
+
+    async def _check(self, request: Request, deadline: Optional[float]) -> float:
+        """Raise if the request expired or its client left; else the time to wait before checking again."""
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            self._counters["expired"] += 1
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                                detail="Deadline expired while queued for inference")
+        if await request.is_disconnected():
+            self._counters["dropped"] += 1
+            raise HTTPException(status_code=HTTP_CLIENT_CLOSED_REQUEST,
+                                detail="Client disconnected while queued for inference")
+        return self._poll_s if deadline is None else min(self._poll_s, deadline - now)
+
+    async def _admit(self, request: Request, deadline: Optional[float], cost: int) -> None:
+        fut = token_budget.try_acquire(cost)
+        if fut is None:
+            return
+        t0 = time.monotonic()
+        try:
+            while True:
+                timeout = await self._check(request, deadline)
+                try:
+                    await asyncio.wait_for(asyncio.shield(fut), timeout=timeout)
+                    break
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException:
+            token_budget.abandon(fut, cost)
+            raise
+        token_budget.admitted(time.monotonic() - t0)
+
+    async def _acquire(self, request: Request, deadline: Optional[float]) -> None:
+        while True:
+            timeout = await self._check(request, deadline)
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                continue
+            # Re-check once we hold the slot; the wait may have consumed the remaining budget
+            if (deadline is not None and time.monotonic() >= deadline) or await request.is_disconnected():
+                self._slots.release()
+                continue
+            return
+
+    async def run(self, request: Request, fn, *args, cost: Optional[int] = None, **kw):
+        """Queue `fn(*args, **kw)` for a worker thread, honoring the request's deadline and connection.
+        `cost` is the call's estimated tokens (padded length x batch) for the token budget."""
+        if self._waiting >= self._max_queue:
+            self._counters["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Inference queue is full, retry later")
+        deadline = request_deadline(request)
+        if not token_budget.enabled:
+            cost = None
+        self._waiting += 1
+        self._counters["queued"] += 1
+        try:
+            with stage("queue"):
+                await self._acquire(request, deadline)
+            # Tokens are taken only once the call holds a slot, so the budget counts work that is
+            # about to run rather than requests still waiting for a slot
+            if cost is not None:
+                try:
+                    with stage("budget"):
+                        await self._admit(request, deadline, cost)
+                except BaseException:
+                    self._slots.release()
+                    raise
+        except asyncio.CancelledError:
+            self._counters["dropped"] += 1
+            raise
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        acquired = cold = False
+        t0 = time.perf_counter()
+        try:
+            if self._residency is not None:
+                with stage("restore"):
+                    cold = await self._residency.acquire()
+                acquired = True
+            # Only while /debug/profile is capturing; otherwise fn runs untouched
+            session = active_session()
+            call = session.wrap(fn) if session is not None else fn
+            with stage("infer"):
+                result = await asyncio.to_thread(call, *args, **kw)
+        except Exception:
+            self._counters["failed"] += 1
+            raise
+        finally:
+            self._running -= 1
+            if acquired:
+                self._residency.release(cold, time.perf_counter() - t0)
+            self._slots.release()
+            if cost is not None:
+                token_budget.release(cost)
+        self._counters["completed"] += 1
+        return result
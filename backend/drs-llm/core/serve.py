@@ -0,0 +1,325 @@
+# /drs-llm/core/serve.py
+
+"""
+Multi-worker serving on one copy of the model weights.
+
+    python -m core.serve api_cls.app:app --workers 4 --port 8081
+
+The parent imports the app and binds the listening socket; the HTTP workers are forked
+from it and all accept on that socket, so request parsing, JSON and diff preprocessing
+scale with cores. How the model is shared depends on --mode (DRSLLM_WORKER_MODE):
+
+fork (CPU backends)
+    The parent builds every model singleton before forking. Workers run inference on
+    the inherited weights; tensor storage is never written after loading, so its pages
+    stay shared copy-on-write and an extra worker costs its Python heap and activations,
+    not another copy of the model. Each worker gets cores // workers torch threads.
+    Workers that exit are re-forked from the loaded parent.
+
+central (accelerators)
+    A CUDA context does not survive fork, so workers are forked before anything is
+    loaded and get a ModelProxy in place of each singleton. The parent then loads the
+    model and runs every model call sent by the workers on its single copy, where
+    limited_infer still bounds concurrency. Stage timings inside the model (tokenize,
+    forward) and /debug/profile traces are not visible from the workers in this mode.
+
+auto picks central when the model is placed on CUDA, fork otherwise. Background job
+processing (core.jobs) runs in worker 0 only.
+"""
+
+from __future__ import annotations
+import argparse
+import functools
+import importlib
+import logging
+import multiprocessing.connection as mpc
+import os
+import secrets
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import HTTPException
+
+from .runtime import WORKER_ID_ENV, SingletonFactory, model_singletons
+from .settings import BaseAppSettings, get_settings
+
+log = logging.getLogger(__name__)
+
+_SIMPLE = (str, int, float, bool, type(None), list, tuple, dict)
+
+
+# ---- central mode: model calls over a Unix socket ----
+
+def _pack_error(e: BaseException):
+    # HTTPException does not survive pickling (its args are empty)
+    if isinstance(e, HTTPException):
+        return ("http", e.status_code, e.detail, e.headers)
+    return ("exc", e)
+
+
+def _unpack_error(packed) -> BaseException:
+    if packed[0] == "http":
+        return HTTPException(status_code=packed[1], detail=packed[2], headers=packed[3])
+    return packed[1]
+
+
+def _describe(obj) -> dict:
+    methods, attrs = [], []
+    for name in dir(obj):
+        if name.startswith("_"):
+            continue
+        value = getattr(obj, name, None)
+        if callable(value):
+            methods.append(name)
+        elif isinstance(value, _SIMPLE):
+            attrs.append(name)
+    return {"methods": methods, "attrs": attrs}
+
+
+def _serve_connection(conn, singletons: Dict[str, SingletonFactory]) -> None:
+    while True:
+        try:
+            name, op, payload = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            obj = singletons[name].get()
+            if op == "describe":
+                value = _describe(obj)
+            elif op == "get":
+                value = getattr(obj, payload[0])
+            else:
+                attr, args, kw = payload
+                value = getattr(obj, attr)(*args, **kw)
+            reply = (True, value)
+        except BaseException as e:  # noqa: BLE001 - every failure goes back to the worker
+            reply = (False, _pack_error(e))
+        try:
+            conn.send(reply)
+        except Exception as e:  # unpicklable result or exception
+            conn.send((False, ("exc", RuntimeError(f"Model call {name}.{op} failed: {e!r}"))))
+
+
+def _serve_models(listener, singletons: Dict[str, SingletonFactory]) -> None:
+    """Accept worker connections; each worker thread gets its own connection and server thread."""
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, mpc.AuthenticationError):
+            log.exception("Rejected a model connection")
+            continue
+        threading.Thread(target=_serve_connection, args=(conn, singletons), name="model-rpc", daemon=True).start()
+
+
+class ModelProxy:
+    """
+    Stands in for a model singleton inside a central-mode worker. Public methods and plain
+    attributes of the real object are forwarded to the parent, one connection per thread
+    (the executor's worker threads), so concurrent calls do not serialize on a socket.
+    """
+    def __init__(self, address: str, authkey: bytes, name: str):
+        self._address = address
+        self._authkey = authkey
+        self._name = name
+        self._local = threading.local()
+        self._spec: Optional[dict] = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Blocks until the parent accepts, i.e. until the model is loaded
+            conn = self._local.conn = mpc.Client(self._address, family="AF_UNIX", authkey=self._authkey)
+        return conn
+
+    def _call(self, op: str, *payload):
+        conn = self._conn()
+        try:
+            conn.send((self._name, op, payload))
+            ok, value = conn.recv()
+        except (EOFError, OSError) as e:
+            self._local.conn = None
+            raise RuntimeError("Lost the connection to the model process") from e
+        if not ok:
+            raise _unpack_error(value)
+        return value
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if self._spec is None:
+            self._spec = self._call("describe")
+        if attr in self._spec["methods"]:
+            return functools.partial(self._method, attr)
+        if attr in self._spec["attrs"]:
+            return self._call("get", attr)
+        raise AttributeError(attr)
+
+    def _method(self, attr: str, *args, **kw):
+        return self._call("call", attr, args, kw)
+
+
+# ---- workers ----
+
+def _resolve_mode(mode: str, settings: BaseAppSettings) -> str:
+    if mode != "auto":
+        return mode
+    import torch
+
+    on_cpu = settings.device_map == "cpu" or settings.backend == "onnx" or not torch.cuda.is_available()
+    return "fork" if on_cpu else "central"
+
+
+def _run_worker(index: int, app_path: str, sock: socket.socket, args, mode: str,
+                rpc: Optional[tuple]) -> None:
+    os.environ[WORKER_ID_ENV] = str(index)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if mode == "fork":
+        import torch
+
+        torch.set_num_threads(args.torch_threads)
+        for singleton in model_singletons.values():
+            after_fork = getattr(singleton.get(), "after_fork", None)
+            if after_fork is not None:
+                after_fork()
+    else:
+        address, authkey = rpc
+        for name, singleton in model_singletons.items():
+            singleton.override(ModelProxy(address, authkey, name))
+    app = _import_app(app_path)
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_graceful_shutdown=args.graceful_s)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _import_app(app_path: str):
+    module, _, attr = app_path.partition(":")
+    return getattr(importlib.import_module(module), attr or "app")
+
+
+def _fork_worker(index: int, app_path: str, sock, args, mode: str, rpc) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(index, app_path, sock, args, mode, rpc)
+        except BaseException:
+            log.exception("Worker %d crashed", index)
+            code = 1
+        finally:
+            os._exit(code)
+    log.info("Started worker %d (pid %d, %s mode)", index, pid, mode)
+    return pid
+
+
+def _supervise(workers: Dict[int, int], respawn) -> None:
+    """Wait on workers; re-fork the ones that exit (fork mode) until asked to stop."""
+    stopping = False
+    starts: Dict[int, List[float]] = {}
+
+    def _stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = next((i for i, p in workers.items() if p == pid), None)
+        if index is None:
+            continue
+        del workers[index]
+        if stopping:
+            continue
+        log.warning("Worker %d (pid %d) exited with status %d", index, pid, os.waitstatus_to_exitcode(status))
+        recent = [t for t in starts.get(index, []) if time.monotonic() - t < 60.0]
+        if respawn is None or len(recent) >= 3:
+            log.error("Not restarting worker %d; shutting down", index)
+            _stop(signal.SIGTERM, None)
+            continue
+        starts[index] = recent + [time.monotonic()]
+        workers[index] = respawn(index)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    settings = get_settings()
+    ap = argparse.ArgumentParser(description="Serve an app from several worker processes sharing one model.")
+    ap.add_argument("app", help="module:attribute, e.g. api_cls.app:app")
+    ap.add_argument("--host", default=settings.host)
+    ap.add_argument("--port", type=int, default=settings.port)
+    ap.add_argument("--workers", type=int, default=settings.workers)
+    ap.add_argument("--mode", choices=("auto", "fork", "central"), default=settings.worker_mode)
+    ap.add_argument("--torch-threads", type=int, default=settings.worker_torch_threads,
+                    help="fork mode: intra-op threads per worker (0: cores // workers)")
+    ap.add_argument("--log-level", default=settings.log_level.lower())
+    ap.add_argument("--graceful-s", type=int, default=30)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args.torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    mode = _resolve_mode(args.mode, settings)
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Importing the app registers its model singletons (nothing is loaded yet)
+    _import_app(args.app)
+    if not model_singletons:
+        raise SystemExit(f"{args.app} registers no model singletons")
+    log.info("Serving %s on %s:%d with %d workers (%s mode)", args.app, args.host, args.port, args.workers, mode)
+
+    if mode == "fork":
+        for name, singleton in model_singletons.items():
+            t0 = time.perf_counter()
+            singleton.get()
+            log.info("Loaded %s in %.1fs before forking", name, time.perf_counter() - t0)
+        fork = functools.partial(_fork_worker, app_path=args.app, sock=sock, args=args, mode=mode, rpc=None)
+        workers = {i: fork(i) for i in range(args.workers)}
+        _supervise(workers, fork)
+        return
+
+    address = os.path.join(tempfile.mkdtemp(prefix="drsllm-"), "model.sock")
+    authkey = secrets.token_bytes(32)
+    listener = mpc.Listener(address, family="AF_UNIX", authkey=authkey)
+    # Workers first: they must not inherit a CUDA context (and are not re-forked later)
+    workers = {
+        i: _fork_worker(i, app_path=args.app, sock=sock, args=args, mode=mode, rpc=(address, authkey))
+        for i in range(args.workers)
+    }
+    sock.close()
+
+    def _load_and_serve():
+        try:
+            for name, singleton in model_singletons.items():
+                t0 = time.perf_counter()
+                singleton.get()
+                log.info("Loaded %s in %.1fs; serving model calls", name, time.perf_counter() - t0)
+        except Exception:
+            log.exception("Model load failed; stopping workers")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        _serve_models(listener, model_singletons)
+
+    threading.Thread(target=_load_and_serve, name="model-owner", daemon=True).start()
+    _supervise(workers, None)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,8 +1,9 @@
 # /drs-llm/core/settings.py
 
+from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
-from typing import Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 class BaseAppSettings(BaseSettings):
     # May be: (a) full fine-tuned model dir OR (b) a PEFT/LoRA adapter dir
@@ -16,6 +17,89 @@ class BaseAppSettings(BaseSettings):
     local_files_only: bool = True
     trust_remote_code: bool = True
     device_map: str = "auto"
+    # Attention kernel passed to from_pretrained ("sdpa", "eager", "flash_attention_2"); None keeps the default
+    attn_implementation: Optional[str] = None
+    # Torch seq-cls engine: "direct" tokenizes and runs the model forward itself (batched, under
+    # inference_mode, softmax/argmax on device); "pipeline" keeps the HF text-classification pipeline
+    seq_cls_engine: Literal["direct", "pipeline"] = "direct"
+    # torch.compile the direct engine's forward (dynamic shapes); the first calls pay the compile
+    torch_compile: bool = False
+    # Inference backend for seq-cls: "torch" (seq_cls_engine above) or "onnx" (ONNX Runtime on CPU)
+    backend: Literal["torch", "onnx"] = "torch"
+    # ONNX: exported graphs are cached here; onnx_source_model exports a different (e.g. distilled)
+    # full seq-cls model instead of model_id; intra-op threads 0 lets ONNX Runtime decide
+    onnx_cache_dir: str = ".cache/onnx"
+    onnx_source_model: Optional[str] = None
+    onnx_quantize_int8: bool = True
+    onnx_intra_op_threads: int = 0
+    # Opt-in: adapters are merged into their base once and cached here as safetensors. The first
+    # start merges unquantized (an 8B base needs ~16 GB of RAM and as much disk); None serves the adapter
+    merged_cache_dir: Optional[str] = None
+
+    # Multi-adapter serving (seq-cls): name -> PEFT adapter dir, all attached to base_model_path.
+    # Empty keeps the single-model behavior of model_id. Raise DRSLLM_MAX_CONCURRENCY so that
+    # concurrent requests for one adapter can be grouped into a batch.
+    adapters: Dict[str, str] = {}
+    default_adapter: Optional[str] = None
+    adapter_memory_budget_mb: int = 2048
+    adapter_batch_size: int = 8
+    adapter_batch_wait_ms: float = 5.0
+
+    # Confidence cascade (seq-cls): a small full seq-cls model with the same labels answers first;
+    # requests whose first-stage confidence is inside cascade_band [low, high) go to the main model
+    cascade_first_stage: Optional[str] = None
+    cascade_band: List[float] = [0.0, 0.9]
+    cascade_device: str = "cpu"
+
+    # Seq-cls results cached by commit_fingerprint (patch-id + cleaned message), so rebased and
+    # cherry-picked commits are not rescored; 0 disables
+    prediction_cache_size: int = 10000
+
+    # Similar-commit index (seq-cls, direct engine): the pooled hidden state of every scored or labeled
+    # commit is stored under similar_index_dir and searched by /similar; None disables. "approx"
+    # searches a similar_approx_dim-dim random projection and re-ranks the best candidates exactly
+    similar_index_dir: Optional[str] = None
+    similar_index_mode: Literal["exact", "approx"] = "exact"
+    similar_approx_dim: int = 256
+    similar_approx_candidates: int = 256
+    similar_max_k: int = 50
+    similar_add_max_items: int = 1000
+
+    # /predict_stream: items are batched as they arrive (up to stream_batch_size, waiting at most
+    # stream_batch_wait_ms after the first); at most stream_max_pending parsed items are buffered
+    stream_batch_size: int = 8
+    stream_batch_wait_ms: float = 20.0
+    stream_max_pending: int = 64
+    stream_max_line_bytes: int = 4_000_000
+
+    # Background jobs (POST /jobs): one SQLite file per service ("{service}" is filled in). Jobs are
+    # processed a batch at a time, highest priority first, and only while no interactive request
+    # is waiting for the model; finished jobs are kept for jobs_retention_hours (at most jobs_max_finished)
+    jobs_db_path: str = ".cache/jobs/{service}.sqlite3"
+    jobs_batch_size: int = 8
+    jobs_max_items: int = 10000
+    jobs_max_queued: int = 100
+    jobs_retention_hours: float = 72.0
+    jobs_max_finished: int = 1000
+    jobs_max_wait_s: float = 60.0
+
+    # Assisted (speculative) decoding for the CLM service: a small causal LM with model_id's tokenizer
+    # drafts draft_num_tokens tokens per step and the main model verifies them in one forward pass.
+    # Greedy output is unchanged; None disables. The draft stops a step early when its top token's
+    # probability falls below draft_confidence_threshold (0 always drafts draft_num_tokens)
+    draft_model_id: Optional[str] = None
+    draft_num_tokens: int = 5
+    draft_confidence_threshold: float = 0.4
+
+    # CLM generation: server caps on each explanation (requests may ask for less; clm_max_time_s 0 = no time
+    # cap). Decoding ends early at EOS or the first of clm_stop_strings, which is cut from the returned text
+    clm_max_new_tokens: int = 100
+    clm_max_time_s: float = 0.0
+    clm_stop_strings: List[str] = ["</ANSWER>"]
+
+    # One process serves both seq-cls (model_id adapter) and CLM explanations (base_model_path)
+    # on a single copy of the base weights; see api_combined
+    combined_serving: bool = False
 
     clm_for_seq_cls: bool = False
     zero_token: str = "0"
@@ -23,9 +107,30 @@ class BaseAppSettings(BaseSettings):
     drs_token: str  = "[/drs]"
     strict_single_token: bool = True
 
+    # Residency: after residency_idle_s without inference the model's memory is released and the next
+    # request brings it back. "offload" parks the weights in pinned host memory (frees the accelerator;
+    # works for 4-bit), "unload" drops them and maps them back from a safetensors snapshot under
+    # residency_snapshot_dir (frees host memory too); "auto" offloads from accelerators and unloads on
+    # CPU. 0 keeps the model resident
+    residency_idle_s: float = 0.0
+    residency_mode: Literal["auto", "offload", "unload"] = "auto"
+    residency_snapshot_dir: str = ".cache/residency"
+
+    # Warm-up: approximate token lengths run through the model before readiness; [] disables
+    warmup_lengths: List[int] = [128, 1024, 4000]
+
     # Server
     host: str = "0.0.0.0"
     port: int = 8080
+    # python -m core.serve: HTTP worker processes sharing one copy of the model. worker_mode "fork"
+    # shares the loaded weights copy-on-write (CPU); "central" runs the model in the parent and
+    # forwards calls to it (accelerators); "auto" picks by device. worker_torch_threads 0 = cores // workers
+    workers: int = 1
+    worker_mode: Literal["auto", "fork", "central"] = "auto"
+    worker_torch_threads: int = 0
+    # Bearer token for /debug/profile (set it in secrets.env); unset disables the endpoint
+    debug_token: Optional[str] = None
+    profile_max_seconds: int = 60
 
     # Logging
     log_level: str = Field("INFO")
@@ -43,9 +148,19 @@ class BaseAppSettings(BaseSettings):
         env_file_encoding="utf-8",
     )
 
+    @field_validator("cascade_band")
+    @classmethod
+    def _band(cls, v: List[float]) -> List[float]:
+        if len(v) != 2 or not v[0] <= v[1]:
+            raise ValueError("cascade_band must be [low, high] with low <= high")
+        return v
+
     @field_validator("log_level", "access_log_level", "transformers_log_level", mode="before")
     @classmethod
     def _upper(cls, v: str) -> str:
         return str(v).upper()
 
-settings = BaseAppSettings()
+@lru_cache(maxsize=1)
+def get_settings() -> BaseAppSettings:
+    """The process's settings, read from the environment and env files once, on first use."""
+    return BaseAppSettings()
@@ -0,0 +1,202 @@
+# /drs-llm/core/streaming.py
+
+"""
+NDJSON streaming for /predict_stream.
+
+The request body is read line by line as it arrives. Each line is parsed into an item and
+placed on a bounded queue, and items are handed to the service in batches: a batch is
+whatever has arrived, up to `batch_size`, waiting at most `batch_wait_s` after its first
+item. Every result is written as one NDJSON line tagged with its input `index` as soon
+as its batch is done. When the queue is full the body is not read any further, so memory
+stays bounded however large the submission is, and TCP flow control pushes back on the
+client.
+
+Clients must read the response while they are still sending (curl -T -, aiohttp, ...);
+a client that writes the whole body before reading will stall once both socket
+buffers are full.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+from .runtime import HTTP_CLIENT_CLOSED_REQUEST
+
+log = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_EOF = object()
+
+# (input index, parsed item or None, error message or None)
+StreamItem = Tuple[int, Optional[BaseModel], Optional[str]]
+
+
+class StreamClient:
+    """
+    Stand-in for the Request handed to InferenceExecutor.run during a stream.
+
+    Request.is_disconnected() would consume body chunks that the reader has not read
+    yet, so the reader tracks disconnects itself and this object reports them.
+    """
+    def __init__(self, request: Request):
+        self.headers = request.headers
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+class NDJSONStreamResponse(StreamingResponse):
+    """StreamingResponse without Starlette's disconnect listener, which would race the
+    body reader for `receive`; the reader reports disconnects through StreamClient."""
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _read_items(request: Request, client: StreamClient, queue: asyncio.Queue,
+                      model: type[BaseModel], max_line_bytes: int) -> None:
+    index = 0
+    buf = b""
+    skipping = False  # inside an over-long line, dropping bytes until its newline
+
+    async def emit(line: bytes) -> None:
+        nonlocal index
+        if len(line) > max_line_bytes:
+            await queue.put((index, None, f"Line exceeds {max_line_bytes} bytes"))
+            index += 1
+        elif line.strip():
+            try:
+                await queue.put((index, model.model_validate_json(line), None))
+            except ValidationError as e:
+                await queue.put((index, None, _validation_message(e)))
+            index += 1
+
+    try:
+        async for chunk in request.stream():
+            buf += chunk
+            while True:
+                nl = buf.find(b"\n")
+                if nl < 0:
+                    break
+                line, buf = buf[:nl], buf[nl + 1:]
+                if skipping:
+                    skipping = False
+                    continue
+                await emit(line)
+            if not skipping and len(buf) > max_line_bytes:
+                await queue.put((index, None, f"Line exceeds {max_line_bytes} bytes"))
+                index += 1
+                buf, skipping = b"", True
+            elif skipping:
+                buf = b""
+        if not skipping:
+            await emit(buf)
+        await queue.put(_EOF)
+        # Body done: keep listening so that a client that goes away stops the remaining batches
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        client.disconnected = True
+    except ClientDisconnect:
+        client.disconnected = True
+        await queue.put(_EOF)
+    except Exception:
+        log.exception("Reading the NDJSON stream failed")
+        await queue.put(_EOF)
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'body'}: {err['msg']}" for err in e.errors())
+
+
+async def _next_batch(queue: asyncio.Queue, batch_size: int, wait_s: float) -> Tuple[List[StreamItem], bool]:
+    """Up to batch_size items, waiting at most wait_s after the first; also returns whether input ended."""
+    first = await queue.get()
+    if first is _EOF:
+        return [], True
+    batch = [first]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_s
+    while len(batch) < batch_size:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+        if item is _EOF:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def _line(obj: dict) -> bytes:
+    return (json.dumps(obj) + "\n").encode()
+
+
+def stream_ndjson(
+    request: Request,
+    model: type[BaseModel],
+    run_batch: Callable[[StreamClient, List[BaseModel]], Awaitable[List[Any]]],
+    *,
+    batch_size: int,
+    batch_wait_s: float,
+    max_pending: int,
+    max_line_bytes: int,
+) -> NDJSONStreamResponse:
+    """
+    Serve an NDJSON stream of `model` items. `run_batch(client, items)` returns one result
+    per item: a dict (merged into the output line) or an HTTPException for that item.
+    Lines that do not parse are answered with {"index", "error", "status": 422}.
+    """
+    client = StreamClient(request)
+
+    async def results():
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        reader = asyncio.create_task(_read_items(request, client, queue, model, max_line_bytes))
+        try:
+            done = False
+            while not done and not client.disconnected:
+                batch, done = await _next_batch(queue, batch_size, batch_wait_s)
+                for index, _, error in batch:
+                    if error is not None:
+                        yield _line({"index": index, "error": error, "status": 422})
+                valid = [(index, item) for index, item, error in batch if error is None]
+                if not valid:
+                    continue
+                try:
+                    outs = await run_batch(client, [item for _, item in valid])
+                except HTTPException as e:
+                    if e.status_code == HTTP_CLIENT_CLOSED_REQUEST:
+                        break
+                    outs = [e] * len(valid)
+                except Exception:
+                    # The response has started; fail this batch's items instead of the stream
+                    log.exception("Stream batch failed")
+                    outs = [HTTPException(status_code=500, detail="Inference failed")] * len(valid)
+                for (index, _), out in zip(valid, outs):
+                    if isinstance(out, HTTPException):
+                        yield _line({"index": index, "error": str(out.detail), "status": out.status_code})
+                    else:
+                        yield _line({"index": index, **out})
+        finally:
+            reader.cancel()
+            if client.disconnected:
+                log.info("Stream client disconnected; remaining input dropped")
+
+    return NDJSONStreamResponse(results())
@@ -0,0 +1,146 @@
+# /drs-llm/core/timing.py
+
+"""
+Per-request stage timing.
+
+ServerTimingMiddleware gives every HTTP request a RequestTiming in a context variable.
+Code on the request path records stages with `stage("name")` and counters with
+`count("name", n)`; both are no-ops outside a request (warm-up, benchmarks). Worker
+threads started with asyncio.to_thread inherit the context, so the model layer can
+record tokenization and forward time too.
+
+The middleware returns the stages as a `Server-Timing` header and feeds them into
+`stage_stats`, which keeps a bounded window per route for percentile summaries.
+"""
+
+from __future__ import annotations
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+
+SERVER_TIMING_HEADER = "Server-Timing"
+
+_current: ContextVar[Optional["RequestTiming"]] = ContextVar("drs_request_timing", default=None)
+
+
+class RequestTiming:
+    """Stage durations (ms, summed per name) and integer counters for one request."""
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def count(self, name: str, n: int) -> None:
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000.0
+
+    def header(self) -> str:
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        parts.extend(f'{name};desc="{n}"' for name, n in self.counts.items())
+        return ", ".join(parts)
+
+    def as_dict(self) -> dict:
+        return {
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+            "total_ms": round(self.total_ms(), 2),
+            **self.counts,
+        }
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name` of the current request (no-op outside one)."""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, (time.perf_counter() - t0) * 1000.0)
+
+
+def count(name: str, n: int) -> None:
+    timing = _current.get()
+    if timing is not None:
+        timing.count(name, n)
+
+
+class StageStats:
+    """Sliding window (last `window` requests) of stage timings per route, summarized as percentiles."""
+    def __init__(self, window: int = 1024):
+        self._window = window
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Deque[float]]] = {}
+        self._requests: Dict[str, int] = {}
+
+    def record(self, route: str, timing: RequestTiming) -> None:
+        values = {**timing.stages, "total": timing.total_ms(), **timing.counts}
+        with self._lock:
+            series = self._routes.setdefault(route, {})
+            for name, v in values.items():
+                series.setdefault(name, deque(maxlen=self._window)).append(float(v))
+            self._requests[route] = self._requests.get(route, 0) + 1
+
+    @staticmethod
+    def _summary(values) -> dict:
+        v = sorted(values)
+        q = statistics.quantiles(v, n=100, method="inclusive") if len(v) > 1 else v * 99
+        return {"n": len(v), "p50": round(q[49], 2), "p95": round(q[94], 2), "p99": round(q[98], 2), "max": round(v[-1], 2)}
+
+    def summary(self) -> dict:
+        with self._lock:
+            snapshot = {route: {name: list(d) for name, d in series.items()} for route, series in self._routes.items()}
+            requests = dict(self._requests)
+        return {
+            route: {"requests": requests[route], "metrics": {name: self._summary(v) for name, v in series.items()}}
+            for route, series in snapshot.items()
+        }
+
+
+stage_stats = StageStats()
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: per-request RequestTiming, `Server-Timing` response header, stage_stats feed."""
+    def __init__(self, app, stats: StageStats = stage_stats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _current.set(timing)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(SERVER_TIMING_HEADER, timing.header())
+                # Only requests that recorded a stage (predictions) go into the stats, keyed by route template
+                if timing.stages:
+                    route = getattr(scope.get("route"), "path", scope["path"])
+                    self.stats.record(f"{scope['method']} {route}", timing)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
@@ -1,16 +1,99 @@
 # gateway/app.py
 import os
+import json
+import time
 import asyncio
-from typing import Dict, Iterable
+import bisect
+import random
+import statistics
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 
 import httpx
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 SEQ_BASE = os.getenv("SEQ_BASE", "http://localhost:8081").rstrip("/")
 CLM_BASE = os.getenv("CLM_BASE", "http://localhost:8082").rstrip("/")
 TIMEOUT_S = float(os.getenv("GATEWAY_TIMEOUT_S", "60"))
 
+# Remaining time budget forwarded upstream so backends can drop work nobody is waiting for
+DEADLINE_HEADER = "X-DRS-Timeout-Ms"
+
+# Upstream /ready results are cached this long; cold upstreams get a fast 503 instead of traffic
+READY_TTL_S = float(os.getenv("GATEWAY_READY_TTL_S", "5"))
+PROBE_PATHS = {"", "health", "ready"}
+_ready_cache: Dict[str, Tuple[float, bool]] = {}
+# Model residency reported with readiness ("resident", "offloaded", "unloaded", ...); released replicas
+# still serve but the next request pays the reload, so routing prefers resident ones
+_residency: Dict[str, Optional[str]] = {}
+
+# Gateway stages appended to the upstream's Server-Timing; recent values kept per route for /debug/timings
+SERVER_TIMING_HEADER = "Server-Timing"
+TIMING_WINDOW = int(os.getenv("GATEWAY_TIMING_WINDOW", "1024"))
+_MAX_TIMED_ROUTES = 64
+_timings: Dict[str, Dict[str, Deque[float]]] = {}
+
+
+# ---- Length-aware routing ----
+# Each service has a "short" and a "long" replica pool (comma-separated bases). Requests whose
+# estimated input exceeds LONG_THRESHOLD_BYTES go to the long pool so big diffs do not
+# head-of-line-block small ones. Both pools default to SEQ_BASE / CLM_BASE (plain proxying).
+def _bases(env: str, default: str) -> List[str]:
+    return [b.strip().rstrip("/") for b in os.getenv(env, "").split(",") if b.strip()] or [default]
+
+POOLS: Dict[str, Dict[str, List[str]]] = {
+    "seq-cls": {"short": _bases("SEQ_SHORT_BASES", SEQ_BASE), "long": _bases("SEQ_LONG_BASES", SEQ_BASE)},
+    "clm": {"short": _bases("CLM_SHORT_BASES", CLM_BASE), "long": _bases("CLM_LONG_BASES", CLM_BASE)},
+}
+DEFAULT_BASES = {"seq-cls": SEQ_BASE, "clm": CLM_BASE}
+LONG_THRESHOLD_BYTES = int(os.getenv("GATEWAY_LONG_THRESHOLD_BYTES", "12000"))
+# Pool for requests whose size cannot be estimated (e.g. the commit lookup failed)
+UNKNOWN_SIZE_POOL = os.getenv("GATEWAY_UNKNOWN_SIZE_POOL", "long")
+# /predict_by_sha bodies carry no diff; its size comes from the commit's patches on GitHub (cached)
+GITHUB_API_BASE = os.getenv("GATEWAY_GITHUB_API_BASE", os.getenv("DRSLLM_GITHUB_API_BASE", "https://api.github.com")).rstrip("/")
+GITHUB_TOKEN = os.getenv("GATEWAY_GITHUB_TOKEN") or os.getenv("DRSLLM_GITHUB_TOKEN")
+_SIZE_CACHE_MAX = 4096
+_commit_sizes: "OrderedDict[str, int]" = OrderedDict()
+_rr: Dict[Tuple[str, str], int] = {}
+
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class _PoolHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.fallbacks = 0
+        self.by_status: Dict[str, int] = {}
+
+    def observe(self, ms: float, status: int, fallback: bool) -> None:
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.fallbacks += int(fallback)
+        key = f"{status // 100}xx"
+        self.by_status[key] = self.by_status.get(key, 0) + 1
+
+    def as_dict(self) -> dict:
+        edges = [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+        cumulative, acc = {}, 0
+        for edge, n in zip(edges, self.buckets):
+            acc += n
+            cumulative[edge] = acc
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 2) if self.count else None,
+            "fallbacks": self.fallbacks,
+            "status": self.by_status,
+            "le_ms": cumulative,
+        }
+
+
+_pool_hist: Dict[Tuple[str, str], _PoolHistogram] = {}
+
 HOP_BY_HOP = {
     "connection",
     "keep-alive",
@@ -43,6 +126,8 @@ async def _startup():
 
 @app.on_event("shutdown")
 async def _shutdown():
+    for task in list(_shadow_tasks):
+        task.cancel()
     await app.state.client.aclose()
 
 
@@ -58,6 +143,18 @@ def _forwardable_request_headers(headers: Iterable[tuple[str, str]]) -> Dict[str
     return out
 
 
+def _with_deadline(headers: Dict[str, str]) -> Dict[str, str]:
+    """Set the deadline header to the gateway timeout, or the caller's own budget if tighter."""
+    budget_ms = TIMEOUT_S * 1000.0
+    for k in [k for k in headers if k.lower() == DEADLINE_HEADER.lower()]:
+        try:
+            budget_ms = min(budget_ms, float(headers.pop(k)))
+        except ValueError:
+            pass
+    headers[DEADLINE_HEADER] = str(int(budget_ms))
+    return headers
+
+
 def _forwardable_response_headers(headers: httpx.Headers) -> Dict[str, str]:
     out: Dict[str, str] = {}
     for k, v in headers.items():
@@ -70,12 +167,54 @@ def _forwardable_response_headers(headers: httpx.Headers) -> Dict[str, str]:
     return out
 
 
+async def _upstream_ready(base: str) -> bool:
+    """Readiness of an upstream (model loaded and warmed up), cached for READY_TTL_S."""
+    now = time.monotonic()
+    cached = _ready_cache.get(base)
+    if cached and now - cached[0] < READY_TTL_S:
+        return cached[1]
+    client: httpx.AsyncClient = app.state.client
+    try:
+        r = await client.get(f"{base}/ready", timeout=min(TIMEOUT_S, 2.0))
+        ok = r.status_code == 200
+        _residency[base] = r.json().get("residency") if ok else None
+    except (httpx.HTTPError, ValueError):
+        ok = False
+    _ready_cache[base] = (now, ok)
+    return ok
+
+
+def _resident(base: str) -> bool:
+    return _residency.get(base) in (None, "resident")
+
+
+def _record_timings(route: str, stages: Dict[str, float]) -> None:
+    if route not in _timings and len(_timings) >= _MAX_TIMED_ROUTES:
+        return
+    series = _timings.setdefault(route, {})
+    for name, ms in stages.items():
+        series.setdefault(name, deque(maxlen=TIMING_WINDOW)).append(ms)
+
+
+def _percentiles(values) -> Dict[str, float]:
+    v = sorted(values)
+    q = statistics.quantiles(v, n=100, method="inclusive") if len(v) > 1 else v * 99
+    return {"n": len(v), "p50": round(q[49], 2), "p95": round(q[94], 2), "p99": round(q[98], 2), "max": round(v[-1], 2)}
+
+
 async def _proxy(request: Request, base: str, tail_path: str) -> Response:
     """
     Generic reverse proxy: forwards method/headers/body/query to the target base.
     tail_path: remainder after prefix (/seq-cls or /clm) has been stripped.
     """
+    t0 = time.perf_counter()
     client: httpx.AsyncClient = app.state.client
+    if tail_path.strip("/") not in PROBE_PATHS and not await _upstream_ready(base):
+        return JSONResponse(
+            {"detail": "Upstream model is not ready yet"},
+            status_code=503,
+            headers={"Retry-After": str(int(READY_TTL_S) or 1)},
+        )
     method = request.method
     query = request.url.query
     upstream_url = f"{base}/{tail_path.lstrip('/')}"
@@ -83,10 +222,20 @@ async def _proxy(request: Request, base: str, tail_path: str) -> Response:
         upstream_url = f"{upstream_url}?{query}"
 
     body = await request.body()
-    headers = _forwardable_request_headers(request.headers.items())
+    headers = _with_deadline(_forwardable_request_headers(request.headers.items()))
 
+    t_up = time.perf_counter()
     upstream = await client.request(method, upstream_url, content=body, headers=headers)
+    upstream_ms = (time.perf_counter() - t_up) * 1000.0
+    request.state.upstream_ms = upstream_ms
     resp_headers = _forwardable_response_headers(upstream.headers)
+
+    stages = {"upstream": upstream_ms, "proxy": (time.perf_counter() - t0) * 1000.0 - upstream_ms}
+    ours = ", ".join(f"{name};dur={ms:.1f}" for name, ms in stages.items())
+    upstream_timing = resp_headers.pop(SERVER_TIMING_HEADER.lower(), None)
+    resp_headers[SERVER_TIMING_HEADER] = f"{upstream_timing}, {ours}" if upstream_timing else ours
+    if tail_path.strip("/") not in PROBE_PATHS:
+        _record_timings(f"{method} {request.url.path}", stages)
     return Response(
         content=upstream.content,
         status_code=upstream.status_code,
@@ -118,7 +267,13 @@ async def health():
 
     seq_fut = check(f"{SEQ_BASE}/health")
     clm_fut = check(f"{CLM_BASE}/health")
-    seq, clm = await asyncio.gather(seq_fut, clm_fut)
+    seq, clm, seq_ready, clm_ready = await asyncio.gather(
+        seq_fut, clm_fut, _upstream_ready(SEQ_BASE), _upstream_ready(CLM_BASE)
+    )
+    seq["ready"] = seq_ready
+    clm["ready"] = clm_ready
+    seq["residency"] = _residency.get(SEQ_BASE)
+    clm["residency"] = _residency.get(CLM_BASE)
 
     return {
         "gateway": "ok",
@@ -129,29 +284,425 @@ async def health():
     }
 
 
+@app.get("/debug/timings")
+async def debug_timings():
+    """Gateway upstream/proxy percentiles (ms) per route; backends serve their own stages at /debug/timings."""
+    return {
+        route: {name: _percentiles(list(values)) for name, values in series.items()}
+        for route, series in list(_timings.items())
+    }
+
+
+@app.get("/debug/pools")
+async def debug_pools():
+    """Pool membership/readiness and per-pool latency histograms (cumulative counts per upper bound in ms)."""
+    out = {}
+    for service, pools in POOLS.items():
+        out[service] = {}
+        for pool, members in pools.items():
+            hist = _pool_hist.get((service, pool)) or _PoolHistogram()
+            out[service][pool] = {
+                "members": {b: _ready_cache.get(b, (0.0, None))[1] for b in members},
+                "residency": {b: _residency.get(b) for b in members},
+                "latency": hist.as_dict(),
+            }
+    return {"long_threshold_bytes": LONG_THRESHOLD_BYTES, "pools": out}
+
+
+# ---- Routing ----
+
+def _pools_split(service: str) -> bool:
+    return POOLS[service]["short"] != POOLS[service]["long"]
+
+
+async def _fetch_commit(repo: str, sha: str) -> Tuple[int, Optional[dict]]:
+    """(status, commit JSON) from the GitHub commits API; status 0 when GitHub was unreachable."""
+    headers = {"Accept": "application/vnd.github+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    client: httpx.AsyncClient = app.state.client
+    try:
+        r = await client.get(f"{GITHUB_API_BASE}/repos/{repo}/commits/{sha}", headers=headers, timeout=min(TIMEOUT_S, 10.0))
+        if r.status_code != 200:
+            return r.status_code, None
+        data = r.json()
+    except (httpx.HTTPError, ValueError):
+        return 0, None
+    if not isinstance(data, dict):
+        return 0, None
+    _remember_size(f"{repo}@{sha}", _json_size(data))
+    return 200, data
+
+
+def _json_size(data: dict) -> int:
+    return len(data.get("commit", {}).get("message", "")) + sum(len(f.get("patch", "")) for f in data.get("files", []))
+
+
+def _remember_size(key: str, size: int) -> None:
+    _commit_sizes[key] = size
+    _commit_sizes.move_to_end(key)
+    if len(_commit_sizes) > _SIZE_CACHE_MAX:
+        _commit_sizes.popitem(last=False)
+
+
+async def _commit_size(repo: str, sha: str) -> Optional[int]:
+    """Bytes of the commit's patches plus message, from the GitHub commit JSON (LRU-cached)."""
+    key = f"{repo}@{sha}"
+    if key in _commit_sizes:
+        _commit_sizes.move_to_end(key)
+        return _commit_sizes[key]
+    status, _ = await _fetch_commit(repo, sha)
+    return _commit_sizes.get(key) if status == 200 else None
+
+
+async def _estimate_size(request: Request, tail: str) -> Optional[int]:
+    """Cheap input-size estimate: body length, or the fetched diff length for predict_by_sha."""
+    body = await request.body()
+    if not tail.endswith("predict_by_sha"):
+        return len(body)
+    try:
+        j = json.loads(body)
+        return await _commit_size(j["repo"], j["sha"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+async def _pick(service: str, pool: str) -> Optional[str]:
+    """Next ready member of a pool, round-robin, preferring members whose model is resident."""
+    members = POOLS[service][pool]
+    start = _rr.get((service, pool), 0)
+    fallback = None
+    for i in range(len(members)):
+        base = members[(start + i) % len(members)]
+        if await _upstream_ready(base):
+            if _resident(base):
+                _rr[(service, pool)] = start + i + 1
+                return base
+            fallback = fallback or (base, start + i + 1)
+    if fallback is not None:
+        _rr[(service, pool)] = fallback[1]
+        return fallback[0]
+    return None
+
+
+async def _choose(service: str, size: Optional[int]) -> Tuple[str, str, bool]:
+    """(base, pool, fell back to the other pool) for an input of `size` bytes."""
+    if size is None:
+        pool = UNKNOWN_SIZE_POOL
+    else:
+        pool = "long" if size >= LONG_THRESHOLD_BYTES else "short"
+    fallback = False
+    base = await _pick(service, pool)
+    if base is None:
+        # Pool unhealthy: serve from the other one rather than failing
+        other = "short" if pool == "long" else "long"
+        base = await _pick(service, other)
+        if base is not None:
+            pool, fallback = other, True
+    return base or POOLS[service][pool][0], pool, fallback  # nothing ready: the caller answers 503
+
+
+# NDJSON /predict_stream writes results while the body is still uploading. httpx sends the whole
+# request before reading the response, so proxying it would buffer both sides in the gateway and
+# stall once unread results fill the socket buffers. Clients stream to the service directly.
+STREAM_PATHS = {"predict_stream"}
+
+
+async def _route(request: Request, service: str, path: str) -> Response:
+    tail = path.strip("/")
+    if tail in STREAM_PATHS:
+        return JSONResponse(
+            {"detail": f"The gateway does not proxy /{tail}; send the stream to the {service} service directly"},
+            status_code=501,
+        )
+    t0 = time.perf_counter()
+    if tail in PROBE_PATHS or not _pools_split(service):
+        base = DEFAULT_BASES[service] if tail in PROBE_PATHS else await _pick(service, "short") or POOLS[service]["short"][0]
+        resp = await _proxy(request, base, path)
+        resp.headers["X-DRS-Upstream"] = base
+    else:
+        base, pool, fallback = await _choose(service, await _estimate_size(request, tail))
+        resp = await _proxy(request, base, path)
+        ms = (time.perf_counter() - t0) * 1000.0
+        _pool_hist.setdefault((service, pool), _PoolHistogram()).observe(ms, resp.status_code, fallback)
+        resp.headers["X-DRS-Upstream"] = base
+        resp.headers["X-DRS-Pool"] = pool
+    await _maybe_shadow(request, service, tail, resp)
+    return resp
+
+
+# ---- /analyze fan-out ----
+# One GitHub call per commit: the unified diff is rebuilt from the commit JSON's per-file patches
+# (GitHub omits patches of binary and very large files; those appear as binary changes).
+ANALYZE_TIMEOUT_S = float(os.getenv("GATEWAY_ANALYZE_TIMEOUT_S", str(TIMEOUT_S)))
+
+
+def _unified_diff(files: List[dict]) -> str:
+    parts: List[str] = []
+    for f in files:
+        new = f.get("filename", "")
+        old = f.get("previous_filename", new)
+        parts.append(f"diff --git a/{old} b/{new}")
+        if f.get("status") == "renamed" and old != new:
+            parts += [f"rename from {old}", f"rename to {new}"]
+        patch = f.get("patch")
+        if patch is None:
+            if f.get("status") != "renamed" or f.get("changes"):
+                parts.append(f"Binary files a/{old} and b/{new} differ")
+            continue
+        parts.append("--- /dev/null" if f.get("status") == "added" else f"--- a/{old}")
+        parts.append("+++ /dev/null" if f.get("status") == "removed" else f"+++ b/{new}")
+        parts.append(patch)
+    return "\n".join(parts) + "\n"
+
+
+async def _call_backend(service: str, path: str, payload: dict, size: int, headers: Dict[str, str],
+                        timeout_s: float) -> dict:
+    t0 = time.perf_counter()
+    base, pool, fallback = await _choose(service, size)
+    out: dict = {"upstream": base}
+    if not await _upstream_ready(base):
+        out.update(ok=False, status=503, error="Upstream model is not ready yet")
+        return out
+    client: httpx.AsyncClient = app.state.client
+    try:
+        r = await client.post(f"{base}{path}", json=payload, headers=headers, timeout=timeout_s)
+        out.update(ok=r.status_code == 200, status=r.status_code)
+        if r.status_code == 200:
+            out["result"] = r.json() if service == "seq-cls" else r.text
+        else:
+            try:
+                out["error"] = r.json().get("detail")
+            except ValueError:
+                out["error"] = r.text[:500]
+    except httpx.TimeoutException:
+        out.update(ok=False, status=504, error=f"No answer within {timeout_s:.1f}s")
+    except httpx.HTTPError as e:
+        out.update(ok=False, status=502, error=f"Upstream request failed: {e.__class__.__name__}")
+    out["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    if _pools_split(service):
+        _pool_hist.setdefault((service, pool), _PoolHistogram()).observe(out["ms"], out["status"], fallback)
+    return out
+
+
+@app.post("/analyze")
+async def analyze(request: Request):
+    """
+    Score and explain one commit: {"repo": "owner/name", "sha": "...", "adapter": optional}.
+
+    The commit is fetched from GitHub once and posted to seq-cls and CLM /predict
+    concurrently. Each side reports ok/status/result (or error) on its own; the response is
+    200 with "partial": true when only one side answered, and 502 when neither did.
+    """
+    t0 = time.perf_counter()
+    try:
+        req = await request.json()
+        repo, sha = req["repo"], req["sha"]
+        if not isinstance(repo, str) or "/" not in repo or not isinstance(sha, str):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"detail": "Body must be JSON with repo ('owner/name') and sha"}, status_code=422)
+
+    status, data = await _fetch_commit(repo, sha)
+    github_ms = (time.perf_counter() - t0) * 1000.0
+    if status != 200:
+        if status == 404:
+            return JSONResponse({"detail": "Commit not found (check repo/sha visibility and token)"}, status_code=404)
+        return JSONResponse({"detail": "Failed to fetch commit from GitHub"}, status_code=502)
+    message = data.get("commit", {}).get("message", "")
+    diff = _unified_diff(data.get("files", []))
+    size = _json_size(data)
+
+    # The backends get what is left of min(caller's budget, ANALYZE_TIMEOUT_S) after the GitHub fetch,
+    # and the gateway waits for them exactly that long
+    budget_ms = ANALYZE_TIMEOUT_S * 1000.0
+    try:
+        budget_ms = min(budget_ms, float(request.headers.get(DEADLINE_HEADER, budget_ms)))
+    except ValueError:
+        pass
+    remaining_ms = budget_ms - (time.perf_counter() - t0) * 1000.0
+    if remaining_ms <= 0:
+        return JSONResponse({"detail": "No time left for inference after fetching the commit"}, status_code=504)
+    headers = {DEADLINE_HEADER: str(int(remaining_ms))}
+    payload = {"commit_message": message, "code_diff": diff}
+    seq_payload = {**payload, "adapter": req["adapter"]} if req.get("adapter") else payload
+    seq, clm = await asyncio.gather(
+        _call_backend("seq-cls", "/predict", seq_payload, size, headers, remaining_ms / 1000.0),
+        _call_backend("clm", "/predict", payload, size, headers, remaining_ms / 1000.0),
+    )
+
+    stages = {"github": github_ms, "seq-cls": seq.get("ms", 0.0), "clm": clm.get("ms", 0.0),
+              "total": (time.perf_counter() - t0) * 1000.0}
+    _record_timings("POST /analyze", stages)
+    answered = seq["ok"] + clm["ok"]
+    return JSONResponse(
+        {"repo": repo, "sha": sha, "seq_cls": seq, "clm": clm, "partial": answered == 1},
+        status_code=200 if answered else 502,
+        headers={SERVER_TIMING_HEADER: ", ".join(f"{k};dur={v:.1f}" for k, v in stages.items())},
+    )
+
+
+# ---- Shadow traffic ----
+# A sampled fraction of a service's requests is sent again to a candidate upstream (e.g. a
+# quantized, merged or CPU backend) so it can be judged on real traffic before switching. The copy
+# goes out only after the primary has answered, so it never delays or competes with the client's
+# request; its response is discarded. At most SHADOW_MAX_INFLIGHT copies per service are in flight
+# and requests sampled beyond that are skipped, not queued.
+SHADOW_BASES: Dict[str, Optional[str]] = {
+    "seq-cls": os.getenv("SEQ_SHADOW_BASE", "").rstrip("/") or None,
+    "clm": os.getenv("CLM_SHADOW_BASE", "").rstrip("/") or None,
+}
+SHADOW_SAMPLE = float(os.getenv("GATEWAY_SHADOW_SAMPLE", "0.1"))
+SHADOW_MAX_INFLIGHT = int(os.getenv("GATEWAY_SHADOW_MAX_INFLIGHT", "2"))
+SHADOW_TIMEOUT_S = float(os.getenv("GATEWAY_SHADOW_TIMEOUT_S", str(TIMEOUT_S)))
+SHADOW_PATHS = {p.strip("/ ") for p in os.getenv("GATEWAY_SHADOW_PATHS", "predict,predict_by_sha,predict_batch").split(",")}
+_shadow_inflight: Dict[str, int] = {}
+_shadow_tasks: set = set()
+
+
+class _ShadowStats:
+    """Latency and agreement of the candidate against the primary over the recent window."""
+    def __init__(self, service: str):
+        self.service = service
+        # seq-cls answers are compared by label and confidence, CLM explanations by their text
+        agreement = "label_agree" if service == "seq-cls" else "text_identical"
+        self.counts = dict(mirrored=0, skipped_busy=0, skipped_not_ready=0, errors=0, compared=0, **{agreement: 0})
+        self.by_status: Dict[str, int] = {}
+        self.primary_ms: Deque[float] = deque(maxlen=TIMING_WINDOW)
+        self.shadow_ms: Deque[float] = deque(maxlen=TIMING_WINDOW)
+        self.delta_ms: Deque[float] = deque(maxlen=TIMING_WINDOW)
+        self.confidence_delta: Deque[float] = deque(maxlen=TIMING_WINDOW)
+
+    def compare(self, primary: bytes, shadow: bytes) -> None:
+        if self.service != "seq-cls":
+            self.counts["compared"] += 1
+            self.counts["text_identical"] += primary.strip() == shadow.strip()
+            return
+        try:
+            a, b = json.loads(primary), json.loads(shadow)
+        except ValueError:
+            return
+        # /predict_batch answers a list in request order
+        for p, s in zip(a, b) if isinstance(a, list) and isinstance(b, list) else [(a, b)]:
+            if not (isinstance(p, dict) and isinstance(s, dict) and "label" in p and "label" in s):
+                continue
+            self.counts["compared"] += 1
+            self.counts["label_agree"] += p["label"] == s["label"]
+            if isinstance(p.get("confidence"), (int, float)) and isinstance(s.get("confidence"), (int, float)):
+                self.confidence_delta.append(s["confidence"] - p["confidence"])
+
+    def as_dict(self) -> dict:
+        compared = self.counts["compared"]
+        out = {**self.counts, "status": self.by_status}
+        for name in ("primary_ms", "shadow_ms", "delta_ms"):
+            values = list(getattr(self, name))
+            out[name] = _percentiles(values) if values else None
+        if self.service != "seq-cls":
+            out["text_agreement"] = round(self.counts["text_identical"] / compared, 4) if compared else None
+            return out
+        out["label_agreement"] = round(self.counts["label_agree"] / compared, 4) if compared else None
+        deltas = list(self.confidence_delta)
+        out["confidence_delta"] = {
+            "mean": round(statistics.fmean(deltas), 4),
+            "mean_abs": round(statistics.fmean(abs(d) for d in deltas), 4),
+            "max_abs": round(max(abs(d) for d in deltas), 4),
+        } if deltas else None
+        return out
+
+
+_shadow_stats: Dict[str, _ShadowStats] = {}
+
+
+async def _maybe_shadow(request: Request, service: str, tail: str, resp: Response) -> None:
+    """Mirror this request to the service's shadow upstream if it is sampled and a slot is free."""
+    base = SHADOW_BASES.get(service)
+    if base is None or request.method != "POST" or tail not in SHADOW_PATHS or resp.status_code != 200:
+        return
+    if random.random() >= SHADOW_SAMPLE:
+        return
+    stats = _shadow_stats.setdefault(service, _ShadowStats(service))
+    if _shadow_inflight.get(service, 0) >= SHADOW_MAX_INFLIGHT:
+        stats.counts["skipped_busy"] += 1
+        return
+    _shadow_inflight[service] = _shadow_inflight.get(service, 0) + 1
+    body = await request.body()
+    headers = _forwardable_request_headers(request.headers.items())
+    headers = {k: v for k, v in headers.items() if k.lower() not in (DEADLINE_HEADER.lower(), "content-length")}
+    # Compared with the shadow's bare POST, so the primary's time is its upstream call alone (no
+    # size lookup, readiness probes or proxying)
+    primary_ms = request.state.upstream_ms
+    task = asyncio.create_task(_shadow_call(service, base, tail, request.url.query, body, headers, resp.body, primary_ms))
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+
+async def _shadow_call(service: str, base: str, tail: str, query: str, body: bytes, headers: Dict[str, str],
+                       primary_body: bytes, primary_ms: float) -> None:
+    stats = _shadow_stats[service]
+    try:
+        if not await _upstream_ready(base):
+            stats.counts["skipped_not_ready"] += 1
+            return
+        url = f"{base}/{tail}" + (f"?{query}" if query else "")
+        headers[DEADLINE_HEADER] = str(int(SHADOW_TIMEOUT_S * 1000))
+        client: httpx.AsyncClient = app.state.client
+        t0 = time.perf_counter()
+        try:
+            r = await client.post(url, content=body, headers=headers, timeout=SHADOW_TIMEOUT_S)
+        except httpx.HTTPError:
+            stats.counts["errors"] += 1
+            return
+        shadow_ms = (time.perf_counter() - t0) * 1000.0
+        stats.counts["mirrored"] += 1
+        key = f"{r.status_code // 100}xx"
+        stats.by_status[key] = stats.by_status.get(key, 0) + 1
+        if r.status_code != 200:
+            return
+        stats.primary_ms.append(primary_ms)
+        stats.shadow_ms.append(shadow_ms)
+        stats.delta_ms.append(shadow_ms - primary_ms)
+        stats.compare(primary_body, r.content)
+    finally:
+        _shadow_inflight[service] -= 1
+
+
+@app.get("/debug/shadow")
+async def debug_shadow():
+    """
+    Shadow upstreams and how they compare with the primary on mirrored requests: latency
+    percentiles of the upstream calls alone (delta_ms = shadow - primary), seq-cls label agreement
+    and confidence deltas, CLM identical-text count.
+    """
+    return {
+        "sample": SHADOW_SAMPLE,
+        "max_inflight": SHADOW_MAX_INFLIGHT,
+        "paths": sorted(SHADOW_PATHS),
+        "services": {
+            service: {
+                "base": base,
+                "inflight": _shadow_inflight.get(service, 0),
+                **(_shadow_stats[service].as_dict() if service in _shadow_stats else {}),
+            }
+            for service, base in SHADOW_BASES.items() if base is not None
+        },
+    }
+
+
 # ---- Route groups ----
 
 @app.api_route("/seq-cls", methods=ALL_METHODS)
 async def seq_root(request: Request):
-    resp = await _proxy(request, SEQ_BASE, "")
-    resp.headers["X-DRS-Upstream"] = SEQ_BASE
-    return resp
+    return await _route(request, "seq-cls", "")
 
 @app.api_route("/seq-cls/{path:path}", methods=ALL_METHODS)
 async def seq_proxy(path: str, request: Request):
-    resp = await _proxy(request, SEQ_BASE, path)
-    resp.headers["X-DRS-Upstream"] = SEQ_BASE
-    return resp
+    return await _route(request, "seq-cls", path)
 
 
 @app.api_route("/clm", methods=ALL_METHODS)
 async def clm_root(request: Request):
-    resp = await _proxy(request, CLM_BASE, "")
-    resp.headers["X-DRS-Upstream"] = CLM_BASE
-    return resp
+    return await _route(request, "clm", "")
 
 @app.api_route("/clm/{path:path}", methods=ALL_METHODS)
 async def clm_proxy(path: str, request: Request):
-    resp = await _proxy(request, CLM_BASE, path)
-    resp.headers["X-DRS-Upstream"] = CLM_BASE
-    return resp
+    return await _route(request, "clm", path)
@@ -8,6 +8,16 @@ set -euo pipefail
 : "${PORT:=8080}"
 : "${UVICORN_WORKERS:=1}"         # adjust if you want workers (GPU models often prefer 1)
 
+: "${DRSLLM_WORKERS:=1}"          # >1: core.serve workers sharing one copy of the model
+
+if [ "${DRSLLM_WORKERS}" -gt 1 ]; then
+  echo "Starting core.serve → module=${APP_MODULE} host=${HOST} port=${PORT} workers=${DRSLLM_WORKERS}"
+  exec python -m core.serve "${APP_MODULE}" \
+    --host "${HOST}" \
+    --port "${PORT}" \
+    --workers "${DRSLLM_WORKERS}"
+fi
+
 echo "Starting Uvicorn → module=${APP_MODULE} host=${HOST} port=${PORT} workers=${UVICORN_WORKERS}"
 
 exec uvicorn "${APP_MODULE}" \